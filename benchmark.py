@@ -0,0 +1,401 @@
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import shlex
+import zipfile
+import tarfile
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FIRST_NAMES = ["דנה", "יעל", "משה", "רון", "נועה", "איתי", "מיכל", "עומר", "שירה", "אורי", "תמר", "יונתן", "הילה", "אביב", "ליאור", "גיל",
+               "מאיה", "עידו", "רותם", "נדב"]
+LAST_NAMES = ["כהן", "לוי", "מזרחי", "פרץ", "ביטון", "דהן", "אברהם", "פרידמן", "אזולאי", "שפירא", "גולן", "ברק", "שמעוני", "קליין",
+              "רוזן", "טל", "אשכנזי", "חדד", "סויסה", "בן דוד"]
+HEBREW_LETTERS = "אבגדהוזחטיכלמנסעפצקרשת"  # Middle initials once the first/last name pairs run out; digits would be cleaned away
+FORK_ROUNDS = 5  # 2^5 processes at most, the RLIMIT_NPROC the program sets does not bind root
+
+# ------------------------------------------------------------------ #
+# Sources of a correct ex4 submission, every behaviour replaces one of them
+
+CORRECT_SOURCES = {
+    "ex4a1.c": r"""#include <stdio.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/stat.h>
+int main(int argc, char *argv[]) {
+    char buf[64];
+    int fd, i, n;
+    if (argc < 4) return 1;
+    mkfifo(argv[1], 0666);
+    /* Opened for writing too, so a read waits for the second client instead of hitting EOF after the first */
+    fd = open(argv[1], O_RDWR);
+    for (i = 0; i < 2; i++) {
+        n = read(fd, buf, 1);  /* One ID per client, two writes may arrive together */
+        if (n <= 0) break;
+        buf[n] = '\0';
+        printf("got: %s\n", buf);
+    }
+    close(fd);
+    unlink(argv[1]);
+    return 0;
+}
+""",
+    "ex4a2.c": r"""#include <stdio.h>
+#include <string.h>
+#include <fcntl.h>
+#include <unistd.h>
+int main(int argc, char *argv[]) {
+    int fd;
+    if (argc < 3) return 1;
+    fd = open(argv[1], O_WRONLY);
+    if (write(fd, argv[2], strlen(argv[2])) < 0) return 1;
+    close(fd);
+    printf("sent %s\n", argv[2]);
+    return 0;
+}
+""",
+    "ex4b1.c": r"""#include <stdio.h>
+#include <sys/ipc.h>
+#include <sys/msg.h>
+struct m { long t; int v; };
+int main(void) {
+    struct m msg;
+    int i, q = msgget(ftok(".", 'b'), IPC_CREAT | 0600);
+    for (i = 0; i < 2; i++) {
+        msgrcv(q, &msg, sizeof(int), 0, 0);
+        printf("got %d\n", msg.v);
+    }
+    msgctl(q, IPC_RMID, NULL);
+    return 0;
+}
+""",
+    "ex4b2.c": r"""#include <stdio.h>
+#include <stdlib.h>
+#include <sys/ipc.h>
+#include <sys/msg.h>
+struct m { long t; int v; };
+int main(int argc, char *argv[]) {
+    struct m msg = {1, 0};
+    int q = msgget(ftok(".", 'b'), 0);
+    if (argc > 1) msg.v = atoi(argv[1]);
+    msgsnd(q, &msg, sizeof(int), 0);
+    printf("sent %d\n", msg.v);
+    return 0;
+}
+""",
+    "ex4c1.c": r"""#include <stdio.h>
+#include <sys/ipc.h>
+#include <sys/msg.h>
+int main(void) {
+    int q = msgget(ftok(".", 'c'), IPC_CREAT | 0600);
+    printf("c1 %d\n", q >= 0);
+    msgctl(q, IPC_RMID, NULL);
+    return 0;
+}
+""",
+    "ex4c2.c": r"""#include <stdio.h>
+#include <sys/ipc.h>
+#include <sys/msg.h>
+int main(void) {
+    int q = msgget(ftok(".", 'd'), IPC_CREAT | 0600);
+    printf("c2 %d\n", q >= 0);
+    msgctl(q, IPC_RMID, NULL);
+    return 0;
+}
+""",
+    "ex4c3.c": r"""#include <stdio.h>
+int is_prime(int n) {
+    int d;
+    if (n < 2) return 0;
+    for (d = 2; d * d <= n; d++)
+        if (n % d == 0) return 0;
+    return 1;
+}
+int is_palindrome(int n) {
+    int reversed = 0, rest = n;
+    while (rest > 0) {
+        reversed = reversed * 10 + rest % 10;
+        rest /= 10;
+    }
+    return reversed == n;
+}
+int main(void) {
+    char c;
+    int n;
+    while (scanf(" %c", &c) == 1) {
+        if (c == 'p') {
+            while (scanf("%d", &n) == 1 && n != 0)
+                if (is_prime(n))
+                    printf("%d is prime\n", n);
+        } else if (c == 'q') {
+            if (scanf("%d", &n) == 1)
+                printf("%d palindrome: %s\n", n, is_palindrome(n) ? "yes" : "no");
+            break;
+        }
+    }
+    return 0;
+}
+""",
+}
+
+BEHAVIOUR_SOURCES = {
+    "correct": {},
+    "compile_error": {"ex4b2.c": CORRECT_SOURCES["ex4b2.c"].replace("printf(\"sent %d\\n\", msg.v);", "printf(\"sent %d\\n\", msg.v)")},
+    "warnings": {"ex4a2.c": CORRECT_SOURCES["ex4a2.c"].replace("    int fd;\n", "    int fd, unused;\n")},
+    "leak": {"ex4c2.c": CORRECT_SOURCES["ex4c2.c"].replace("#include <stdio.h>\n", "#include <stdio.h>\n#include <stdlib.h>\n")
+                                                   .replace("    printf(\"c2", "    char *buffer = malloc(64);\n    buffer[0] = 0;\n    printf(\"c2")},
+    # The reader waits for a writer on fifo1 that never comes, the writers wait for a reader on fifom
+    "fifo_deadlock": {"ex4a1.c": r"""#include <stdio.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/stat.h>
+int main(int argc, char *argv[]) {
+    char buf[64];
+    int fd;
+    if (argc < 4) return 1;
+    mkfifo(argv[1], 0666);
+    mkfifo(argv[2], 0666);
+    fd = open(argv[2], O_RDONLY);
+    if (read(fd, buf, sizeof(buf)) > 0) printf("got: %s\n", buf);
+    return 0;
+}
+"""},
+    "infinite_output": {"ex4c3.c": r"""#include <stdio.h>
+int main(void) {
+    long n = 0;
+    for (;;)
+        printf("line %ld of a program that never stops printing\n", n++);
+}
+"""},
+    "fork_bomb": {"ex4c1.c": r"""#include <stdio.h>
+#include <unistd.h>
+#include <sys/ipc.h>
+#include <sys/msg.h>
+#include <sys/resource.h>
+int main(void) {
+    struct rlimit limit = {64, 64};
+    pid_t parent = getpid();
+    int i, q = msgget(ftok(".", 'c'), IPC_CREAT | 0600);
+    setrlimit(RLIMIT_NPROC, &limit);
+    for (i = 0; i < %d; i++)
+        if (fork() < 0)
+            break;
+    if (getpid() != parent)
+        for (;;)
+            pause();
+    printf("c1 %%d\n", q >= 0);
+    msgctl(q, IPC_RMID, NULL);
+    return 0;
+}
+""" % FORK_ROUNDS},
+}
+
+# Relative frequency of every behaviour and upload format in a generated class
+BEHAVIOUR_WEIGHTS = {"correct": 4, "compile_error": 1, "warnings": 1, "leak": 1, "fifo_deadlock": 1, "infinite_output": 1, "fork_bomb": 1}
+ARCHIVE_WEIGHTS = {"zip": 3, "tgz": 2, "nested": 1, "files": 1}
+
+# ------------------------------------------------------------------ #
+
+def student_names(count, rng):
+    # count distinct Hebrew names, in random order
+    pairs = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    rng.shuffle(pairs)
+    names = []
+    for index in range(count):
+        name = pairs[index % len(pairs)]
+        rounds = index // len(pairs)
+        if rounds:
+            first, last = name.split(" ", 1)
+            name = f"{first} {HEBREW_LETTERS[(rounds - 1) % len(HEBREW_LETTERS)] * ((rounds - 1) // len(HEBREW_LETTERS) + 1)}. {last}"
+        names.append(name)
+    return names
+
+def write_submission(student_path, name, behaviour, archive):
+    # Writes one student's sources as the given upload format
+    files = dict(CORRECT_SOURCES, **BEHAVIOUR_SOURCES[behaviour])
+    files["README.txt"] = f"{name}\nex4 submission\n"
+    if archive == "files":
+        for file_name, content in files.items():
+            with open(os.path.join(student_path, file_name), 'w') as f:
+                f.write(content)
+        return
+    prefix = "ex4/" if archive == "nested" else ""  # Everything inside one folder, extract.py moves it up
+    if archive == "tgz":
+        with tarfile.open(os.path.join(student_path, "ex4.tgz"), 'w:gz') as tar:
+            for file_name, content in files.items():
+                data = content.encode()
+                info = tarfile.TarInfo(prefix + file_name)
+                info.size = len(data)
+                info.mtime = time.time()
+                tar.addfile(info, fileobj=io.BytesIO(data))
+        return
+    with zipfile.ZipFile(os.path.join(student_path, "ex4.zip"), 'w', zipfile.ZIP_DEFLATED) as archive_file:
+        for file_name, content in files.items():
+            archive_file.writestr(prefix + file_name, content)
+
+def generate_corpus(corpus_dir, count, seed=0, behaviours=None):
+    """Writes a class of count student folders into corpus_dir, returns what each one got.
+
+    Folders are named like the Moodle download (name, submission id,
+    _assignsubmission_file_) so clean.py has something to do. The same seed
+    always gives the same class.
+    """
+    rng = random.Random(seed)
+    weights = {name: weight for name, weight in BEHAVIOUR_WEIGHTS.items() if behaviours is None or name in behaviours}
+    # Shuffled once and cycled, so a class at least as big as a pool has every behaviour and format in it
+    behaviour_pool = [name for name, weight in weights.items() for _ in range(weight)]
+    archive_pool = [name for name, weight in ARCHIVE_WEIGHTS.items() for _ in range(weight)]
+    rng.shuffle(behaviour_pool)
+    rng.shuffle(archive_pool)
+    students = []
+    for index, name in enumerate(student_names(count, rng)):
+        behaviour = behaviour_pool[index % len(behaviour_pool)]
+        archive = archive_pool[index % len(archive_pool)]
+        folder = f"{name}_{100000 + index}_assignsubmission_file_"
+        student_path = os.path.join(corpus_dir, folder)
+        os.makedirs(student_path)
+        write_submission(student_path, name, behaviour, archive)
+        students.append({"folder": folder, "behaviour": behaviour, "archive": archive})
+    return students
+
+# ------------------------------------------------------------------ #
+
+def run_phase(command, cwd, log_path):
+    """Runs one phase to completion, returns its wall time, CPU time and peak RSS.
+
+    CPU and peak RSS come from wait4 on the phase's process, so they include
+    every child it waited for (gcc, valgrind, the student programs).
+    """
+    start = time.time()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return {
+        "command": [os.path.basename(part) if part.startswith(REPO_DIR) else part for part in command[1:]],
+        "returncode": process.returncode,
+        "wall_seconds": round(time.time() - start, 3),
+        "user_seconds": round(usage.ru_utime, 3),
+        "system_seconds": round(usage.ru_stime, 3),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+
+def read_statistics(log_path):
+    # The "----- Statistics Summary -----" block of a check.py or pipeline.py log as {label: value}
+    statistics = {}
+    with open(log_path, errors='replace') as f:
+        lines = f.read().splitlines()
+    if "----- Statistics Summary -----" not in lines:
+        return statistics
+    for line in lines[lines.index("----- Statistics Summary -----") + 1:]:
+        if ":" not in line:
+            break
+        label, value = line.split(":", 1)
+        statistics[label.strip()] = value.strip()
+    return statistics
+
+def run_flow(corpus_dir, run_dir, runner, memcheck, check_args):
+    # Grades a fresh copy of the corpus, returns {phase: measurements} and the grader's statistics
+    shutil.copytree(corpus_dir, run_dir)
+    cache_dir = run_dir + "_cache"  # Cold compile cache for every run, so runs are comparable
+    grader_args = ["--memcheck", memcheck, "--compile-cache", cache_dir] + check_args
+    if runner == "pipeline":
+        steps = [("pipeline", [sys.executable, os.path.join(REPO_DIR, "pipeline.py")] + grader_args)]
+    else:
+        steps = [("clean", [sys.executable, os.path.join(REPO_DIR, "clean.py")]),
+                 ("extract", [sys.executable, os.path.join(REPO_DIR, "extract.py")]),
+                 ("check", [sys.executable, os.path.join(REPO_DIR, "check.py")] + grader_args)]
+    phases = {}
+    for name, command in steps:
+        print(f"[{memcheck}] {name} ...", flush=True)
+        phases[name] = run_phase(command, run_dir, f"{run_dir}_{name}.log")
+        print(f"[{memcheck}] {name}: {phases[name]['wall_seconds']:.2f}s wall, "
+              f"{phases[name]['user_seconds'] + phases[name]['system_seconds']:.2f}s CPU, {phases[name]['peak_rss_mb']} MB peak RSS", flush=True)
+    statistics = read_statistics(f"{run_dir}_{steps[-1][0]}.log")
+    return phases, statistics
+
+def compare(previous, current):
+    # Prints the change of every phase measurement between two result files
+    print(f"\n----- Compared with {previous.get('started_at', 'previous run')} -----")
+    for memcheck, run in current["runs"].items():
+        old_run = previous.get("runs", {}).get(memcheck)
+        if old_run is None:
+            print(f"[{memcheck}] not in the previous results")
+            continue
+        for phase, measurements in run["phases"].items():
+            old = old_run["phases"].get(phase)
+            if old is None:
+                continue
+            changes = []
+            for key in ("wall_seconds", "user_seconds", "system_seconds", "peak_rss_mb"):
+                change = (measurements[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                changes.append(f"{key} {old[key]} -> {measurements[key]} ({change:+.1f}%)")
+            print(f"[{memcheck}] {phase}: " + ", ".join(changes))
+    if previous.get("students") != current["students"] or previous.get("seed") != current["seed"]:
+        print("Warning: the runs graded different corpora (students or seed differ)")
+
+# ------------------------------------------------------------------ #
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic ex4 class and time the clean -> extract -> check flow on it.")
+    parser.add_argument("-n", "--students", type=int, default=50, help="number of student folders to generate (default: 50)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated class, the same seed gives the same class (default: 0)")
+    parser.add_argument("--behaviours", nargs="+", choices=sorted(BEHAVIOUR_WEIGHTS), help="only generate these behaviours (default: all)")
+    parser.add_argument("--memcheck", nargs="+", choices=["valgrind", "asan"], default=["valgrind"],
+                        help="grade the class once per leak checker (default: valgrind)")
+    parser.add_argument("--runner", choices=["scripts", "pipeline"], default="scripts",
+                        help="clean.py, extract.py and check.py one after the other, or pipeline.py (default: scripts)")
+    parser.add_argument("--check-args", default="", help="extra options for check.py/pipeline.py, e.g. \"--jobs 4\"")
+    parser.add_argument("--work-dir", help="where the class is generated and graded (default: a new temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory for a look at the logs")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON file the results are written to (default: %(default)s)")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="ex4_benchmark_")
+    corpus_dir = os.path.join(work_dir, "corpus")
+    os.makedirs(corpus_dir)
+    students = generate_corpus(corpus_dir, args.students, args.seed, args.behaviours)
+    print(f"Generated {len(students)} students in {corpus_dir}")
+
+    results = {
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "students": args.students,
+        "seed": args.seed,
+        "runner": args.runner,
+        "check_args": args.check_args,
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "behaviours": {name: sum(1 for student in students if student["behaviour"] == name) for name in BEHAVIOUR_WEIGHTS},
+        "archives": {name: sum(1 for student in students if student["archive"] == name) for name in ARCHIVE_WEIGHTS},
+        "runs": {},
+    }
+    for memcheck in args.memcheck:
+        phases, statistics = run_flow(corpus_dir, os.path.join(work_dir, f"run_{memcheck}"), args.runner, memcheck, shlex.split(args.check_args))
+        results["runs"][memcheck] = {
+            "phases": phases,
+            "total_wall_seconds": round(sum(phase["wall_seconds"] for phase in phases.values()), 3),
+            "statistics": statistics,
+        }
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Results have been written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    if args.keep:
+        print(f"Work directory kept at {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import locale
+import hashlib
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# ------------------------------------------------------------------ #
+
+class BoundedBuffer:
+    """Keeps the first head_limit and the last tail_limit bytes of a stream.
+
+    The head is appended to until it is full, after that incoming bytes go to a
+    preallocated ring buffer, so a program that never stops printing costs a
+    fixed amount of memory and only memory copies, no string concatenation.
+    """
+
+    def __init__(self, head_limit, tail_limit):
+        self.head_limit = head_limit
+        self.tail_limit = tail_limit
+        self.head = bytearray()
+        self.ring = None  # Allocated the first time the head overflows
+        self.ring_pos = 0
+        self.ring_len = 0
+        self.total = 0
+
+    @property
+    def truncated(self):
+        return self.total > self.head_limit + self.tail_limit
+
+    def write(self, data):
+        self.total += len(data)
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if not data or self.tail_limit <= 0:
+            return
+        if self.ring is None:
+            self.ring = bytearray(self.tail_limit)
+        if len(data) >= self.tail_limit:
+            self.ring[:] = data[-self.tail_limit:]
+            self.ring_pos = 0
+            self.ring_len = self.tail_limit
+            return
+        first = min(len(data), self.tail_limit - self.ring_pos)
+        self.ring[self.ring_pos:self.ring_pos + first] = data[:first]
+        self.ring[:len(data) - first] = data[first:]
+        self.ring_pos = (self.ring_pos + len(data)) % self.tail_limit
+        self.ring_len = min(self.tail_limit, self.ring_len + len(data))
+
+    def tail(self):
+        if not self.ring_len:
+            return b''
+        if self.ring_len < self.tail_limit:
+            return bytes(self.ring[:self.ring_len])
+        return bytes(self.ring[self.ring_pos:] + self.ring[:self.ring_pos])
+
+    def getvalue(self):
+        if not self.truncated:
+            return bytes(self.head) + self.tail()
+        omitted = self.total - len(self.head) - self.ring_len
+        return bytes(self.head) + f"\n... [{omitted} bytes omitted] ...\n".encode() + self.tail()
+
+def decode_output(data):
+    # Same result as the old universal_newlines pipes, but decoded once at the end
+    text = data.decode(locale.getpreferredencoding(False), errors='replace')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+# ------------------------------------------------------------------ #
+
+HEAD_LINES = 20
+TAIL_LINES = 5
+
+class StreamCapture:
+    """Everything kept of one stdout/stderr stream while it is being read.
+
+    The first and last bytes go to a BoundedBuffer; the whole stream goes
+    through a sha256 and the line/byte counters and, once spill_path is set,
+    to a file on disk. summary() turns it into the compact OutputSummary.
+    """
+
+    def __init__(self, head_limit, tail_limit):
+        self.buffer = BoundedBuffer(head_limit, tail_limit)
+        self.digest = hashlib.sha256()
+        self.newlines = 0
+        self.ends_with_newline = True
+        self.spill_path = None  # Set by the owner when the full stream should be kept on disk
+        self.spill_file = None
+        self.spilled = False
+        self.checker = None  # An output_check.OutputChecker fed with every chunk, when the step has expected output
+
+    @property
+    def total(self):
+        return self.buffer.total
+
+    def write(self, data):
+        data = bytes(data)
+        self.buffer.write(data)
+        self.digest.update(data)
+        self.newlines += data.count(b'\n')
+        self.ends_with_newline = data.endswith(b'\n')
+        if self.checker is not None:
+            self.checker.feed(data)
+        if self.spill_path:
+            if self.spill_file is None:
+                self.spill_file = open(self.spill_path, 'wb')
+                self.spilled = True
+            self.spill_file.write(data)
+
+    def close(self):
+        if self.checker is not None:
+            self.checker.finish()
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+    def summary(self):
+        lines = self.newlines + (0 if self.ends_with_newline else 1)
+        if not self.buffer.truncated:
+            text_lines = decode_output(self.buffer.getvalue()).splitlines()
+            head, tail = text_lines[:HEAD_LINES], text_lines[HEAD_LINES:][-TAIL_LINES:]
+        else:
+            head = decode_output(bytes(self.buffer.head)).splitlines()[:HEAD_LINES]
+            tail = decode_output(self.buffer.tail()).splitlines()[1:][-TAIL_LINES:]  # The first tail line is cut
+        return OutputSummary(head, tail, lines, self.total, self.digest.hexdigest(), self.spill_path if self.spilled else None)
+
+class OutputSummary:
+    """What is kept of a program's output after its group finished.
+
+    The first and last lines, the line and byte counts and the sha256 of the
+    full stream; spill_path points at the full output when it was kept.
+    """
+
+    __slots__ = ("head", "tail", "lines", "bytes", "sha256", "spill_path")
+
+    def __init__(self, head, tail, lines, byte_count, sha256, spill_path=None):
+        self.head = head
+        self.tail = tail
+        self.lines = lines
+        self.bytes = byte_count
+        self.sha256 = sha256
+        self.spill_path = spill_path
+
+    @classmethod
+    def from_text(cls, text):
+        capture = StreamCapture(len(text.encode()), 0)
+        capture.write(text.encode())
+        return capture.summary()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["head"], data["tail"], data["lines"], data["bytes"], data["sha256"], data.get("spill_path"))
+
+    def __str__(self):
+        omitted = self.lines - len(self.head) - len(self.tail)
+        text = "\n".join(self.head)
+        if omitted > 0:
+            text += f"\n... [{omitted} lines omitted] ..."
+        if self.tail:
+            text += "\n" + "\n".join(self.tail)
+        return text
@@ -2,146 +2,118 @@ import os
 import subprocess
 import re
 import signal
-import threading
-from summarize import do_summarize, display_statistics
-import time
+import functools
+from summarize import do_summarize, display_statistics, student_totals
 import logging
 import sys
 import resource
-import select
+import shutil
+import tempfile
+import argparse
+import json
+import glob
+import threading
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from supervisor import GroupSupervisor, ProcessSpec, POLL_INTERVAL
+from capture import OutputSummary
+from compile_cache import CompileCache, default_cache_dir
+from memcheck import LeakReport, ValgrindXmlParser, valgrind_command, SANITIZER_FLAGS, sanitizer_options, parse_sanitizer_log
+from results_store import ResultsStore, input_hash
+from testplan import DEFAULT_PLAN, MSGQUEUE_RESOURCE, load_plan, run_plan
+from tracing import tracer, traced
+from output_check import OutputChecker
+from similarity import DEFAULT_THRESHOLD, find_clusters, format_clusters
+from work_queue import WorkQueue, LEASE_SECONDS
+from timeouts import load_policy, save_samples
+from procfs import MsgQueueScope, fifos_exist, waits_on_msgqueue, sweep_sessions
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
 
 
-# Handle SIGTERM and SIGINT signals
+# Handle SIGTERM and SIGINT signals: students being graded finish and are saved, the rest are left for --resume
+stop_requested = threading.Event()
+
 def signal_handler(signum, frame):
     logging.info(f"Received signal: {signum}")
+    stop_requested.set()
 
 signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
 
-def set_limits():
-    # Limit CPU time to 30 seconds
-    resource.setrlimit(resource.RLIMIT_CPU, (30, 30))
-    # Limit maximum memory size to 256 MB
-    resource.setrlimit(resource.RLIMIT_AS, (256*1024*1024, 256*1024*1024))
-# ------------------------------------------------------------------ #
-def run_process_with_timeout_valgrind(command, exe_file, timeout_duration):
-    try:
-        max_output_lines = 5
-        process = subprocess.Popen(command, preexec_fn=set_limits, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True, start_new_session=True)
-        logging.info(f"Before valgrind process.communicate Running {exe_file} with PID: {process.pid}")
-        
-        stdout,stderr = process.communicate(timeout=timeout_duration)
-       
-        logging.info(f"After valgrind process.communicate Running {exe_file} with PID: {process.pid}")
-        logging.info(f"stdout: {stdout}")
-        logging.info(f"stderr: {stderr}")
-        return stdout, stderr, None  # No error
-    except subprocess.TimeoutExpired:
-        logging.warning(f"Timeout expired running {exe_file}, attempting to terminate with SIGINT...")
-        process.send_signal(signal.SIGINT)  # Send SIGINT to the process
-
-        try:
-            # Wait for the process to terminate after SIGINT
-            stdout, stderr = process.communicate(timeout=2)
-        except subprocess.TimeoutExpired:
-            logging.warning("Process did not terminate after SIGINT, attempting to send '0'...")
-            process.terminate()
-        return stdout, stderr, "Execution timed out."
-    except Exception as e:
-        logging.exception(f"Error running {exe_file}")
-        return None, None, str(e)
-
-def run_process_with_timeout(command, exe_file, timeout_duration, input_data=None, max_output_bytes=1024*1024):
-    process = None
-    try:
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE, universal_newlines=True, start_new_session=True)
-        logging.info(f"Starting {exe_file} with PID: {process.pid}")
-
-        start_time = time.time()
-        stdout, stderr = '', ''
-        while True:
-            # Check if the timeout has been exceeded
-            if time.time() - start_time > timeout_duration:
-                logging.warning(f"Timeout expired running {exe_file}, attempting to terminate...")
-              
-                raise subprocess.TimeoutExpired(process.args, timeout_duration)
-
-            # Use select to wait for output to be available
-            readable, _, _ = select.select([process.stdout, process.stderr], [], [], 0.1)
-            if readable:
-               #logging.debug(f"readable: select.select {readable}")
-            # Read available output
-            
-                for output in readable:
-                    if output == process.stdout:
-                        chunk = process.stdout.read(1024)
-                        stdout += chunk
-                    elif output == process.stderr:
-                        chunk = process.stderr.read(1024)
-                        stderr += chunk
-
-                # Check if both stdout and stderr have reached the output limit
-                if len(stdout) + len(stderr) >= max_output_bytes:
-                    logging.warning("Maximum output size reached. Further output will be discarded.")
-                    break
-
-            # Check if the process has terminated
-            if process.poll() is not None:
-                break
-
-        logging.info(f"Completed {exe_file} with PID: {process.pid}")
-        logging.info(f"stdout: {stdout[:10]}")  # Log only the first 1000 characters
-        logging.info(f"stderr: {stderr[:50]}")
-
-        return stdout, stderr, None
-
-    except subprocess.TimeoutExpired:
-        logging.warning(f"Timeout expired running {exe_file}, attempting to terminate...")
-        process.kill()
-        process.wait()
-        logging.info(f"Terminated {exe_file} due to timeout.")
-
-        return stdout, stderr, "Execution timed out."
-
-    except Exception as e:
-        logging.exception(f"Error running {exe_file}")
-        if process:
-            process.kill()
-            process.wait()
-        return None, None, str(e)
-
-    finally:
-        if process:
-            process.stdout.close()
-            process.stderr.close()
-
-
-def remove_all_msg_queues():
-    try:
-        # Command to list and remove all message queues
-        cmd = "ipcs -q | awk '/0x/ {print $2}' | xargs -n 1 ipcrm -q"
-        subprocess.run(cmd, shell=True, check=True)
-        logging.info("Successfully removed all message queues")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to remove message queues: {e}")
+COMPILE_FLAGS = ["-Wall", "-g"]
+VALGRIND_TIMEOUT = 30
+PROGRAM_TIMEOUT = 120
+RUBRIC_VERSION = 3  # Bump whenever grading rules change, so --incremental grades everyone again
+STORED_FIELDS = ["compilation_errors", "warning_messages", "catched_errors", "output", "grade", "extraction_penalty",
+                 "readme_content", "source_headers", "test_results", "orphans_reaped", "orphan_cpu_time", "output_checks",
+                 "timeout_hits"]
+# Options a worker takes from its coordinator, so every student of a run is graded alike
+SHARED_OPTIONS = ["memcheck", "plan", "rlimit_cpu", "rlimit_as", "deadlock_window", "spill_dir", "results_db", "adaptive_timeouts"]
+SHARED_PATHS = ["plan", "spill_dir", "results_db"]  # Sent relative to the class directory, which every worker runs in
+QUEUE_POLL_INTERVAL = 2  # Seconds between looks at the work queue while waiting
+QUEUE_STATES = ["pending", "leased", "done", "failed"]
+
+def set_limits(cpu_seconds=30, memory_mb=256):
+    # Runs in the child before exec; 0 leaves a limit unset
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    if memory_mb:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_mb*1024*1024, memory_mb*1024*1024))
 
 # ------------------------------------------------------------------ #
 
 class Student:
-    def __init__(self, student_dir):
+    # Hundreds of these are alive while a batch is compiled, so no per-instance __dict__
+    __slots__ = ("student_dir", "options", "compile_cache", "leak_check_pool", "plan", "student_path", "lock", "work_dir", "spill_dir",
+                 "compilation_errors", "warning_messages", "test_results", "grade", "extraction_penalty", "file_hashes", "source_hash",
+                 "catched_errors", "memory_leaks", "readme_content", "output", "source_headers", "orphans_reaped", "orphan_cpu_time",
+                 "sanitizer_reports", "output_checks", "timeout_policy", "timeout_hits")
+
+    def __init__(self, student_dir, options=None, compile_cache=None, leak_check_pool=None, timeout_policy=None):
         self.student_dir = student_dir
+        self.options = options if options is not None else parse_args([])  # Command line settings
+        self.compile_cache = compile_cache
+        self.leak_check_pool = leak_check_pool  # Shared executor for valgrind runs, None runs them one by one
+        self.timeout_policy = timeout_policy  # Shared timeouts.TimeoutPolicy, None keeps the fixed budgets and records nothing
+        self.plan = load_plan(self.options.plan)  # Sources to compile and test groups to run
+        self.student_path = os.path.abspath(student_dir)
+        self.lock = threading.Lock()  # For counters updated from the test group and valgrind threads
+        self.work_dir = None  # Scratch cwd for the student's programs, holds the FIFOs
+        self.spill_dir = None  # Where the full stdout/stderr of every run goes with --spill-dir
         self.compilation_errors = []
         self.warning_messages = []
         self.test_results = []
         self.grade = 100  # Starting grade, adjust based on errors and warnings
-        self.extraction_penalty = 0  # Adjust based on extraction summary log
+        self.extraction_penalty = 0  # Adjust based on the extraction manifest
+        self.file_hashes = {}  # Relative path -> sha256 of the files extract.py left, from the manifest
+        self.source_hash = None  # Hash of the sources and settings the grade depends on, see results_store.input_hash
         self.catched_errors = []
         self.memory_leaks = []
         self.readme_content = self.read_readme()
-        self.output = []
+        self.output = []  # (program label, OutputSummary) for every run that printed something
         self.source_headers = {}
+        self.orphans_reaped = 0  # Leftover processes killed after the student's programs finished
+        self.orphan_cpu_time = 0.0
+        self.sanitizer_reports = {}  # exe_file -> LeakReport filled from the AddressSanitizer logs of its runs
+        self.output_checks = []  # Verdict of every run whose plan step has expected output
+        self.timeout_hits = []  # Runs stopped by an adaptive budget shorter than the fixed one
+
+    def to_dict(self):
+        # The graded fields, as stored in the results store
+        data = {field: getattr(self, field) for field in STORED_FIELDS}
+        data["output"] = [(program, output.to_dict()) for program, output in self.output]
+        data["memory_leaks"] = [report.to_dict() for report in self.memory_leaks]
+        return data
+
+    def load_dict(self, data):
+        for field in STORED_FIELDS:
+            if field in data:  # Rows written before a field existed keep its default
+                setattr(self, field, data[field])
+        # Rows stored before outputs were summarized hold the whole text
+        self.output = [(program, OutputSummary.from_text(output) if isinstance(output, str) else OutputSummary.from_dict(output))
+                       for program, output in self.output]
+        self.memory_leaks = [LeakReport.from_dict(report) for report in data["memory_leaks"]]
 
     def read_readme(self):
         readme_files = [file for file in os.listdir(self.student_dir) if file.lower().startswith('readme')]
@@ -160,10 +132,29 @@ class Student:
                 readme_content.append(f"Error reading README: {str(e)}")
         return readme_content
 
-    def compile_single_program(self, source_file, exe_file):
-        compile_result = subprocess.run(["gcc", "-Wall", "-g", source_file, "-o", exe_file], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    @traced("gcc", describe=lambda source_file, exe_file, flags=COMPILE_FLAGS: {"source": os.path.basename(source_file), "flags": " ".join(flags)})
+    def compile_single_program(self, source_file, exe_file, flags=COMPILE_FLAGS):
+        if self.compile_cache:
+            return self.compile_cache.compile(source_file, exe_file, flags)
+        compile_result = subprocess.run(["gcc"] + flags + [source_file, "-o", exe_file], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
         return compile_result
 
+    def sanitizer_exe(self, exe_file):
+        # The AddressSanitizer build lives next to the graded one, which stays a plain build
+        return os.path.join(os.path.dirname(exe_file), ".asan", os.path.basename(exe_file))
+
+    def compile_sanitizer_build(self, source_file, exe_file):
+        os.makedirs(os.path.dirname(self.sanitizer_exe(exe_file)), exist_ok=True)
+        return self.compile_single_program(source_file, self.sanitizer_exe(exe_file), COMPILE_FLAGS + SANITIZER_FLAGS)
+
+    def record_sanitizer_build(self, source, exe_file, compile_result):
+        # Not graded: the plain build already reported errors and warnings, a failed
+        # sanitizer build only means the plain binary runs and gets no leak report
+        if compile_result.returncode != 0:
+            logging.warning(f"AddressSanitizer build failed for {source}: {compile_result.stderr}")
+            if os.path.exists(self.sanitizer_exe(exe_file)):
+                os.remove(self.sanitizer_exe(exe_file))
+
     def handle_compilation_result(self, compile_result, program):
         if compile_result.returncode != 0:
             self.compilation_errors.append(compile_result.stderr)
@@ -174,117 +165,268 @@ class Student:
             logging.warning(f"Warnings for {program}: {compile_result.stderr}")
             self.grade -= 7  # Deduct points for warnings
 
-    def compile_program(self, program):
-        program_sources = {
-            "ex4a1": ["ex4a1.c"],
-            "ex4a2": ["ex4a2.c"],
-            "ex4b1": ["ex4b1.c", "ex4b2.c"],
-            "ex4c1": ["ex4c1.c", "ex4c2.c", "ex4c3.c"],
-        }
-        try:
-            for source in program_sources.get(program, []):
-                source_file = os.path.join(self.student_dir, source)
-                exe_file = os.path.join(self.student_dir, source.replace(".c", ""))
-                if os.path.exists(source_file):
-                    compile_result = self.compile_single_program(source_file, exe_file)
-                    self.handle_compilation_result(compile_result, source)
-                else:
-                    self.compilation_errors.append(f"Source file {source}.c not found.")
-                    logging.error(f"Source file {source}.c not found.")
-                    self.grade -= 5  # Deduct points for missing file
-                logging.info(f"Compilation completed for {source}")
-                self.valgrind_check(exe_file)
-        except Exception as e:
-            logging.exception(f"Error compiling {program}")
+    def compile_jobs(self):
+        # (source, source_file, exe_file) for every source, in grading order
+        jobs = []
+        for program, sources in self.plan.sources.items():
+            for source in sources:
+                jobs.append((source, os.path.join(self.student_dir, source), os.path.join(self.student_dir, source.replace(".c", ""))))
+        return jobs
+
+    def record_compilation(self, source, compile_result):
+        # compile_result is None when the source file is missing
+        if compile_result is not None:
+            self.handle_compilation_result(compile_result, source)
+        else:
+            self.compilation_errors.append(f"Source file {source}.c not found.")
+            logging.error(f"Source file {source}.c not found.")
+            self.grade -= 5  # Deduct points for missing file
+        logging.info(f"Compilation completed for {source}")
+
+    def limits(self, sanitizer=False):
+        # preexec_fn applying the --rlimit-* settings; AddressSanitizer reserves terabytes
+        # of address space for its shadow memory, so its builds get no RLIMIT_AS
+        return functools.partial(set_limits, self.options.rlimit_cpu, 0 if sanitizer else self.options.rlimit_as)
+
+    def valgrind_check_all(self):
+        exe_files = [exe_file for source, source_file, exe_file in self.compile_jobs()]
+        if self.leak_check_pool:
+            reports = list(self.leak_check_pool.map(self.valgrind_check, exe_files))
+        else:
+            reports = [self.valgrind_check(exe_file) for exe_file in exe_files]
+        # Recorded in compile order whatever order the checks finished in
+        for report in reports:
+            if report.status == "leaks":
+                self.grade -= 10
+            logging.info(f"Valgrind result for {report.exe_file}: {report}")
+            self.memory_leaks.append(report)
 
+    @traced("valgrind", nested=True, describe=lambda exe_file: {"exe": os.path.basename(exe_file)})
     def valgrind_check(self, exe_file):
+        report = LeakReport(exe_file)
+        work_dir = None
         try:
             logging.info(f"Running Valgrind on {exe_file}")
-            valgrind_command = ["valgrind", "--leak-check=summary", exe_file]
-            stdout, stderr, error = run_process_with_timeout_valgrind(valgrind_command, exe_file, 30)
-            if stderr and "no leaks are possible" not in stderr:
-                self.grade -= 10
-                self.memory_leaks.append(f"Memory leaks detected in {exe_file}:\n{stderr}")
-            else:
-                self.memory_leaks.append(f"No memory leaks in {exe_file}")
+            parser = ValgrindXmlParser(report)
+            xml_read, xml_write = os.pipe()
+            timeout_key = f"valgrind {os.path.basename(exe_file)}"
+            spec = ProcessSpec(valgrind_command(os.path.abspath(exe_file), xml_write), timeout=self.timeout_budget(timeout_key, VALGRIND_TIMEOUT), preexec_fn=self.limits(),
+                               pass_fds=(xml_write,), readers={xml_read: parser.feed}, stop_signal=signal.SIGINT)
+            # SIGINT lets valgrind write its leak report for a program that never exits on its own
+            work_dir = tempfile.mkdtemp(prefix="ex4_valgrind_")
+            msg_scope = MsgQueueScope(f"{self.student_dir} (valgrind {os.path.basename(exe_file)})", [work_dir])
+            supervisor = GroupSupervisor([spec], cwd=work_dir, on_start=lambda process: msg_scope.track(process.pid), deadlock_window=self.options.deadlock_window,
+                                         on_sample=msg_scope.refresh)
+            result = supervisor.run()[0]
+            self.record_runtime(timeout_key, VALGRIND_TIMEOUT, result, supervisor.deadlock)
+            self.reap_stragglers(supervisor.sessions, exe_file)
+            msg_scope.cleanup()
+
+            if result.pid is None:
+                report.status = "error"
+                report.message = result.error
+            elif not parser.complete:
+                if result.timed_out or supervisor.deadlock:
+                    report.status = "timeout"
+                else:
+                    report.status = "error"
+                    last_line = result.stderr.strip().splitlines()[-1:] or [f"exit code {result.returncode}"]
+                    report.message = report.message or last_line[0]
             logging.info(f"Valgrind check completed for {exe_file}")
-        except subprocess.TimeoutExpired:
-            logging.error(f"Timeout expired running Valgrind on {exe_file}")
-            self.memory_leaks.append(f"Timeout expired during Valgrind check for {exe_file}")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Valgrind process was terminated for {exe_file}, possibly 'killed'. Return code: {e.returncode}")
-            self.memory_leaks.append(f"Valgrind process was terminated for {exe_file}.")
+            logging.debug(f"Valgrind resource usage for {exe_file}: {result.usage}")
         except Exception as e:
             logging.exception(f"Error running Valgrind on {exe_file}")
-
-    def execute_program(self, command, input_data=None):
-        try:
-            if command is "ex4c3" or command is "ex4c2" or command is "ex4c1":
-                timeout = 12
-            else:
-                timeout = 120
-            thread_id = threading.get_ident()  # Get current thread identifier
-            logging.debug(f"Thread {thread_id} executing command: {' '.join(command)}")    
-            stdout, stderr, error = run_process_with_timeout(command, command[0], timeout,input_data=input_data)
-            if stdout:
-                logging.info(f"Output for {' '.join(command)}: {stdout}")
-                self.output.append((command[0], stdout))
-            if error:
-                logging.error(f"Error execute_program error: {' '.join(command)}: {error}")
-                self.catched_errors.append(error)
-            if stderr:
-                logging.error(f"Error execute_program stderr: {' '.join(command)}: {stderr}")
-                self.catched_errors.append(stderr)
-        except Exception as e:
-            logging.exception(f"Error running {' '.join(command)}")
-
+            report.status = "error"
+            report.message = str(e)
+        finally:
+            cleanup_workspace(work_dir)
+        return report
+
+    def collect_sanitizer_logs(self, results, log_prefixes, deadlock):
+        # Every process of a run writes <prefix>.<pid>, forked children included
+        for result, log_prefix in zip(results, log_prefixes):
+            if log_prefix is None:
+                continue
+            exe_file = os.path.join(self.student_dir, os.path.basename(result.command[0]))
+            report = self.sanitizer_reports.setdefault(exe_file, LeakReport(exe_file, tool="AddressSanitizer"))
+            log_files = sorted(glob.glob(log_prefix + ".*"))
+            for log_file in log_files:
+                with open(log_file, 'r', errors='replace') as f:
+                    parse_sanitizer_log(f.read(), report)
+            if not log_files and (result.timed_out or deadlock) and report.status == "ok":
+                report.status = "timeout"  # Killed before LeakSanitizer ran at exit
+
+    def record_sanitizer_reports(self):
+        # Recorded in compile order like the valgrind reports
+        for source, source_file, exe_file in self.compile_jobs():
+            report = self.sanitizer_reports.get(exe_file)
+            if report is None:
+                report = LeakReport(exe_file, tool="AddressSanitizer")
+                report.status = "error"
+                report.message = "no sanitizer build was run"
+            if report.status == "leaks":
+                self.grade -= 10
+            logging.info(f"AddressSanitizer result for {report.exe_file}: {report}")
+            self.memory_leaks.append(report)
+
+    def reap_stragglers(self, sessions, label):
+        # Kills whatever the student's programs left running in their sessions
+        count, cpu_time = sweep_sessions(sessions)
+        if count:
+            logging.warning(f"Reaped {count} leftover processes of {self.student_dir} after {label}, they had used {cpu_time:.2f}s CPU")
+            with self.lock:
+                self.orphans_reaped += count
+                self.orphan_cpu_time += cpu_time
+
+    def program_timeout(self, step):
+        # The fixed budget of a plan step, PROGRAM_TIMEOUT unless the plan sets one
+        return step.timeout if step.timeout is not None else PROGRAM_TIMEOUT
+
+    def timeout_budget(self, key, fixed):
+        return self.timeout_policy.budget(key, fixed) if self.timeout_policy else fixed
+
+    def record_runtime(self, key, fixed, result, deadlock):
+        # Runs that exited on their own feed the timeout history; runs cut short by an adaptive budget are kept for the report
+        if self.timeout_policy is None or result.pid is None:
+            return
+        if not result.timed_out and not deadlock and result.returncode is not None and result.returncode >= 0:
+            self.timeout_policy.record(key, result.exit_time - result.start_time)
+        elif result.timed_out and result.spec.timeout < fixed:
+            logging.warning(f"{key} of {self.student_dir} stopped by its adaptive budget of {result.spec.timeout:.2f}s (fixed {fixed}s)")
+            with self.lock:
+                self.timeout_hits.append({"program": key, "budget": result.spec.timeout, "fixed": fixed})
+
+    def record_result(self, result):
+        # Stores what one process of a test group printed and how it ended
+        command = result.command
+        self.test_results.append({
+            "program": os.path.basename(command[0]),
+            "args": command[1:],
+            "pid": result.pid,
+            "returncode": result.returncode,
+            "start": result.start_time,
+            "ready": result.ready_time,
+            "exit": result.exit_time,
+            "usage": result.usage,
+        })
+        logging.debug(f"{' '.join(command)}: started {result.start_time}, ready {result.ready_time}, exited {result.exit_time}")
+        if result.pid is not None:
+            # Every program on its own track of the student, next to the threads that ran it
+            program = os.path.basename(command[0])
+            if result.spec.ready is not None and result.ready_time is not None:
+                tracer.add("ready wait", result.start_time, result.ready_time, self.student_dir, result.pid, program)
+            tracer.add(f"run {program}", result.start_time, result.exit_time, self.student_dir, result.pid, program,
+                       returncode=result.returncode, timed_out=result.timed_out)
+        # Output that passed a content check is not kept, the summary only shows mismatches and unchecked output
+        checked = self.record_output_check(result)
+        if result.stdout and not checked:
+            logging.info(f"Output for {' '.join(command)}: {result.stdout}")
+            self.output.append((os.path.join(self.student_dir, os.path.basename(command[0])), result.stdout_capture.summary()))
+        if result.error:
+            logging.error(f"Error execute_program error: {' '.join(command)}: {result.error}")
+            self.catched_errors.append(result.error)
+        if result.stderr:
+            logging.error(f"Error execute_program stderr: {' '.join(command)}: {result.stderr}")
+            self.catched_errors.append(str(result.stderr_capture.summary()))
+
+    def record_output_check(self, result):
+        # Returns True when the run passed a check of its output's content
+        checker = result.spec.stdout_checker
+        if checker is None:
+            return False
+        label = " ".join([os.path.basename(result.command[0])] + result.command[1:])
+        self.output_checks.append({"program": label, "verdict": checker.verdict, "message": checker.message, "points": checker.rule.points})
+        if checker.verdict == "fail":
+            logging.warning(f"Output check failed for {label} in {self.student_dir}: {checker.message}")
+            self.grade -= checker.rule.points
+            return False
+        return checker.rule.checks_content
+
+    @traced("run tests")
     def just_run_all(self):
-        commands_groups = [
-        [  # First group of commands
-            [os.path.join(self.student_dir, "ex4a1"), "fifom", "fifo1", "fifo2"],
-            [os.path.join(self.student_dir, "ex4a2"), "fifom", "0"],
-            [os.path.join(self.student_dir, "ex4a2"), "fifom", "1"],
-            ],
-        [  # Second group of commands
-            [os.path.join(self.student_dir, "ex4b1")],
-            [os.path.join(self.student_dir, "ex4b2"), "0"],
-            [os.path.join(self.student_dir, "ex4b2"), "1"],
-            ],
-        [  # Third group of commands
-            [os.path.join(self.student_dir, "ex4c1")],
-            [os.path.join(self.student_dir, "ex4c2")],
-            [os.path.join(self.student_dir, "ex4c3")],  # This one requires special input handling
-              ]
-          ]
         try:
-           
-            remove_all_msg_queues()
-            for commands in commands_groups:
-                if os.path.exists(commands[0][0]) :
-                    remove_all_msg_queues()
-                    threads = []  # Resetting threads for each group
-                    for command in commands:
-                        logging.info(f"Running {' '.join(command)} for {self.student_dir}")
-                       
-                        if command[0].endswith("ex4c3"):
-                        # Special handling for ex4c3, assuming you want to send and receive specific data
-                           logging.info(f"Special handling for {' '.join(command)}")
-                           thread = threading.Thread(target=self.execute_program, args=(command, "p 1 2 3 4 5 6 7 8 9 10 0\nq 121\n"))
-                        else:
-                            thread = threading.Thread(target=self.execute_program, args=(command,))
-                        threads.append(thread)
-                        thread.start()
-                        if 'ex4a1' in command or 'ex4b1' in command or 'ex4c1' in command or 'ex4c2' in command:
-                            logging.info("Waiting after starting creator program")
-                            time.sleep(5)  # Wait for 1 second after starting the creator program
-                    # Debugging: List all live threads
-                    live_threads = threading.enumerate()
-                    logging.debug(f"Live threads: {[thread.name for thread in live_threads]}")        
-                    for thread in threads:
-                        thread.join()
+            self.work_dir = tempfile.mkdtemp(prefix="ex4_run_")
+            if self.options.spill_dir:
+                self.spill_dir = os.path.join(os.path.abspath(self.options.spill_dir), self.student_dir)
+                os.makedirs(self.spill_dir, exist_ok=True)
+            outcomes = run_plan(self.plan.groups, self.run_group, self.options.group_jobs)
+            # Recorded in plan order whatever order the groups ran in
+            for group in self.plan.groups:
+                if outcomes.get(group.name):
+                    self.record_group(group, *outcomes[group.name])
         except Exception as e:
             logging.exception("Error in just_run_all method")
-
+        finally:
+            cleanup_workspace(self.work_dir)
+
+    @traced("group", nested=True, describe=lambda group: {"group": group.name})
+    def run_group(self, group):
+        # Runs one test group of the plan, returns (results, log prefixes, deadlock) or None if it was skipped
+        if not os.path.exists(os.path.join(self.student_path, group.steps[0].program)):
+            return None
+        try:
+            # Groups that make no queues share the scratch directory with those that do, so they claim no queue by its key
+            key_paths = [self.work_dir, self.student_path] if MSGQUEUE_RESOURCE in group.resources else []
+            msg_scope = MsgQueueScope(f"{self.student_dir} ({group.name})", key_paths)
+            specs = []
+            log_prefixes = []
+            for index, step in enumerate(group.steps):
+                command = [os.path.join(self.student_path, step.program)] + step.args
+                run_command = command
+                env = None
+                log_prefix = None
+                if self.options.memcheck == "asan" and os.path.exists(self.sanitizer_exe(command[0])):
+                    # Same arguments and cwd, only the binary and its report destination change
+                    log_prefix = os.path.join(self.work_dir, f"asan_{group.name}_{index}")
+                    env = dict(os.environ, ASAN_OPTIONS=sanitizer_options(log_prefix))
+                    run_command = [self.sanitizer_exe(command[0])] + command[1:]
+                log_prefixes.append(log_prefix)
+                logging.info(f"Running {' '.join(command)} for {self.student_dir}")
+                if step.stdin is not None:
+                    logging.info(f"Special handling for {' '.join(command)}")
+                ready = None
+                if step.has_ready_check:
+                    # The next command starts once the step's FIFO or queue exists
+                    ready = functools.partial(self.ready_check, step, msg_scope)
+                timeout = self.timeout_budget(step.program, self.program_timeout(step))
+                checker = OutputChecker(step.expect) if step.expect else None
+                specs.append(ProcessSpec(run_command, input_data=step.stdin, timeout=timeout, ready=ready, ready_timeout=step.ready_timeout, env=env,
+                                         preexec_fn=self.limits(log_prefix is not None), stdout_checker=checker))
+            supervisor = GroupSupervisor(specs, cwd=self.work_dir, on_start=lambda process: msg_scope.track(process.pid), deadlock_window=self.options.deadlock_window,
+                                         spill_dir=self.spill_dir, on_sample=msg_scope.refresh)
+            results = supervisor.run()
+            self.reap_stragglers(supervisor.sessions, group.name)
+            msg_scope.cleanup()
+            return results, log_prefixes, supervisor.deadlock
+        except Exception as e:
+            logging.exception(f"Error running group {group.name} for {self.student_dir}")
+            return None
+
+    def record_group(self, group, results, log_prefixes, deadlock):
+        for step, result in zip(group.steps, results):
+            self.record_result(result)
+            self.record_runtime(step.program, self.program_timeout(step), result, deadlock)
+        if deadlock:
+            logging.error(f"Deadlock in {self.student_dir}: {deadlock}")
+            self.catched_errors.append(f"deadlock: {deadlock}")
+        self.collect_sanitizer_logs(results, log_prefixes, deadlock)
+
+    def ready_check(self, step, msg_scope):
+        # Called right before the step starts, returns the readiness predicate
+        if step.ready_fifos:
+            return lambda: fifos_exist(self.work_dir, step.ready_fifos)
+        # Queues of other students running at the same time must not open the gate, so only this group's
+        # queues count. A queue created with IPC_PRIVATE or an unrelated ftok() path and not used yet cannot be
+        # told apart; then the creator sleeping in msgrcv/msgsnd counts as ready, else the step's ready_timeout.
+        queues_before = set(msg_scope.group_queues())
+        creator_index = len(msg_scope.leaders)  # Called right before the creator starts, it is the next process tracked
+        def ready():
+            if set(msg_scope.group_queues()) - queues_before:
+                return True
+            return len(msg_scope.leaders) > creator_index and waits_on_msgqueue(msg_scope.leaders[creator_index])
+        return ready
+
+    @traced("read_source_header")
     def read_source_header(self, num_lines=20):
         for file in os.listdir(self.student_dir):
             if file.endswith(".c"):
@@ -303,32 +445,37 @@ class Student:
 
 # ------------------------------------------------------------------ #
 
-def read_extraction_penalties(summary_log_path):
-    penalties = {}
+def read_extraction_manifest(manifest_path):
+    # Student directory -> the record extract.py wrote for it
+    manifest = {}
     try:
-        with open(summary_log_path, 'r', encoding='utf-8') as f:
-            content = f.read().split('\n\n')
-            for block in content:
-                lines = block.split('\n')
-                if lines[0].startswith("Logs for "):
-                    student_name = lines[0][9:-1]  # Remove "Logs for " and trailing colon
-                    score_line = lines[-1]
-                    score = int(score_line.split(': ')[-1].split(' ')[0])
-                    penalties[student_name] = 100 - score  # Calculate penalty
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    manifest[record["student"]] = record
+                except (ValueError, KeyError) as e:
+                    logging.error(f"Skipping line {line_number} of {manifest_path}: {e}")
+    except FileNotFoundError:
+        logging.warning(f"No extraction manifest at {manifest_path}, extraction penalties are not applied")
     except Exception as e:
-        logging.exception("Error reading extraction penalties")
-    return penalties
+        logging.exception("Error reading extraction manifest")
+    return manifest
 
 # ------------------------------------------------------------------ #
 
-def cleanup_fifos(fifo_list, main_dir):
-    for fifo in fifo_list:
-        try:
-            os.remove(fifo)
-            logging.info(f"Removed named pipe: {fifo}")
-        except OSError as e:
-            logging.error(f"Error removing named pipe {fifo}: {e}")
-            
+def cleanup_workspace(work_dir):
+    # Removes the student's scratch directory together with any FIFOs left in it
+    if not work_dir:
+        return
+    try:
+        leftovers = os.listdir(work_dir)
+        shutil.rmtree(work_dir)
+        logging.info(f"Removed workspace {work_dir} (leftovers: {leftovers})")
+    except OSError as e:
+        logging.error(f"Error removing workspace {work_dir}: {e}")
 
 # ------------------------------------------------------------------ #
 
@@ -344,46 +491,416 @@ def student_count(main_dir):
 
 # ------------------------------------------------------------------ #
 
-# Main script
-ex_name = "ex4"
-main_dir = os.getcwd()
-extraction_summary_log_path = os.path.join(main_dir, "extraction_summary.log")
-extraction_penalties = read_extraction_penalties(extraction_summary_log_path)
-
-students = []
-final_summary_file_path = os.path.join(main_dir, f"final_summary_{ex_name}.log")
-count = 0
-
-with open(final_summary_file_path, 'w') as final_summary_file:
-    for student_dir in os.listdir(main_dir):
-        student_path = os.path.join(main_dir, student_dir)
-        if not os.path.isdir(student_path) or not contains_hebrew(student_dir):
-            continue
+def prepare_student(student_dir, args, compile_cache, leak_check_pool, timeout_policy, extraction_manifest, manifest_time):
+    # A Student with the extraction penalty and the input hash it is stored under
+    student = Student(student_dir, args, compile_cache, leak_check_pool, timeout_policy)
+    extraction = extraction_manifest.get(student_dir, {})
+    student.extraction_penalty = extraction.get("penalty", 0)
+    student.file_hashes = {file["path"]: file["sha256"] for file in extraction.get("files", [])}
+    settings = (student.extraction_penalty, args.memcheck, student.plan.digest, args.rlimit_cpu, args.rlimit_as, args.adaptive_timeouts)
+    student.source_hash = input_hash(student_dir, student.file_hashes, manifest_time, settings)
+    return student
+
+def compile_all(students, workers):
+    """Compiles every (student, source) pair on one bounded pool.
+
+    All gcc runs finish before this returns. Results are applied to each
+    student in the same order the sequential per-student loop used, so
+    grades and messages do not depend on which compile finished first.
+    """
+    jobs = [(student, source, source_file, exe_file) for student in students for source, source_file, exe_file in student.compile_jobs()]
+    logging.info(f"Compiling {len(jobs)} sources for {len(students)} students on {workers} workers")
+    with tracer.span("compile all", sources=len(jobs)), ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(student.compile_single_program, source_file, exe_file) if os.path.exists(source_file) else None
+                   for student, source, source_file, exe_file in jobs]
+        sanitizer_futures = [pool.submit(student.compile_sanitizer_build, source_file, exe_file)
+                             if os.path.exists(source_file) and student.options.memcheck == "asan" else None
+                             for student, source, source_file, exe_file in jobs]
+        for (student, source, source_file, exe_file), future, sanitizer_future in zip(jobs, futures, sanitizer_futures):
+            try:
+                student.record_compilation(source, future.result() if future else None)
+                if sanitizer_future:
+                    student.record_sanitizer_build(source, exe_file, sanitizer_future.result())
+            except Exception as e:
+                logging.exception(f"Error compiling {source_file}")
 
+def compile_student(student):
+    # One student's sources one after the other, for callers that already compile students in parallel
+    for source, source_file, exe_file in student.compile_jobs():
         try:
-            fifo_list = ['fifom', 'fifo1', 'fifo2']
-            logging.info(f"Processing: {student_dir}")
-            cleanup_fifos(fifo_list,main_dir)
-
-            student = Student(student_dir)
-            student.extraction_penalty = extraction_penalties.get(student_dir, 0)
-            students.append(student)
+            exists = os.path.exists(source_file)
+            student.record_compilation(source, student.compile_single_program(source_file, exe_file) if exists else None)
+            if exists and student.options.memcheck == "asan":
+                student.record_sanitizer_build(source, exe_file, student.compile_sanitizer_build(source_file, exe_file))
+        except Exception as e:
+            logging.exception(f"Error compiling {source_file}")
 
-            logging.info(f"Compiling for {student_dir}")
-            for program in ["ex4a1", "ex4a2", "ex4b1", "ex4c1"]:
-                student.compile_program(program)
+def grade_student(student):
+    # Runs and summarizes one compiled student, returns (summary text, completed)
+    with tracer.span("grade", student.student_dir):
+        try:
+            logging.info(f"Processing: {student.student_dir}")
+            if student.options.memcheck == "valgrind":
+                student.valgrind_check_all()
             student.just_run_all()
+            if student.options.memcheck == "asan":
+                student.record_sanitizer_reports()
             student.read_source_header()
-            count += 1
-            cleanup_fifos(fifo_list,main_dir)
 
-            student_summary = do_summarize(student)
-            final_summary_file.write(student_summary)
-            final_summary_file.write("\n" + "="*40 + "\n\n")
+            return student_summary(student), True
         except Exception as e:
-            logging.exception(f"An error occurred while processing {student_dir}")
-            final_summary_file.write(f"Error processing {student_dir}: {str(e)}\n\n")
-            final_summary_file.write("\n" + "="*40 + "\n\n")
+            logging.exception(f"An error occurred while processing {student.student_dir}")
+            return error_summary(student.student_dir, e), False
+
+def student_summary(student):
+    with tracer.span("do_summarize", student.student_dir):
+        return do_summarize(student) + "\n" + "="*40 + "\n\n"
+
+def restore_student(student, stored):
+    # Fills student from a results store row, returns (summary text, completed)
+    stored_hash, rubric_version, completed, data = stored
+    if not completed:
+        return data["summary"], False
+    student.load_dict(data)
+    return student_summary(student), True
+
+def reusable_result(results_store, student, args, resumed):
+    # The stored row to use instead of grading student, or None when it has to be graded
+    student_dir = student.student_dir
+    if not (args.incremental or args.summary_only or student_dir in resumed):
+        return None
+    stored = results_store.lookup(student_dir)
+    if stored is not None and (args.summary_only or student_dir in resumed or results_store.is_current(student_dir, student.source_hash, RUBRIC_VERSION)):
+        logging.info(f"Using stored result for {student_dir}")
+        return stored
+    return None
+
+def start_run(results_store, args, argv):
+    # Returns (run id, student dirs the run already graded); --resume continues the last unfinished run
+    run_id = results_store.unfinished_run() if args.resume else None
+    if run_id is not None:
+        resumed = results_store.graded_in_run(run_id)
+        logging.info(f"Resuming run {run_id}, {len(resumed)} students already graded")
+        return run_id, resumed
+    if args.resume:
+        logging.warning("No interrupted run to resume, starting a new one")
+    if args.summary_only:
+        return None, set()
+    return results_store.start_run({"argv": sys.argv[1:] if argv is None else argv, "rubric_version": RUBRIC_VERSION}), set()
+
+def similarity_section(results_store, main_dir, student_dirs, args):
+    # The similarity clusters closing the final summary, empty with --no-similarity
+    if args.no_similarity:
+        return ""
+    try:
+        with tracer.span("similarity", students=len(student_dirs)):
+            clusters = find_clusters({student_dir: os.path.join(main_dir, student_dir) for student_dir in student_dirs}, results_store, args.similarity_threshold)
+        logging.info(f"Found {len(clusters)} clusters of similar submissions")
+        return format_clusters(clusters, args.similarity_threshold)
+    except Exception as e:
+        logging.exception("Error finding similar submissions")
+        return f"Error finding similar submissions: {e}\n\n"
+
+def finish_trace(args):
+    if args.trace_top > 0:
+        tracer.print_top(args.trace_top)
+    if args.trace:
+        tracer.write(args.trace)
+        logging.info(f"Trace has been written to {args.trace}")
+
+def shared_path(path, main_dir):
+    # path relative to main_dir, for workers on other hosts; a path outside it is sent as it is
+    path = os.path.abspath(path)
+    relative = os.path.relpath(path, main_dir)
+    return path if relative.split(os.sep)[0] == os.pardir else relative
+
+def shared_options(args, main_dir):
+    options = {name: getattr(args, name) for name in SHARED_OPTIONS}
+    for name in SHARED_PATHS:
+        if options[name]:
+            options[name] = shared_path(options[name], main_dir)
+    if os.path.abspath(args.plan) == DEFAULT_PLAN:
+        options["plan"] = None  # Every worker has the default plan next to its own check.py
+    options["plan_digest"] = load_plan(args.plan).digest
+    return options
+
+def coordinate(results_store, run_id, students, args):
+    """--coordinate: hands students out to --worker processes and waits until all are graded.
+
+    Workers save every student to the results store under run_id. Students
+    whose lease ran out MAX_ATTEMPTS times are saved here as failed. When the
+    coordinator is stopped the pending students are taken off the queue and
+    the workers finish the ones they hold.
+    """
+    work_queue = WorkQueue(os.path.join(os.getcwd(), args.queue_db), args.lease_seconds)
+    work_queue.fill(run_id, shared_options(args, os.getcwd()), [student.student_dir for student in students])
+    logging.info(f"Queued {len(students)} students in {args.queue_db}, waiting for workers (check.py --worker --queue-db {args.queue_db})")
+    progress = None
+    while True:
+        counts = work_queue.counts()
+        if counts != progress:
+            logging.info("Work queue: " + ", ".join(f"{counts.get(state, 0)} {state}" for state in QUEUE_STATES))
+            progress = counts
+        if not counts.get("pending") and not counts.get("leased"):
+            break
+        if stop_requested.wait(QUEUE_POLL_INTERVAL):
+            logging.warning(f"Taking {work_queue.cancel_pending()} pending students off the queue")
+            break
+    hashes = {student.student_dir: student.source_hash for student in students}
+    for student_dir, worker, attempts in work_queue.failed():
+        logging.error(f"Giving up on {student_dir}: its lease ran out {attempts} times, last held by {worker}")
+        error = f"grading was lost with {attempts} workers, the last one was {worker}"
+        results_store.save(student_dir, hashes[student_dir], RUBRIC_VERSION, False, {"summary": error_summary(student_dir, error)}, run_id)
+    work_queue.close()
+
+def work(args):
+    """--worker: grades students leased from a coordinator's queue until none are left.
+
+    Waits for a coordinator to fill the queue, then grades with its
+    SHARED_OPTIONS on --jobs threads and saves to the results store the
+    coordinator reads. A heartbeat thread renews the leases; a worker that
+    dies stops renewing them and its students go to the other workers.
+    """
+    main_dir = os.getcwd()
+    work_queue = WorkQueue(os.path.join(main_dir, args.queue_db), args.lease_seconds)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    run = work_queue.run()
+    while run is None:
+        logging.info(f"Waiting for a coordinator to fill {args.queue_db}")
+        if stop_requested.wait(QUEUE_POLL_INTERVAL):
+            return
+        run = work_queue.run()
+    run_id, options = run
+    plan_digest = options.pop("plan_digest", None)
+    for name, value in options.items():
+        setattr(args, name, value)
+    args.plan = args.plan or DEFAULT_PLAN
+    try:
+        plan = load_plan(args.plan)
+    except (OSError, ValueError) as e:
+        logging.error(f"Worker {worker} cannot load the coordinator's test plan {args.plan}: {e}")
+        return
+    if plan_digest is not None and plan.digest != plan_digest:
+        # Grades and input hashes would not match the coordinator's
+        logging.error(f"Worker {worker} has a different {args.plan} than the coordinator, not grading run {run_id}")
+        return
+    logging.info(f"Worker {worker} grading run {run_id}")
+
+    extraction_manifest_path = os.path.join(main_dir, "extraction_manifest.jsonl")
+    extraction_manifest = read_extraction_manifest(extraction_manifest_path)
+    manifest_time = os.path.getmtime(extraction_manifest_path) if extraction_manifest else 0
+    compile_cache = None
+    if not args.no_compile_cache:
+        compile_cache = CompileCache(args.compile_cache, args.compile_cache_size * 1024 * 1024)
+    leak_check_pool = ThreadPoolExecutor(max_workers=max(1, args.valgrind_jobs)) if args.memcheck == "valgrind" else None
+    results_store = ResultsStore(os.path.join(main_dir, args.results_db))
+    timeout_policy = load_policy(results_store, args.adaptive_timeouts)
+
+    finished = threading.Event()
+    def heartbeat():
+        while not finished.wait(args.lease_seconds / 3):
+            work_queue.heartbeat(worker)
+    threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
+
+    def grade_leased():
+        # One grading thread: claim, grade, save, until the queue runs dry; returns how many were graded
+        graded = 0
+        while not stop_requested.is_set():
+            claimed = work_queue.claim(worker)
+            if claimed is None:
+                # Leases held by others may still run out and need a new worker
+                if not work_queue.counts().get("leased"):
+                    break
+                stop_requested.wait(QUEUE_POLL_INTERVAL)
+                continue
+            student_dir, previous_worker, attempt = claimed
+            if previous_worker:
+                logging.warning(f"Taking over {student_dir} from {previous_worker} (attempt {attempt})")
+            student = None
+            try:
+                student = prepare_student(student_dir, args, compile_cache, leak_check_pool, timeout_policy, extraction_manifest, manifest_time)
+                compile_student(student)
+                summary, completed = grade_student(student)
+            except Exception as e:
+                logging.exception(f"An error occurred while processing {student_dir}")
+                summary, completed = error_summary(student_dir, e), False
+            # Saved before completing, so a student the coordinator sees as done is always in the store
+            results_store.save(student_dir, student.source_hash if student else "", RUBRIC_VERSION, completed,
+                               student.to_dict() if completed else {"summary": summary}, run_id)
+            if not work_queue.complete(student_dir, worker):
+                logging.warning(f"Lease on {student_dir} ran out while it was graded, it may be graded twice")
+            graded += completed
+        return graded
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        count = sum(pool.map(lambda _: grade_leased(), range(max(1, args.jobs))))
+    finished.set()
+    if leak_check_pool:
+        leak_check_pool.shutdown()
+    save_samples(results_store, timeout_policy)
+    results_store.close()
+    work_queue.close()
+    logging.info(f"Worker {worker} graded {count} students")
+    if compile_cache:
+        logging.info(f"Compile cache of worker {worker}: {compile_cache.hits} hits, {compile_cache.misses} misses")
+    finish_trace(args)
+
+def error_summary(student_dir, error):
+    return f"Error processing {student_dir}: {str(error)}\n\n" + "\n" + "="*40 + "\n\n"
 
-logging.info(f"Total {count} students out of {student_count(main_dir)}")
-display_statistics(students, count)
+# ------------------------------------------------------------------ #
+
+def build_arg_parser(add_help=True):
+    parser = argparse.ArgumentParser(description="Compile, run and summarize ex4 submissions found in the current directory.", add_help=add_help)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of students graded at the same time (default: 1)")
+    parser.add_argument("--compile-jobs", type=int, default=os.cpu_count() or 1, help="number of gcc processes run at the same time (default: number of cores)")
+    parser.add_argument("--valgrind-jobs", type=int, default=os.cpu_count() or 1, help="number of valgrind checks run at the same time (default: number of cores)")
+    parser.add_argument("--compile-cache", default=default_cache_dir(), help="directory of the compile cache (default: %(default)s)")
+    parser.add_argument("--compile-cache-size", type=int, default=512, help="compile cache size limit in MB (default: 512)")
+    parser.add_argument("--no-compile-cache", action="store_true", help="always run gcc")
+    parser.add_argument("--memcheck", choices=["valgrind", "asan"], default="valgrind",
+                        help="leak checker: a separate valgrind run of every program, or AddressSanitizer builds checked during the normal runs (default: valgrind)")
+    parser.add_argument("--results-db", default="ex4_results.sqlite", help="SQLite file that keeps every graded student (default: %(default)s)")
+    parser.add_argument("--incremental", action="store_true", help="only grade students whose sources, extraction penalty or the rubric changed since they were stored")
+    parser.add_argument("--resume", action="store_true", help="continue the last interrupted run, students it already graded are taken from the results store")
+    parser.add_argument("--summary-only", action="store_true", help="grade nobody, rebuild the summary and statistics from the results store")
+    parser.add_argument("--plan", default=DEFAULT_PLAN, help="test plan file with the sources to compile and the groups to run (default: test_plans/ex4.json)")
+    parser.add_argument("--group-jobs", type=int, default=3, help="test groups of one student run at the same time when their FIFOs and queues do not conflict (default: 3)")
+    parser.add_argument("--rlimit-cpu", type=int, default=30, help="RLIMIT_CPU in seconds for every student program and valgrind run, 0 for none (default: 30)")
+    parser.add_argument("--rlimit-as", type=int, default=256,
+                        help="RLIMIT_AS in MB for every student program and valgrind run, 0 for none; never applied to AddressSanitizer builds (default: 256)")
+    parser.add_argument("--spill-dir", help="keep the full stdout/stderr of every program run under this directory, the summary only has the first lines")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="students whose normalized sources are at least this similar are listed together in the summary (default: %(default)s)")
+    parser.add_argument("--no-similarity", action="store_true", help="skip the near-duplicate check across students")
+    parser.add_argument("--trace", metavar="FILE", help="write every timed span (gcc, valgrind, test groups, programs, summaries) as Chrome trace JSON")
+    parser.add_argument("--trace-top", type=int, default=5, help="slowest students and phases listed after the statistics, 0 lists none (default: 5)")
+    parser.add_argument("--adaptive-timeouts", action="store_true",
+                        help="cut each program's time budget to what its earlier clean runs needed (p99 x2 + 1s), never above the fixed budget")
+    parser.add_argument("--deadlock-window", type=float, default=10, help="seconds a test group may sit blocked on pipes/queues without progress before it is killed, 0 disables (default: 10)")
+    return parser
+
+def add_queue_arguments(parser):
+    # Only check.py grades through a work queue
+    parser.add_argument("--coordinate", action="store_true",
+                        help="grade nothing here: queue the students for --worker processes, then write the summary and statistics from their results")
+    parser.add_argument("--worker", action="store_true",
+                        help="grade students from the coordinator's queue, with its grading options, until none are left")
+    parser.add_argument("--queue-db", default="ex4_queue.sqlite", help="SQLite file of the work queue, shared by the coordinator and its workers (default: %(default)s)")
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS,
+                        help="a worker without a heartbeat for this long is taken for dead and its students are handed out again (default: %(default)s)")
+    return parser
+
+def parse_args(argv=None):
+    return add_queue_arguments(build_arg_parser()).parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.trace:
+        tracer.record_events()
+    if args.worker:
+        return work(args)
+    main_dir = os.getcwd()
+    extraction_manifest_path = os.path.join(main_dir, "extraction_manifest.jsonl")
+    extraction_manifest = read_extraction_manifest(extraction_manifest_path)
+    manifest_time = os.path.getmtime(extraction_manifest_path) if extraction_manifest else 0
+
+    final_summary_file_path = os.path.join(main_dir, f"final_summary_{load_plan(args.plan).name}.log")
+    count = 0
+    student_dirs = [name for name in os.listdir(main_dir) if os.path.isdir(os.path.join(main_dir, name)) and contains_hebrew(name)]
+    compile_cache = None
+    if not args.no_compile_cache and not args.coordinate:
+        compile_cache = CompileCache(args.compile_cache, args.compile_cache_size * 1024 * 1024)
+    # One pool for the valgrind runs of all students, so --jobs does not multiply them
+    leak_check_pool = ThreadPoolExecutor(max_workers=max(1, args.valgrind_jobs)) if args.memcheck == "valgrind" else None
+
+    results_store = ResultsStore(os.path.join(main_dir, args.results_db))
+    run_id, resumed = start_run(results_store, args, argv)
+    timeout_policy = load_policy(results_store, args.adaptive_timeouts)
+
+    # Creating a student only reads its README; failures are reported in listdir order later.
+    # stored is (summary, completed) for students taken from the results store instead of graded.
+    entries = []
+    for student_dir in student_dirs:
+        try:
+            student = prepare_student(student_dir, args, compile_cache, leak_check_pool, timeout_policy, extraction_manifest, manifest_time)
+            stored = reusable_result(results_store, student, args, resumed)
+            if stored is not None:
+                entries.append((student_dir, student, restore_student(student, stored), None))
+            elif args.summary_only:
+                entries.append((student_dir, None, None, "no stored result"))
+                continue
+            else:
+                entries.append((student_dir, student, None, None))
+        except Exception as e:
+            logging.exception(f"An error occurred while processing {student_dir}")
+            entries.append((student_dir, None, None, e))
+
+    interrupted = []
+    if args.coordinate and not args.summary_only:
+        # The workers grade and store every student that is not reused, they are then restored like --resume does
+        coordinate(results_store, run_id, [student for student_dir, student, stored, error in entries if student and not stored], args)
+        graded = results_store.graded_in_run(run_id)
+        for index, (student_dir, student, stored, error) in enumerate(entries):
+            if student and not stored:
+                if student_dir in graded:
+                    entries[index] = (student_dir, student, restore_student(student, results_store.lookup(student_dir)), None)
+                else:
+                    interrupted.append(student_dir)
+                    entries[index] = (student_dir, None, None, "grading interrupted, run again with --resume")
+
+    compile_all([student for student_dir, student, stored, error in entries if student and not stored], max(1, args.compile_jobs))
+
+    # Written next to the final file and renamed over it, so an interrupted batch never leaves half a summary
+    partial_summary_file_path = final_summary_file_path + ".partial"
+    totals = []  # StudentTotals of every graded or restored student, the Student itself is dropped once it is written
+    with open(partial_summary_file_path, 'w') as final_summary_file, ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        # Futures are consumed in submission order, so the summary file keeps the listdir order
+        futures = [pool.submit(grade_student, student) if student and not stored else None for student_dir, student, stored, error in entries]
+        for index, future in enumerate(futures):
+            student_dir, student, stored, error = entries[index]
+            entries[index] = futures[index] = None
+            if student is None:
+                final_summary_file.write(error_summary(student_dir, error))
+                continue
+            if future is None:
+                summary, completed = stored
+            else:
+                while not future.done() and not stop_requested.wait(POLL_INTERVAL):
+                    pass
+                if stop_requested.is_set():
+                    # Students already being graded finish, the queued ones are left for --resume
+                    for pending in futures:
+                        if pending:
+                            pending.cancel()
+                if future.cancelled():
+                    interrupted.append(student_dir)
+                    final_summary_file.write(error_summary(student_dir, "grading interrupted, run again with --resume"))
+                    continue
+                summary, completed = future.result()
+                # Saved from this thread only, as soon as the student is done
+                results_store.save(student_dir, student.source_hash, RUBRIC_VERSION, completed, student.to_dict() if completed else {"summary": summary}, run_id)
+            if completed:
+                count += 1
+            totals.append(student_totals(student))
+            final_summary_file.write(summary)
+        final_summary_file.write(similarity_section(results_store, main_dir, student_dirs, args))
+    os.replace(partial_summary_file_path, final_summary_file_path)
+    if interrupted:
+        logging.warning(f"Interrupted with {len(interrupted)} students left, run again with --resume to grade them")
+    elif run_id is not None:
+        results_store.finish_run(run_id)
+    save_samples(results_store, timeout_policy)
+    results_store.close()
+
+    if leak_check_pool:
+        leak_check_pool.shutdown()
+    logging.info(f"Total {count} students out of {student_count(main_dir)}")
+    display_statistics(totals, count, compile_cache)
+    if args.coordinate:
+        # gcc and the test runs were timed in the workers, each lists its own slowest students and phases
+        args.trace_top = 0
+    finish_trace(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,35 @@
 import os
 import re
 
+def clean_name(folder_name):
+    # Remove numbers and specific substrings
+    return re.sub(r'\d+|_assignsubmission_file|_', '', folder_name)
+
+def clean_folder(main_dir, folder_name):
+    # Renames one student folder, returns its new name
+    new_folder_name = clean_name(folder_name)
+    if new_folder_name == folder_name:
+        return folder_name
+    folder_path = os.path.join(main_dir, folder_name)
+    new_folder_path = os.path.join(main_dir, new_folder_name)
+    # Rename the folder
+    os.rename(folder_path, new_folder_path)
+    print(f"Renamed '{folder_name}' to '{new_folder_name}'")
+    return new_folder_name
+
 def clean_folder_names(main_dir):
     for folder_name in os.listdir(main_dir):
         folder_path = os.path.join(main_dir, folder_name)
         # Ensure we're only dealing with directories
         if os.path.isdir(folder_path):
-            # Remove numbers and specific substrings
-            new_folder_name = re.sub(r'\d+|_assignsubmission_file|_', '', folder_name)
-            new_folder_path = os.path.join(main_dir, new_folder_name)
-            # Rename the folder
-            os.rename(folder_path, new_folder_path)
-            print(f"Renamed '{folder_name}' to '{new_folder_name}'")
+            clean_folder(main_dir, folder_name)
+
+def main():
+    # Directory containing all student folders
+    main_dir = os.getcwd()
 
-# Directory containing all student folders
-main_dir = os.getcwd()
+    # Clean up the folder names
+    clean_folder_names(main_dir)
 
-# Clean up the folder names
-clean_folder_names(main_dir)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+import logging
+
+INCLUDE_PATTERN = re.compile(rb'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+SOURCE_DIR_PLACEHOLDER = "\0SOURCE_DIR\0"  # Stands in for the student directory inside cached stderr
+
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "ex4_compile_cache")
+
+# ------------------------------------------------------------------ #
+
+class CompileCache:
+    """Content-addressed store of gcc results.
+
+    An entry is keyed by the source bytes, the bytes of every local header it
+    includes, the gcc version and the flags, and holds the binary together with
+    gcc's stderr and return code, so a hit reports the same warnings and errors
+    as a real compile. Entries are evicted least recently used first once the
+    cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512*1024*1024, compiler="gcc"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.compiler = compiler
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.compiler_id = self.read_compiler_id()
+
+    def read_compiler_id(self):
+        try:
+            version = subprocess.run([self.compiler, "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            machine = subprocess.run([self.compiler, "-dumpmachine"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            return version.stdout.splitlines()[0] + " " + machine.stdout.strip()
+        except (OSError, IndexError):
+            return self.compiler
+
+    def key(self, source_file, flags):
+        digest = hashlib.sha256()
+        digest.update(self.compiler_id.encode())
+        digest.update("\0".join(flags).encode())
+        seen = set()
+        pending = [source_file]
+        while pending:
+            path = pending.pop()
+            if path in seen:
+                continue
+            seen.add(path)
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            except OSError:
+                content = b''  # A missing header makes gcc fail, which is cached like any other result
+            digest.update(os.path.relpath(path, os.path.dirname(source_file)).encode() + b"\0" + content + b"\0")
+            for header in INCLUDE_PATTERN.findall(content):
+                pending.append(os.path.normpath(os.path.join(os.path.dirname(path), header.decode(errors='replace'))))
+        return digest.hexdigest()
+
+    def compile(self, source_file, exe_file, flags):
+        """Builds exe_file from source_file, returns a CompletedProcess like subprocess.run."""
+        command = [self.compiler] + flags + [source_file, "-o", exe_file]
+        key = self.key(source_file, flags)
+        source_dir = os.path.dirname(source_file) + os.sep
+        entry_dir = os.path.join(self.cache_dir, key)
+        cached = self.load(entry_dir, exe_file)
+        if cached is not None:
+            returncode, stderr = cached
+            with self.lock:
+                self.hits += 1
+            logging.info(f"Compile cache hit for {source_file}")
+            return subprocess.CompletedProcess(command, returncode, "", stderr.replace(SOURCE_DIR_PLACEHOLDER, source_dir))
+
+        with self.lock:
+            self.misses += 1
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.store(entry_dir, exe_file, result.returncode, result.stderr.replace(source_dir, SOURCE_DIR_PLACEHOLDER))
+        return result
+
+    def load(self, entry_dir, exe_file):
+        try:
+            with open(os.path.join(entry_dir, "result.json"), 'r') as f:
+                meta = json.load(f)
+            if meta["returncode"] == 0:
+                shutil.copyfile(os.path.join(entry_dir, "binary"), exe_file)
+                os.chmod(exe_file, 0o755)
+            os.utime(entry_dir)  # The directory's mtime is the entry's last use
+            return meta["returncode"], meta["stderr"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store(self, entry_dir, exe_file, returncode, stderr):
+        try:
+            staging = tempfile.mkdtemp(dir=self.cache_dir, prefix=".staging_")
+            if returncode == 0:
+                shutil.copyfile(exe_file, os.path.join(staging, "binary"))
+            with open(os.path.join(staging, "result.json"), 'w') as f:
+                json.dump({"returncode": returncode, "stderr": stderr}, f)
+            try:
+                os.rename(staging, entry_dir)
+            except OSError:
+                shutil.rmtree(staging, ignore_errors=True)  # Another worker stored the same key first
+        except OSError as e:
+            logging.error(f"Failed to store compile cache entry {entry_dir}: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if name.startswith(".") or not os.path.isdir(path):
+                    continue
+                try:
+                    size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+                    entries.append((os.path.getmtime(path), size, path))
+                except OSError:
+                    continue  # Removed by another grader sharing the cache
+                total += size
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                logging.info(f"Evicted compile cache entry {os.path.basename(path)}")
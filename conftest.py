@@ -0,0 +1 @@
+# Lets the tests under tests/ import the flat modules of this directory
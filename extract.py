@@ -1,10 +1,26 @@
 import os
+import time
+import json
+import hashlib
+import zlib
 import zipfile
 import tarfile
 import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 import os, stat
 
+COPY_CHUNK_SIZE = 64 * 1024
+MAX_ENTRY_BYTES = 20 * 1024 * 1024  # Largest single file taken out of an archive
+MAX_TOTAL_BYTES = 100 * 1024 * 1024  # Everything extracted for one student
+MAX_ENTRIES = 1000
+SKIPPED_DIRS = ["__MACOSX", ".git", ".vscode", ".idea"]
+SKIPPED_SUFFIXES = [".o", ".obj", ".out", ".exe", ".so", ".a", ".dll", ".DS_Store"]
+MANIFEST_NAME = "extraction_manifest.jsonl"
+ARCHIVE_SUFFIXES = (".zip", ".tgz", ".tar.gz")  # Extracted and deleted, a .rar stays for manual extraction
+ELF_MAGIC = b"\x7fELF"  # Compiled binaries are rebuilt from the sources, never taken from the upload
+
 def check_permissions(path):
     # Check for read, write, and execute permissions
     is_readable = os.access(path, os.R_OK)
@@ -13,7 +29,7 @@ def check_permissions(path):
     return permissions
 
 def handle_extraction_directory(student_path, log_entries, scores, student_dir):
-   
+
     contents_after_extraction = os.listdir(student_path)
     if len(contents_after_extraction) == 1 and os.path.isdir(os.path.join(student_path, contents_after_extraction[0])):
         print(f"Found an unwanted directory: {contents_after_extraction[0]}")
@@ -42,58 +58,225 @@ def handle_extraction_directory(student_path, log_entries, scores, student_dir):
         except Exception as e:
             log_entries.append(f"Error moving contents from unwanted directory '{unwanted_dir}': {e}")
 
+# ------------------------------------------------------------------ #
 
-def unzip_and_extract_student_submissions(main_dir):
-    extraction_logs = {}
-    scores = {}
+class ExtractionBudget:
+    """Byte and entry allowance shared by all archives of one student.
+
+    Sizes in archive headers are not trusted: bytes are counted while they are
+    written, so a zip bomb is cut off after the budget, not after it is full.
+    """
+
+    def __init__(self, max_entry_bytes=MAX_ENTRY_BYTES, max_total_bytes=MAX_TOTAL_BYTES, max_entries=MAX_ENTRIES):
+        self.max_entry_bytes = max_entry_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_entries = max_entries
+        self.bytes_written = 0
+        self.entries = 0
+        self.skipped = 0
+        self.rejected = []  # (name, reason) of entries that were not extracted
+
+    def reject(self, name, reason, log_entries):
+        self.rejected.append((name, reason))
+        log_entries.append(f"Rejected {name}: {reason}")
+
+def member_target(student_path, name):
+    # Where an archive member goes, None for absolute paths and '..' escapes
+    base = os.path.abspath(student_path)
+    target = os.path.abspath(os.path.join(base, name))
+    if os.path.commonpath([base, target]) != base:
+        return None
+    return target
+
+def is_skipped(name):
+    # Editor and system folders, object files and prebuilt binaries
+    parts = [part for part in name.replace("\\", "/").split("/") if part]
+    return any(part in SKIPPED_DIRS for part in parts) or any(name.endswith(suffix) for suffix in SKIPPED_SUFFIXES)
 
-    for student_dir in os.listdir(main_dir):
-        student_path = os.path.join(main_dir, student_dir)
-        if not os.path.isdir(student_path):
+def copy_member(source, target, name, budget, log_entries):
+    # Streams one member to disk, removes the partial file if a limit or a binary header stops it
+    written = 0
+    reason = None
+    with open(target, 'wb') as out:
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            if written == 0 and chunk.startswith(ELF_MAGIC):
+                reason = "compiled binary"
+                break
+            written += len(chunk)
+            if written > budget.max_entry_bytes:
+                reason = f"larger than {budget.max_entry_bytes} bytes"
+                break
+            if budget.bytes_written + written > budget.max_total_bytes:
+                reason = f"student total over {budget.max_total_bytes} bytes"
+                break
+            out.write(chunk)
+    if reason:
+        os.remove(target)
+        budget.reject(name, reason, log_entries)
+        return False
+    budget.bytes_written += written
+    return True
+
+def extract_members(members, student_path, budget, log_entries):
+    """Extracts (name, is_dir, is_file, open_member) tuples under student_path.
+
+    Members outside the student directory, links and devices are rejected;
+    editor folders and build artifacts are skipped and only counted. Returns
+    the number of files written.
+    """
+    extracted = 0
+    for name, is_dir, is_file, open_member in members:
+        target = member_target(student_path, name)
+        if target is None:
+            budget.reject(name, "path outside the student directory", log_entries)
+            continue
+        if is_skipped(name):
+            budget.skipped += 1
+            continue
+        if is_dir:
+            try:
+                os.makedirs(target, exist_ok=True)
+            except OSError as e:
+                budget.reject(name, f"directory clashes with a file ({e})", log_entries)
+            continue
+        if not is_file:
+            budget.reject(name, "link or special file", log_entries)
             continue
+        if os.path.isdir(target):
+            # A zip entry named "." or a file named like a directory extracted before
+            budget.reject(name, "file clashes with a directory", log_entries)
+            continue
+        if budget.entries >= budget.max_entries:
+            budget.reject(name, f"more than {budget.max_entries} entries", log_entries)
+            continue
+        budget.entries += 1
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open_member() as source:
+                if copy_member(source, target, name, budget, log_entries):
+                    extracted += 1
+        except (OSError, RuntimeError, EOFError, zlib.error, zipfile.BadZipFile, tarfile.TarError) as e:
+            if os.path.isfile(target):
+                os.remove(target)
+            budget.reject(name, f"unreadable ({e})", log_entries)
+    return extracted
+
+def zip_members(zip_ref):
+    for info in zip_ref.infolist():
+        yield info.filename, info.is_dir(), not info.is_dir(), lambda info=info: zip_ref.open(info)
 
-        log_entries = []
-        score = 100  # Start with a full score
-
-        for file in os.listdir(student_path):
-            file_path = os.path.join(student_path, file)
-            if file.endswith('.zip'):
-                try:
-                    with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                        zip_ref.extractall(student_path)
-                        log_entries.append(f"Extracted and deleted {file}")
-                    os.remove(file_path)  # Delete the zip file after extraction
-                except zipfile.BadZipFile:
-                    log_entries.append(f"Error extracting {file}: Bad zip file")
-                    score -= 10
-            elif file.endswith('.tgz'):
-                try:
-                    with tarfile.open(file_path, 'r:gz') as tar_ref:
-                        tar_ref.extractall(student_path)
-                        log_entries.append(f"TGZ archive found: {file}.")
-                        score -= 0
-                        log_entries.append(f"Extracted and deleted {file}")
-                    os.remove(file_path)  # Delete the tgz file after extraction
-               
-                except tarfile.TarError:
-                    log_entries.append(f"Error extracting {file}: Bad tgz file")
-                    score -= 20
-            elif file.endswith('.rar'):
-                log_entries.append(f"RAR archive found: {file}. Manual extraction required.")
-                score -= 15
-            elif file.endswith('.tar.gz'):
-                log_entries.append(f"TAR archive found: {file}. Manual extraction required.")
-                score -= 15
-                # Note: Manual extraction required for .rar files or use an external tool
-        scores[student_dir] = score
-        handle_extraction_directory(student_path, log_entries, scores, student_dir)
-        extraction_logs[student_dir] = log_entries
-        
+def tar_members(tar_ref):
+    for member in tar_ref:
+        yield member.name, member.isdir(), member.isfile(), lambda member=member: tar_ref.extractfile(member)
+
+def list_files(student_path):
+    # Every file left in the student directory, with its size and sha256, in path order
+    files = []
+    for root, dirs, names in os.walk(student_path):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            digest = hashlib.sha256()
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                files.append({"path": os.path.relpath(path, student_path), "size": os.path.getsize(path), "sha256": digest.hexdigest()})
+            except OSError:
+                continue  # Unreadable files are reported by the checker when it needs them
+    return files
+
+# ------------------------------------------------------------------ #
+
+def extract_student(main_dir, student_dir, budget_limits):
+    # One pool task: extracts every archive of one student, returns (log entries, score, stats)
+    student_path = os.path.join(main_dir, student_dir)
+    log_entries = []
+    score = 100  # Start with a full score
+    budget = ExtractionBudget(*budget_limits)
+    start = time.time()
+    extracted = 0
+    archives = []
+
+    for file in os.listdir(student_path):
+        file_path = os.path.join(student_path, file)
+        if file.endswith('.zip'):
+            archives.append({"file": file, "type": "zip"})
+            try:
+                with zipfile.ZipFile(file_path, 'r') as zip_ref:
+                    extracted += extract_members(zip_members(zip_ref), student_path, budget, log_entries)
+                    log_entries.append(f"Extracted and deleted {file}")
+                os.remove(file_path)  # Delete the zip file after extraction
+            except zipfile.BadZipFile:
+                log_entries.append(f"Error extracting {file}: Bad zip file")
+                score -= 10
+        elif file.endswith('.tgz') or file.endswith('.tar.gz'):
+            archives.append({"file": file, "type": "tgz"})
+            try:
+                with tarfile.open(file_path, 'r:gz') as tar_ref:
+                    log_entries.append(f"TGZ archive found: {file}.")
+                    extracted += extract_members(tar_members(tar_ref), student_path, budget, log_entries)
+                    log_entries.append(f"Extracted and deleted {file}")
+                os.remove(file_path)  # Delete the tgz file after extraction
+            except (tarfile.TarError, EOFError, zlib.error, OSError):
+                log_entries.append(f"Error extracting {file}: Bad tgz file")
+                score -= 20
+        elif file.endswith('.rar'):
+            archives.append({"file": file, "type": "rar"})
+            log_entries.append(f"RAR archive found: {file}. Manual extraction required.")
+            score -= 15
+            # Note: Manual extraction required for .rar files or use an external tool
+    scores = {student_dir: score}
+    handle_extraction_directory(student_path, log_entries, scores, student_dir)
+
+    seconds = time.time() - start
+    stats = {
+        "extracted": extracted,
+        "bytes": budget.bytes_written,
+        "seconds": round(seconds, 3),
+        "rejected": [{"name": name, "reason": reason} for name, reason in budget.rejected],
+        "archives": archives,
+        "files": list_files(student_path),
+    }
+    if budget.skipped:
+        log_entries.append(f"Skipped {budget.skipped} editor, system or build artifact entries")
+    if extracted or budget.rejected:
+        log_entries.append(f"Extracted {extracted} files ({budget.bytes_written} bytes) in {seconds:.2f}s, rejected {len(budget.rejected)} entries")
+    return log_entries, scores[student_dir], stats
+
+def has_archives(student_path):
+    return any(name.endswith(ARCHIVE_SUFFIXES) for name in os.listdir(student_path))
+
+def manifest_extraction(record):
+    # (log entries, score, stats) of a student from the manifest line an earlier run wrote
+    stats = {key: value for key, value in record.items() if key not in ("student", "score", "penalty", "archive_type", "log")}
+    return record.get("log", []), record["score"], stats
+
+def unzip_and_extract_student_submissions(main_dir, workers=None, budget_limits=(MAX_ENTRY_BYTES, MAX_TOTAL_BYTES, MAX_ENTRIES)):
+    extraction_logs = {}
+    scores = {}
+    extraction_stats = {}
+
+    student_dirs = [student_dir for student_dir in os.listdir(main_dir) if os.path.isdir(os.path.join(main_dir, student_dir))]
+    # One student per task, so a huge upload only holds up its own worker
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(extract_student, main_dir, student_dir, budget_limits) for student_dir in student_dirs]
+        for student_dir, future in zip(student_dirs, futures):
+            try:
+                extraction_logs[student_dir], scores[student_dir], extraction_stats[student_dir] = future.result()
+            except Exception as e:
+                extraction_logs[student_dir] = [f"Error extracting submission: {e}"]
+                scores[student_dir] = 100
+                extraction_stats[student_dir] = {"extracted": 0, "bytes": 0, "seconds": 0.0, "rejected": [], "archives": [], "files": []}
 
     # Return the logs and scores for further processing
-    return extraction_logs, scores
+    return extraction_logs, scores, extraction_stats
 
-def write_summary_log(main_dir, extraction_logs, scores):
+def write_summary_log(main_dir, extraction_logs, scores, extraction_stats=None, elapsed=None, reused=()):
+    # reused: students taken from an earlier manifest, left out of the throughput
     summary_log_path = os.path.join(main_dir, "extraction_summary.log")
     with open(summary_log_path, 'w') as log_file:
         for student, logs in extraction_logs.items():
@@ -101,14 +284,69 @@ def write_summary_log(main_dir, extraction_logs, scores):
             for log in logs:
                 log_file.write(f" - {log}\n")
             log_file.write(f"Score for {student}: {scores[student]} points\n\n")
+        if extraction_stats and elapsed:
+            extracted_stats = [stats for student, stats in extraction_stats.items() if student not in reused]
+            total_bytes = sum(stats["bytes"] for stats in extracted_stats)
+            log_file.write("Extraction throughput:\n")
+            if extracted_stats:
+                log_file.write(f" - {sum(stats['extracted'] for stats in extracted_stats)} files, {total_bytes} bytes in {elapsed:.2f}s ({total_bytes / elapsed / (1024*1024):.2f} MB/s)\n")
+                log_file.write(f" - Rejected entries: {sum(len(stats['rejected']) for stats in extracted_stats)}\n")
+            if reused:
+                log_file.write(f" - Taken from the earlier manifest: {len(reused)} students\n")
+    if extraction_stats is not None:
+        write_manifest(main_dir, scores, extraction_stats, extraction_logs)
+
+def write_manifest(main_dir, scores, extraction_stats, extraction_logs=None):
+    """Writes one JSON line per student for check.py.
+
+    Holds the same penalty and log lines as the text log plus the archives,
+    the extracted file list with sizes and sha256 hashes, and timing, so later
+    stages do not parse the log or hash the files again.
+    """
+    manifest_path = os.path.join(main_dir, MANIFEST_NAME)
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+        for student, stats in extraction_stats.items():
+            record = {
+                "student": student,
+                "score": scores[student],
+                "penalty": 100 - scores[student],
+                "archive_type": stats["archives"][0]["type"] if stats["archives"] else None,
+            }
+            if extraction_logs is not None:
+                record["log"] = extraction_logs[student]
+            record.update(stats)
+            manifest_file.write(json.dumps(record, ensure_ascii=False, sort_keys=True) + "\n")
+
+# ------------------------------------------------------------------ #
+
+def add_limit_arguments(parser):
+    parser.add_argument("--max-entry-mb", type=int, default=MAX_ENTRY_BYTES // (1024*1024), help="largest file extracted from an archive in MB (default: %(default)s)")
+    parser.add_argument("--max-total-mb", type=int, default=MAX_TOTAL_BYTES // (1024*1024), help="most data extracted for one student in MB (default: %(default)s)")
+    parser.add_argument("--max-entries", type=int, default=MAX_ENTRIES, help="most files extracted for one student (default: %(default)s)")
+
+def budget_limits(args):
+    return (args.max_entry_mb * 1024 * 1024, args.max_total_mb * 1024 * 1024, args.max_entries)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract the student archives found in the current directory.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of students extracted at the same time (default: number of cores)")
+    add_limit_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Directory containing all student folders
+    main_dir = os.getcwd()
 
-# Directory containing all student folders
-main_dir = os.getcwd()
+    # Run the function to unzip and extract submissions, and collect logs and scores
+    start = time.time()
+    extraction_logs, scores, extraction_stats = unzip_and_extract_student_submissions(main_dir, max(1, args.jobs), budget_limits(args))
 
-# Run the function to unzip and extract submissions, and collect logs and scores
-extraction_logs, scores = unzip_and_extract_student_submissions(main_dir)
+    # Write a summary log file with the extraction logs and scores for all students
+    write_summary_log(main_dir, extraction_logs, scores, extraction_stats, time.time() - start)
 
-# Write a summary log file with the extraction logs and scores for all students
-write_summary_log(main_dir, extraction_logs, scores)
+    print(f"Extraction summary log has been written to {os.path.join(main_dir, 'extraction_summary.log')}")
+    print(f"Extraction manifest has been written to {os.path.join(main_dir, MANIFEST_NAME)}")
 
-print(f"Extraction summary log has been written to {os.path.join(main_dir, 'extraction_summary.log')}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+LEAK_KINDS = {
+    "Leak_DefinitelyLost": "definitely_lost",
+    "Leak_IndirectlyLost": "indirectly_lost",
+    "Leak_PossiblyLost": "possibly_lost",
+    "Leak_StillReachable": "still_reachable",
+}
+TOP_FRAMES = 3
+SANITIZER_FLAGS = ["-fsanitize=address,leak", "-fno-omit-frame-pointer"]
+SANITIZER_LEAK_KINDS = {"Direct": "Leak_DefinitelyLost", "Indirect": "Leak_IndirectlyLost"}
+SANITIZER_LEAK_PATTERN = re.compile(r'^(Direct|Indirect) leak of (\d+) byte\(s\) in (\d+) object\(s\)')
+SANITIZER_ERROR_PATTERN = re.compile(r'^==\d+==ERROR: AddressSanitizer: ([\w-]+)')
+SANITIZER_FRAME_PATTERN = re.compile(r'^\s+#\d+ 0x[0-9a-f]+ in (\S+) (.*)$')
+
+def valgrind_command(exe_file, xml_fd):
+    # Leak records only show up in the XML with a full leak check; still reachable
+    # blocks are included because the old "no leaks are possible" check failed on them too
+    return ["valgrind", "--leak-check=full", "--show-leak-kinds=all", "--xml=yes", f"--xml-fd={xml_fd}", exe_file]
+
+# ------------------------------------------------------------------ #
+
+class LeakReport:
+    """What valgrind or the sanitizers found in one executable, as totals plus a few records.
+
+    status is "ok" when the run finished without leaks, "leaks" when blocks
+    were still allocated at exit, "timeout" when the program was stopped before
+    the leak summary was written and "error" when the check could not run.
+    """
+
+    def __init__(self, exe_file, tool="Valgrind"):
+        self.exe_file = exe_file
+        self.tool = tool
+        self.status = "ok"
+        self.message = None
+        self.bytes = Counter()  # Per leak kind: definitely_lost, indirectly_lost, ...
+        self.blocks = Counter()
+        self.errors = Counter()  # Non-leak error kinds: InvalidRead, UninitCondition, ...
+        self.records = []  # {"kind", "bytes", "blocks", "frames"} for leaks and errors
+
+    @property
+    def leaked_bytes(self):
+        return sum(self.bytes.values())
+
+    def add_record(self, kind, leaked_bytes, blocks, frames):
+        self.records.append({"kind": kind, "bytes": leaked_bytes, "blocks": blocks, "frames": frames})
+        if kind in LEAK_KINDS:
+            self.bytes[LEAK_KINDS[kind]] += leaked_bytes
+            self.blocks[LEAK_KINDS[kind]] += blocks
+            self.status = "leaks"
+        else:
+            self.errors[kind] += 1
+
+    def to_dict(self):
+        return {"exe_file": self.exe_file, "tool": self.tool, "status": self.status, "message": self.message, "records": self.records}
+
+    @classmethod
+    def from_dict(cls, data):
+        # Totals are rebuilt from the records, status is restored last since add_record sets it
+        report = cls(data["exe_file"], data.get("tool", "Valgrind"))
+        for record in data["records"]:
+            report.add_record(record["kind"], record["bytes"], record["blocks"], record["frames"])
+        report.status = data["status"]
+        report.message = data["message"]
+        return report
+
+    def __str__(self):
+        if self.status == "timeout":
+            return f"Timeout expired during {self.tool} check for {self.exe_file}"
+        if self.status == "error":
+            return f"{self.tool} could not check {self.exe_file}: {self.message}"
+        errors = ", ".join(f"{kind} x{count}" for kind, count in sorted(self.errors.items()))
+        if self.status == "ok":
+            return f"No memory leaks in {self.exe_file}" + (f" (errors: {errors})" if errors else "")
+        totals = ", ".join(f"{self.bytes[name]} bytes {name.replace('_', ' ')}" for name in LEAK_KINDS.values())
+        line = f"Memory leaks detected in {self.exe_file}: {totals} in {len([r for r in self.records if r['kind'] in LEAK_KINDS])} records"
+        if errors:
+            line += f"; errors: {errors}"
+        biggest = max((r for r in self.records if r['kind'] in LEAK_KINDS), key=lambda r: r['bytes'])
+        if biggest['frames']:
+            line += "\n\t\tlargest at " + " < ".join(biggest['frames'])
+        return line
+
+# ------------------------------------------------------------------ #
+
+class ValgrindXmlParser:
+    """Feeds valgrind's --xml-fd stream into a LeakReport as it arrives.
+
+    Each <error> element is turned into a record and dropped right away, so
+    memory does not grow with the number of errors.
+    """
+
+    def __init__(self, report):
+        self.report = report
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.root = None
+        self.complete = False
+        self.failed = False
+
+    def feed(self, data):
+        if self.failed:
+            return
+        try:
+            self.parser.feed(data)
+            for event, element in self.parser.read_events():
+                if event == "start" and self.root is None:
+                    self.root = element
+                elif event == "end" and element.tag == "error":
+                    self.handle_error(element)
+                    self.root.remove(element)
+                elif event == "end" and element is self.root:
+                    self.complete = True
+        except ET.ParseError as e:
+            self.failed = True
+            self.report.message = f"Unreadable valgrind XML: {e}"
+
+    def handle_error(self, element):
+        kind = element.findtext("kind", "Unknown")
+        leaked_bytes = int(element.findtext("xwhat/leakedbytes", "0"))
+        blocks = int(element.findtext("xwhat/leakedblocks", "0"))
+        self.report.add_record(kind, leaked_bytes, blocks, self.top_frames(element))
+
+    @staticmethod
+    def top_frames(element):
+        frames = []
+        for frame in element.findall("stack/frame"):
+            name = frame.findtext("fn") or frame.findtext("ip", "?")
+            if frame.findtext("file"):
+                name += f" ({frame.findtext('file')}:{frame.findtext('line', '?')})"
+            elif frame.findtext("obj"):
+                name += f" ({os.path.basename(frame.findtext('obj'))})"
+            frames.append(name)
+            if len(frames) == TOP_FRAMES:
+                break
+        return frames
+
+# ------------------------------------------------------------------ #
+
+def sanitizer_options(log_prefix):
+    # Reports go to <log_prefix>.<pid> instead of being mixed into the program's stderr
+    return f"log_path={log_prefix}:detect_leaks=1:halt_on_error=0"
+
+def parse_sanitizer_log(text, report):
+    """Adds the leaks and errors of an AddressSanitizer/LeakSanitizer log to report.
+
+    Leak kinds map onto valgrind's (direct leaks are definitely lost, indirect
+    ones indirectly lost) so both modes fill memory_leaks the same way.
+    """
+    frames = None  # Frames of the record being read, filled in by the lines that follow it
+    for line in text.splitlines():
+        leak = SANITIZER_LEAK_PATTERN.match(line)
+        error = SANITIZER_ERROR_PATTERN.match(line)
+        frame = SANITIZER_FRAME_PATTERN.match(line)
+        if leak:
+            frames = []
+            report.add_record(SANITIZER_LEAK_KINDS[leak.group(1)], int(leak.group(2)), int(leak.group(3)), frames)
+        elif error:
+            frames = []
+            report.add_record(error.group(1), 0, 0, frames)
+        elif frame and frames is not None and len(frames) < TOP_FRAMES:
+            function, location = frame.groups()
+            frames.append(f"{function} ({os.path.basename(location.strip('()').split('+')[0])})")
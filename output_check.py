@@ -0,0 +1,119 @@
+import os
+import re
+from capture import decode_output
+
+MAX_LINE_BYTES = 64 * 1024  # A longer line without a newline is checked in pieces
+
+# ------------------------------------------------------------------ #
+
+class OutputRule:
+    """What a step's stdout has to look like, from the "expect" entry of a test plan step.
+
+    patterns: regular expressions that have to be found in this order, several
+    may match on one line. lines / reference (a file next to the plan): the
+    exact expected lines. exact: no other lines allowed (the default for lines
+    and reference). forbidden: expressions no line may match. max_lines: more
+    output than this fails. points: deducted from the grade on a failure.
+    stop_on_fail: stop the program as soon as it has failed.
+    """
+
+    def __init__(self, data, base_dir=None):
+        expected_lines = data.get("lines")
+        if "reference" in data:
+            with open(os.path.join(base_dir or "", data["reference"])) as f:
+                expected_lines = f.read().splitlines()
+        if expected_lines is not None:
+            self.patterns = [re.compile(re.escape(line) + r"\Z") for line in expected_lines]
+        else:
+            self.patterns = [re.compile(pattern) for pattern in data.get("patterns", [])]
+        self.exact = data.get("exact", expected_lines is not None)
+        self.forbidden = [re.compile(pattern) for pattern in data.get("forbidden", [])]
+        self.max_lines = data.get("max_lines")
+        self.points = data.get("points", 0)
+        self.stop_on_fail = data.get("stop_on_fail", False)
+
+    @property
+    def checks_content(self):
+        # False for rules that only bound the amount of output
+        return bool(self.patterns or self.forbidden)
+
+    @property
+    def open_ended(self):
+        # Once every pattern matched, nothing printed later can fail the check
+        return not self.exact and not self.forbidden and self.max_lines is None
+
+class OutputChecker:
+    """Checks one process's stdout against an OutputRule while it is being read.
+
+    feed() gets every chunk as it arrives and checks the complete lines in it.
+    Once the verdict is certain the checker ignores the rest of the stream,
+    and with stop_on_fail the supervisor stops the program.
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.partial = b''
+        self.next_pattern = 0
+        self.lines = 0
+        self.verdict = None  # "pass" or "fail" once certain
+        self.message = None
+
+    @property
+    def stop_requested(self):
+        return self.verdict == "fail" and self.rule.stop_on_fail
+
+    def feed(self, data):
+        if self.verdict is not None:
+            return
+        self.partial += data
+        if b'\n' not in data and len(self.partial) < MAX_LINE_BYTES:
+            return
+        *lines, self.partial = self.partial.split(b'\n')
+        if len(self.partial) >= MAX_LINE_BYTES:
+            lines.append(self.partial)
+            self.partial = b''
+        for line in lines:
+            self.check_line(decode_output(line))
+            if self.verdict is not None:
+                return
+
+    def check_line(self, line):
+        self.lines += 1
+        for pattern in self.rule.forbidden:
+            if pattern.search(line):
+                return self.fail(f"line {self.lines} is not allowed: {line!r}")
+        patterns = self.rule.patterns
+        if self.rule.exact:
+            if self.next_pattern >= len(patterns):
+                return self.fail(f"unexpected line {self.lines}: {line!r}")
+            if not patterns[self.next_pattern].match(line):
+                return self.fail(f"line {self.lines}: expected {patterns[self.next_pattern].pattern!r}, got {line!r}")
+            self.next_pattern += 1
+        else:
+            position = 0
+            while self.next_pattern < len(patterns):
+                match = patterns[self.next_pattern].search(line, position)
+                if not match:
+                    break
+                position = match.end()
+                self.next_pattern += 1
+        if self.rule.max_lines is not None and self.lines > self.rule.max_lines:
+            return self.fail(f"more than {self.rule.max_lines} lines of output")
+        if self.rule.open_ended and self.next_pattern == len(patterns):
+            self.verdict = "pass"
+
+    def finish(self):
+        # Called once the stream ended
+        if self.verdict is None and self.partial:
+            self.check_line(decode_output(self.partial))
+            self.partial = b''
+        if self.verdict is not None:
+            return
+        if self.next_pattern < len(self.rule.patterns):
+            self.fail(f"output ended after {self.lines} lines without {self.rule.patterns[self.next_pattern].pattern!r}")
+        else:
+            self.verdict = "pass"
+
+    def fail(self, message):
+        self.verdict = "fail"
+        self.message = message
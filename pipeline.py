@@ -0,0 +1,290 @@
+import os
+import time
+import queue
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from clean import clean_folder, clean_name
+from extract import extract_student, has_archives, manifest_extraction, write_summary_log, add_limit_arguments, budget_limits, MANIFEST_NAME
+from check import (Student, build_arg_parser, compile_student, reusable_result, restore_student, start_run, student_summary,
+                   error_summary, similarity_section, contains_hebrew, stop_requested, finish_trace, read_extraction_manifest, RUBRIC_VERSION)
+from compile_cache import CompileCache
+from results_store import ResultsStore, input_hash
+from summarize import display_statistics, student_totals
+from tracing import tracer
+from timeouts import load_policy, save_samples
+from testplan import load_plan
+
+STAGES = ["prepare", "compile", "run", "leak-check", "summarize"]
+INTERRUPTIBLE_STAGES = ["prepare", "compile", "run"]  # A stop request skips these, later stages finish what was started
+END = None  # Queue marker after the last item
+
+# ------------------------------------------------------------------ #
+
+class PipelineItem:
+    # One student folder on its way through the stages
+    def __init__(self, index, folder_name):
+        self.index = index  # Position in the listdir order, the summary keeps it
+        self.folder_name = folder_name
+        self.student_dir = folder_name  # The cleaned name once the prepare stage ran
+        self.trace_name = clean_name(folder_name)  # Spans of every stage go under the cleaned name
+        self.extraction = None  # (log entries, score, stats) from extract_student
+        self.extraction_reused = False  # Taken from the manifest of an earlier run
+        self.hashes_time = 0
+        self.student = None
+        self.totals = None  # StudentTotals once the student is written, the Student is dropped then
+        self.stored = False  # Restored from the results store instead of graded
+        self.summary = None
+        self.completed = False
+        self.error = None
+        self.done = False  # Nothing left to do in the remaining stages
+        self.interrupted = False
+        self.timings = {}
+
+class Stage:
+    """Worker threads that take items from inbox, process them and put them on outbox.
+
+    Items that are done pass through untouched. The last worker to see the
+    end marker forwards it, so the next stage stops after it has drained
+    everything this one produced.
+    """
+
+    def __init__(self, name, function, workers, inbox, outbox):
+        self.name = name
+        self.function = function
+        self.inbox = inbox
+        self.outbox = outbox
+        self.remaining = workers
+        self.lock = threading.Lock()
+        self.started = None  # Wall clock of the first item this stage worked on and the last one it finished
+        self.finished = None
+        self.threads = [threading.Thread(target=self.work, name=f"{name}-{index}", daemon=True) for index in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    @property
+    def wall_time(self):
+        # From the first item started to the last one finished; for later stages it includes waiting for the earlier ones
+        return self.finished - self.started if self.started is not None else 0
+
+    def work(self):
+        while True:
+            item = self.inbox.get()
+            if item is END:
+                self.inbox.put(END)  # For the other workers of this stage
+                with self.lock:
+                    self.remaining -= 1
+                    last = self.remaining == 0
+                if last:
+                    self.outbox.put(END)
+                return
+            if not item.done and stop_requested.is_set() and self.name in INTERRUPTIBLE_STAGES:
+                item.interrupted = True
+                item.done = True
+            if not item.done:
+                started = time.time()
+                with self.lock:
+                    self.started = min(self.started or started, started)
+                try:
+                    with tracer.span(self.name, item.trace_name):
+                        self.function(item)
+                except Exception as e:
+                    logging.exception(f"Error in the {self.name} stage for {item.student_dir}")
+                    item.error = e
+                    item.done = True
+                finished = time.time()
+                item.timings[self.name] = finished - started
+                with self.lock:
+                    self.finished = max(self.finished or finished, finished)
+            self.outbox.put(item)
+
+# ------------------------------------------------------------------ #
+
+class Pipeline:
+    """clean -> extract -> compile -> run -> leak-check -> summarize, one student at a time per worker.
+
+    Each stage has its own workers and a bounded queue in front of it, so one
+    student can be compiling while the next is still being extracted and an
+    earlier one runs its tests. The main thread collects finished students
+    and writes them to the summary in listdir order.
+    """
+
+    def __init__(self, main_dir, args, results_store, run_id, resumed, compile_cache, leak_check_pool, timeout_policy):
+        self.main_dir = main_dir
+        self.args = args
+        self.results_store = results_store
+        self.run_id = run_id
+        self.resumed = resumed
+        self.compile_cache = compile_cache
+        self.leak_check_pool = leak_check_pool
+        self.timeout_policy = timeout_policy
+        self.limits = budget_limits(args)
+        self.stages = {}  # Stage name -> Stage once started
+        # Folders an earlier run extracted have lost their archives and nested folders, extracting them again would lose their penalties
+        manifest_path = os.path.join(main_dir, MANIFEST_NAME)
+        self.manifest = read_extraction_manifest(manifest_path) if os.path.exists(manifest_path) else {}
+        self.manifest_time = os.path.getmtime(manifest_path) if self.manifest else 0
+
+    def prepare(self, item):
+        try:
+            item.student_dir = clean_folder(self.main_dir, item.folder_name)
+        except OSError as e:
+            logging.error(f"Could not rename {item.folder_name}: {e}")
+        record = self.manifest.get(item.student_dir)
+        if record is not None and not has_archives(os.path.join(self.main_dir, item.student_dir)):
+            item.extraction = manifest_extraction(record)
+            item.extraction_reused = True
+            item.hashes_time = self.manifest_time
+        else:
+            item.extraction = extract_student(self.main_dir, item.student_dir, self.limits)
+            item.hashes_time = time.time()
+        if not contains_hebrew(item.student_dir):
+            item.done = True  # Not a student folder, only its extraction is logged
+
+    def compile(self, item):
+        log_entries, score, stats = item.extraction
+        student = Student(item.student_dir, self.args, self.compile_cache, self.leak_check_pool, self.timeout_policy)
+        student.extraction_penalty = 100 - score
+        student.file_hashes = {file["path"]: file["sha256"] for file in stats["files"]}
+        settings = (student.extraction_penalty, self.args.memcheck, student.plan.digest, self.args.rlimit_cpu, self.args.rlimit_as,
+                    self.args.adaptive_timeouts)
+        student.source_hash = input_hash(student.student_dir, student.file_hashes, item.hashes_time, settings)
+        item.student = student
+        stored = reusable_result(self.results_store, student, self.args, self.resumed)
+        if stored is not None:
+            item.summary, item.completed = restore_student(student, stored)
+            item.stored = True
+            item.done = True
+            return
+        compile_student(student)
+
+    def run(self, item):
+        logging.info(f"Processing: {item.student_dir}")
+        item.student.just_run_all()
+        if self.args.memcheck == "asan":
+            item.student.record_sanitizer_reports()
+
+    def leak_check(self, item):
+        if self.args.memcheck == "valgrind":
+            item.student.valgrind_check_all()
+
+    def summarize(self, item):
+        item.student.read_source_header()
+        item.summary = student_summary(item.student)
+        item.completed = True
+
+    def start(self, folder_names):
+        functions = {"prepare": self.prepare, "compile": self.compile, "run": self.run, "leak-check": self.leak_check, "summarize": self.summarize}
+        workers = {"prepare": self.args.extract_jobs, "compile": self.args.compile_jobs, "run": self.args.jobs, "leak-check": self.args.jobs, "summarize": 1}
+        queues = [queue.Queue(maxsize=2 * max(1, workers[name])) for name in STAGES] + [queue.Queue()]
+        self.stages = {name: Stage(name, functions[name], max(1, workers[name]), queues[index], queues[index + 1]) for index, name in enumerate(STAGES)}
+        for stage in self.stages.values():
+            stage.start()
+
+        def feed():
+            for index, folder_name in enumerate(folder_names):
+                queues[0].put(PipelineItem(index, folder_name))
+            queues[0].put(END)
+        threading.Thread(target=feed, name="feed", daemon=True).start()
+        return queues[-1]
+
+    def finish(self, item):
+        # Runs on the main thread: saves a graded student and returns its summary text, None for non-students
+        if item.interrupted:
+            if not contains_hebrew(clean_name(item.student_dir)):
+                return None
+            return error_summary(item.student_dir, "grading interrupted, run again with --resume")
+        if item.error is not None and item.student is None:
+            return error_summary(item.student_dir, item.error) if contains_hebrew(item.student_dir) else None
+        if item.student is None:
+            return None
+        if item.error is not None:
+            item.summary, item.completed = error_summary(item.student_dir, item.error), False
+        if not item.stored:
+            self.results_store.save(item.student_dir, item.student.source_hash, RUBRIC_VERSION, item.completed,
+                                    item.student.to_dict() if item.completed else {"summary": item.summary}, self.run_id)
+        return item.summary
+
+# ------------------------------------------------------------------ #
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(parents=[build_arg_parser(add_help=False)],
+                                     description="Clean, extract, compile, run and summarize the ex4 submissions in the current directory as one pipeline.")
+    parser.add_argument("--extract-jobs", type=int, default=os.cpu_count() or 1, help="number of students cleaned and extracted at the same time (default: number of cores)")
+    add_limit_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.summary_only:
+        parser.error("--summary-only does not run the pipeline, use check.py --summary-only")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.trace:
+        tracer.record_events()
+    main_dir = os.getcwd()
+    folder_names = [name for name in os.listdir(main_dir) if os.path.isdir(os.path.join(main_dir, name))]
+    final_summary_file_path = os.path.join(main_dir, f"final_summary_{load_plan(args.plan).name}.log")
+    compile_cache = None
+    if not args.no_compile_cache:
+        compile_cache = CompileCache(args.compile_cache, args.compile_cache_size * 1024 * 1024)
+    leak_check_pool = ThreadPoolExecutor(max_workers=max(1, args.valgrind_jobs)) if args.memcheck == "valgrind" else None
+    results_store = ResultsStore(os.path.join(main_dir, args.results_db))
+    run_id, resumed = start_run(results_store, args, argv)
+    timeout_policy = load_policy(results_store, args.adaptive_timeouts)
+
+    start = time.time()
+    pipeline = Pipeline(main_dir, args, results_store, run_id, resumed, compile_cache, leak_check_pool, timeout_policy)
+    finished = pipeline.start(folder_names)
+
+    # Students finish out of order; each summary is written once all students before it are written
+    items = [None] * len(folder_names)
+    summaries = {}
+    next_index = 0
+    partial_summary_file_path = final_summary_file_path + ".partial"
+    with open(partial_summary_file_path, 'w') as final_summary_file:
+        while True:
+            item = finished.get()
+            if item is END:
+                break
+            items[item.index] = item
+            summaries[item.index] = pipeline.finish(item)
+            if item.student is not None and not item.interrupted:
+                item.totals = student_totals(item.student)
+            item.student = None
+            while next_index in summaries:
+                if summaries[next_index]:
+                    final_summary_file.write(summaries[next_index])
+                del summaries[next_index]
+                next_index += 1
+        student_dirs = [item.student_dir for item in items if item.extraction is not None and contains_hebrew(item.student_dir)]
+        final_summary_file.write(similarity_section(results_store, main_dir, student_dirs, args))
+    os.replace(partial_summary_file_path, final_summary_file_path)
+    elapsed = time.time() - start
+
+    prepared = [item for item in items if item.extraction is not None]
+    write_summary_log(main_dir, {item.student_dir: item.extraction[0] for item in prepared}, {item.student_dir: item.extraction[1] for item in prepared},
+                      {item.student_dir: item.extraction[2] for item in prepared}, pipeline.stages["prepare"].wall_time,
+                      {item.student_dir for item in prepared if item.extraction_reused})
+
+    if leak_check_pool:
+        leak_check_pool.shutdown()
+    interrupted = [item for item in items if item.interrupted]
+    if interrupted:
+        logging.warning(f"Interrupted with {len(interrupted)} students left, run again with --resume to grade them")
+    elif run_id is not None:
+        results_store.finish_run(run_id)
+    save_samples(results_store, timeout_policy)
+    results_store.close()
+
+    for name in STAGES:
+        busy = sum(item.timings.get(name, 0) for item in items)
+        logging.info(f"Stage {name}: {busy:.2f}s busy over {len(folder_names)} folders")
+    logging.info(f"Pipeline finished in {elapsed:.2f}s")
+    display_statistics([item.totals for item in items if item.totals is not None], sum(1 for item in items if item.completed), compile_cache)
+    finish_trace(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import os
+import stat
+import signal
+import time
+import subprocess
+import threading
+import logging
+from collections import namedtuple
+
+SYSVIPC_MSG_PATH = "/proc/sysvipc/msg"
+# Kernel wait channels of a process stuck on a pipe/FIFO or a message queue
+MSGQUEUE_WCHAN_MARKERS = ("msgrcv", "msgsnd", "msg_rcv", "msg_snd")
+BLOCKING_WCHAN_MARKERS = ("pipe", "wait_for_partner", "fifo") + MSGQUEUE_WCHAN_MARKERS
+CHILD_WAIT_WCHAN = "do_wait"  # A parent in wait() is stuck exactly when its children are
+
+MsgQueue = namedtuple("MsgQueue", ["key", "msqid", "lspid", "lrpid"])
+ProcStat = namedtuple("ProcStat", ["pid", "state", "ppid", "pgrp", "session", "cpu_ticks", "name"])
+
+# ------------------------------------------------------------------ #
+
+def read_proc_stat(pid):
+    # Returns None once the process is gone
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            content = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces and parentheses, the fields start after the last ')'
+    fields = content[content.rindex(')') + 2:].split()
+    name = content[content.index('(') + 1:content.rindex(')')]
+    return ProcStat(pid, fields[0], int(fields[1]), int(fields[2]), int(fields[3]), int(fields[11]) + int(fields[12]), name)
+
+def read_wchan(pid):
+    try:
+        with open(f"/proc/{pid}/wchan", 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def is_blocking_wchan(wchan):
+    return bool(wchan) and any(marker in wchan for marker in BLOCKING_WCHAN_MARKERS)
+
+def waits_on_msgqueue(session):
+    # True when a process of the session sleeps in msgrcv/msgsnd; False also where /proc hides wait channels
+    for proc_stat in session_processes({session}):
+        wchan = read_wchan(proc_stat.pid)
+        if wchan and any(marker in wchan for marker in MSGQUEUE_WCHAN_MARKERS):
+            return True
+    return False
+
+def session_processes(sessions):
+    # Live (non-zombie) processes whose session is one of the given ones
+    processes = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        proc_stat = read_proc_stat(int(entry))
+        if proc_stat is not None and proc_stat.session in sessions and proc_stat.state != 'Z':
+            processes.append(proc_stat)
+    return processes
+
+def signal_process_group(pgid, signum=signal.SIGKILL):
+    # Programs run with start_new_session=True, so the leader's PID is also the group ID
+    try:
+        os.killpg(pgid, signum)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+def sweep_sessions(sessions, max_passes=5):
+    """Kills every process still alive in one of the given sessions.
+
+    Returns (number of processes killed, CPU seconds they had used). Several
+    passes are made so that children forked while we were killing are caught.
+    """
+    sessions = set(sessions)
+    killed = set()
+    cpu_ticks = 0
+    for _ in range(max_passes):
+        processes = session_processes(sessions)
+        for proc_stat in processes:
+            try:
+                os.kill(proc_stat.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                continue
+            if proc_stat.pid not in killed:
+                killed.add(proc_stat.pid)
+                cpu_ticks += proc_stat.cpu_ticks
+        if not processes:
+            break
+        time.sleep(0.01)
+    return len(killed), cpu_ticks / os.sysconf("SC_CLK_TCK")
+
+# ------------------------------------------------------------------ #
+
+def list_msg_queues():
+    # Parse /proc/sysvipc/msg into {msqid: MsgQueue}
+    queues = {}
+    try:
+        with open(SYSVIPC_MSG_PATH, 'r') as f:
+            header = f.readline().split()
+            for line in f:
+                fields = dict(zip(header, line.split()))
+                if "msqid" not in fields:
+                    continue
+                msqid = int(fields["msqid"])
+                queues[msqid] = MsgQueue(int(fields["key"]), msqid, int(fields.get("lspid", 0)), int(fields.get("lrpid", 0)))
+    except OSError as e:
+        logging.error(f"Failed to read {SYSVIPC_MSG_PATH}: {e}")
+    return queues
+
+def remove_msg_queues(msqids):
+    removed = []
+    for msqid in msqids:
+        try:
+            subprocess.run(["ipcrm", "-q", str(msqid)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            removed.append(msqid)
+        except subprocess.CalledProcessError as e:
+            # The owner may have removed it between listing and ipcrm
+            logging.debug(f"Failed to remove message queue {msqid}: {e.stderr}")
+    return removed
+
+def fifos_exist(directory, names):
+    for name in names:
+        try:
+            if not stat.S_ISFIFO(os.stat(os.path.join(directory, name)).st_mode):
+                return False
+        except OSError:
+            return False
+    return True
+
+def ftok_suffix(path):
+    # The low 24 bits ftok(path, id) puts in a key: device and inode numbers, the id takes the top byte
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev & 0xff) << 16 | (st.st_ino & 0xffff)
+
+# ------------------------------------------------------------------ #
+
+_active_scopes = set()
+_active_scopes_lock = threading.Lock()
+
+class MsgQueueScope:
+    """Tracks the message queues created while one student's programs run.
+
+    Queues that existed when the scope was opened are never touched. A new
+    queue is owned by this scope when its last sender or receiver PID (the
+    owner PIDs recorded in /proc/sysvipc/msg) belongs to a process we started
+    or to anything it forked. Every started process leads its own session, so
+    the members of those sessions are collected whenever the scope looks at
+    the queues and from the supervisor's samples; a child that used a queue
+    and exited between two looks is missed. Queues nobody has used yet carry
+    no PID, so they are only claimed when no other scope was open at the same
+    time, or when their key is what ftok() gives for one of key_paths. Only
+    the scope of a group that makes queues should get key_paths: while two
+    open scopes share one, neither claims unused queues by that key.
+    """
+
+    def __init__(self, name, key_paths=()):
+        self.name = name
+        # ftok() keys of our programs' cwd and directory; a queue made with one of them is ours before anyone used it
+        self.key_suffixes = {ftok_suffix(path) for path in key_paths} - {None}
+        self.shared_suffixes = set()  # Keys another scope open at the same time claims too
+        self.leaders = []  # PIDs of the started processes in start order, each also its session ID
+        self.pids = set()  # Leaders and every member of their sessions seen so far
+        self.exclusive = True
+        self.baseline = set(list_msg_queues())
+        with _active_scopes_lock:
+            if _active_scopes:
+                self.exclusive = False
+                for scope in _active_scopes:
+                    scope.exclusive = False
+                    shared = scope.key_suffixes & self.key_suffixes
+                    scope.shared_suffixes |= shared
+                    self.shared_suffixes |= shared
+            _active_scopes.add(self)
+
+    def track(self, pid):
+        self.leaders.append(pid)
+        self.pids.add(pid)
+
+    def refresh(self, processes=None):
+        # Remembers the live members of our sessions, processes is a session_processes() list the caller already has
+        if processes is None:
+            processes = session_processes(set(self.leaders))
+        self.pids.update(proc_stat.pid for proc_stat in processes)
+
+    def group_queues(self):
+        # New queues that are certainly ours: used by one of our processes, or unused with one of our ftok() keys
+        self.refresh()
+        key_suffixes = self.key_suffixes - self.shared_suffixes
+        return [msqid for msqid, queue in list_msg_queues().items()
+                if msqid not in self.baseline and (queue.lspid in self.pids or queue.lrpid in self.pids
+                                                   or (queue.lspid == 0 and queue.lrpid == 0 and queue.key & 0xffffff in key_suffixes))]
+
+    def owned_queues(self):
+        owned = self.group_queues()
+        if self.exclusive:
+            owned.extend(msqid for msqid, queue in list_msg_queues().items()
+                         if msqid not in self.baseline and msqid not in owned and queue.lspid == 0 and queue.lrpid == 0)
+        return owned
+
+    def cleanup(self):
+        with _active_scopes_lock:
+            _active_scopes.discard(self)
+        removed = remove_msg_queues(self.owned_queues())
+        if removed:
+            logging.info(f"Removed message queues {removed} created by {self.name}")
+        return removed
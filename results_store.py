@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import hashlib
+
+SOURCE_SUFFIXES = (".c", ".h")
+
+def input_hash(student_dir, file_hashes=None, hashes_time=0, extra=()):
+    """Hash of everything a student's grade depends on.
+
+    Covers the sources and README in the student directory plus extra values
+    such as the extraction penalty. Hashes from the extraction manifest
+    (written at hashes_time) are used for files not modified since; other
+    files are read and hashed here.
+    """
+    file_hashes = file_hashes or {}
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(student_dir)):
+        path = os.path.join(student_dir, name)
+        if not os.path.isfile(path) or not (name.endswith(SOURCE_SUFFIXES) or name.lower().startswith("readme")):
+            continue
+        file_digest = file_hashes.get(name)
+        if file_digest is None or os.path.getmtime(path) > hashes_time:
+            with open(path, 'rb') as f:
+                file_digest = hashlib.sha256(f.read()).hexdigest()
+        digest.update(f"{name}\0{file_digest}\0".encode())
+    for value in extra:
+        digest.update(f"{value}\0".encode())
+    return digest.hexdigest()
+
+# ------------------------------------------------------------------ #
+
+class ResultsStore:
+    """SQLite table of graded students, one row per student directory.
+
+    A row holds the student's fields as JSON together with the input hash and
+    rubric version they were graded with, so a later run can tell which
+    students have to be graded again. Calls from several threads are
+    serialized, and every row is written in its own transaction, so a batch
+    killed halfway keeps every finished student. The runs table records each
+    batch; a run without finished_at was interrupted and can be resumed. The
+    signatures table caches the MinHash signature of every student's sources,
+    the runtimes table the wall times timeout budgets are learned from.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # The timeout waits out the other processes saving to the same file, such as --worker processes
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    student_dir TEXT PRIMARY KEY,
+                    input_hash TEXT NOT NULL,
+                    rubric_version INTEGER NOT NULL,
+                    completed INTEGER NOT NULL,
+                    graded_at REAL NOT NULL,
+                    data TEXT NOT NULL,
+                    run_id INTEGER
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at REAL NOT NULL,
+                    finished_at REAL,
+                    settings TEXT NOT NULL
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS signatures (
+                    student_dir TEXT PRIMARY KEY,
+                    source_hash TEXT NOT NULL,
+                    seed INTEGER NOT NULL,
+                    signature TEXT NOT NULL
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS runtimes (
+                    program TEXT NOT NULL,
+                    seconds REAL NOT NULL
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS runtimes_program ON runtimes (program)")
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(results)")]
+            if "run_id" not in columns:
+                self.connection.execute("ALTER TABLE results ADD COLUMN run_id INTEGER")  # Stores written before runs were tracked
+
+    def start_run(self, settings):
+        with self.lock, self.connection:
+            cursor = self.connection.execute("INSERT INTO runs (started_at, settings) VALUES (?, ?)", (time.time(), json.dumps(settings)))
+        return cursor.lastrowid
+
+    def unfinished_run(self):
+        # The latest run, if it never finished
+        with self.lock:
+            row = self.connection.execute("SELECT run_id, finished_at FROM runs ORDER BY run_id DESC LIMIT 1").fetchone()
+            return row[0] if row and row[1] is None else None
+
+    def finish_run(self, run_id):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def graded_in_run(self, run_id):
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT student_dir FROM results WHERE run_id = ?", (run_id,))}
+
+    def lookup(self, student_dir):
+        # (input_hash, rubric_version, completed, data) or None
+        with self.lock:
+            row = self.connection.execute("SELECT input_hash, rubric_version, completed, data FROM results WHERE student_dir = ?", (student_dir,)).fetchone()
+            if row is None:
+                return None
+            return row[0], row[1], bool(row[2]), json.loads(row[3])
+
+    def is_current(self, student_dir, student_hash, rubric_version):
+        stored = self.lookup(student_dir)
+        return stored is not None and stored[:3] == (student_hash, rubric_version, True)
+
+    def save(self, student_dir, student_hash, rubric_version, completed, data, run_id=None):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results (student_dir, input_hash, rubric_version, completed, graded_at, data, run_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (student_dir, student_hash, rubric_version, int(completed), time.time(), json.dumps(data, ensure_ascii=False), run_id))
+
+    def load_signatures(self, seed):
+        # {student_dir: (source hash, MinHash signature)} of the similarity index, see similarity.find_clusters
+        with self.lock:
+            rows = self.connection.execute("SELECT student_dir, source_hash, signature FROM signatures WHERE seed = ?", (seed,)).fetchall()
+        return {row[0]: (row[1], json.loads(row[2])) for row in rows}
+
+    def save_signature(self, student_dir, source_hash, seed, signature):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO signatures (student_dir, source_hash, seed, signature) VALUES (?, ?, ?, ?)",
+                                    (student_dir, source_hash, seed, json.dumps(signature)))
+
+    def load_runtimes(self, limit):
+        # {program: wall seconds of its latest clean runs}, see timeouts.TimeoutPolicy
+        with self.lock:
+            rows = self.connection.execute("SELECT program, seconds FROM runtimes ORDER BY rowid DESC").fetchall()
+        runtimes = {}
+        for program, seconds in rows:
+            if len(runtimes.setdefault(program, [])) < limit:
+                runtimes[program].append(seconds)
+        return runtimes
+
+    def save_runtimes(self, samples, limit):
+        # Appends (program, seconds) samples and keeps the latest limit of every program
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT INTO runtimes (program, seconds) VALUES (?, ?)", samples)
+            for program in {program for program, seconds in samples}:
+                self.connection.execute("DELETE FROM runtimes WHERE program = ? AND rowid NOT IN "
+                                        "(SELECT rowid FROM runtimes WHERE program = ? ORDER BY rowid DESC LIMIT ?)", (program, program, limit))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,186 @@
+import os
+import re
+import random
+import hashlib
+import logging
+
+SHINGLE_SIZE = 5  # Tokens per shingle
+NUM_HASHES = 128  # MinHash signature length
+BANDS = 32  # LSH bands of NUM_HASHES // BANDS rows; pairs above ~0.4 similarity usually share a band
+MINHASH_SEED = 4  # Signatures from different seeds cannot be compared, so it is part of every cached row
+MERSENNE_PRIME = (1 << 61) - 1
+DEFAULT_THRESHOLD = 0.8
+LISTED_PAIRS = 10  # Most similar pairs shown per cluster
+
+C_KEYWORDS = {
+    "auto", "break", "case", "char", "const", "continue", "default", "do", "double", "else", "enum", "extern", "float", "for", "goto",
+    "if", "inline", "int", "long", "register", "restrict", "return", "short", "signed", "sizeof", "static", "struct", "switch",
+    "typedef", "union", "unsigned", "void", "volatile", "while",
+}
+TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<preprocessor>^[ \t]*\#[^\n]*)
+  | (?P<string>"(?:\\.|[^"\\\n])*")
+  | (?P<char>'(?:\\.|[^'\\\n])*')
+  | (?P<number>\b\d[\w.]*)
+  | (?P<identifier>\b[A-Za-z_]\w*)
+  | (?P<operator>->|\+\+|--|<<=|>>=|<<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^]=|[-+*/%&|^!~<>=?:;,.(){}\[\]])
+""", re.DOTALL | re.MULTILINE | re.VERBOSE)
+
+# ------------------------------------------------------------------ #
+
+def tokenize(text):
+    """C tokens with everything a copy can change for free normalized away.
+
+    Comments and preprocessor lines are dropped, every identifier that is not
+    a keyword becomes ID, and literals become STR, CHR and NUM, so renaming
+    variables or rewording printf strings does not change the token stream.
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind in ("comment", "preprocessor"):
+            continue
+        if kind == "identifier":
+            tokens.append(match.group() if match.group() in C_KEYWORDS else "ID")
+        elif kind == "string":
+            tokens.append("STR")
+        elif kind == "char":
+            tokens.append("CHR")
+        elif kind == "number":
+            tokens.append("NUM")
+        else:
+            tokens.append(match.group())
+    return tokens
+
+def shingles(tokens):
+    # 64-bit hashes of every SHINGLE_SIZE window; blake2b so they are the same in every process
+    return {int.from_bytes(hashlib.blake2b(" ".join(tokens[index:index + SHINGLE_SIZE]).encode(), digest_size=8).digest(), 'little')
+            for index in range(max(1, len(tokens) - SHINGLE_SIZE + 1))} if tokens else set()
+
+class MinHasher:
+    # NUM_HASHES universal hash functions (a*x + b) mod p; the minimum of each over a shingle set is the signature
+    def __init__(self, num_hashes=NUM_HASHES, seed=MINHASH_SEED):
+        rng = random.Random(seed)
+        self.coefficients = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_hashes)]
+
+    def signature(self, shingle_set):
+        values = list(shingle_set)
+        prime = MERSENNE_PRIME
+        return [min([(a * value + b) % prime for value in values]) for a, b in self.coefficients]
+
+def estimated_similarity(first, second):
+    # Share of equal signature positions, an estimate of the Jaccard similarity of the shingle sets
+    return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+# ------------------------------------------------------------------ #
+
+class LshIndex:
+    """Locality-sensitive hashing over MinHash signatures.
+
+    Each signature is cut into bands; two students become a candidate pair
+    when any band matches exactly. Adding a student costs one dict lookup per
+    band, so a class is indexed in linear time instead of comparing all pairs.
+    """
+
+    def __init__(self, bands=BANDS):
+        self.bands = bands
+        self.buckets = {}
+
+    def add(self, key, signature):
+        # Indexes key, returns the keys it shares a band with
+        rows = len(signature) // self.bands
+        candidates = set()
+        for band in range(self.bands):
+            bucket = self.buckets.setdefault((band, tuple(signature[band * rows:(band + 1) * rows])), [])
+            candidates.update(bucket)
+            bucket.append(key)
+        return candidates
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, key):
+        self.parent.setdefault(key, key)
+        while self.parent[key] != key:
+            self.parent[key] = self.parent[self.parent[key]]
+            key = self.parent[key]
+        return key
+
+    def union(self, first, second):
+        self.parent[self.find(first)] = self.find(second)
+
+# ------------------------------------------------------------------ #
+
+def read_sources(student_path):
+    # (sha256 of the student's .c files, their text) in name order
+    digest = hashlib.sha256()
+    texts = []
+    for name in sorted(os.listdir(student_path)):
+        path = os.path.join(student_path, name)
+        if name.endswith(".c") and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+            digest.update(f"{name}\0".encode() + content + b"\0")
+            texts.append(content.decode('utf-8', errors='replace'))
+    return digest.hexdigest(), texts
+
+def find_clusters(student_paths, results_store, threshold=DEFAULT_THRESHOLD):
+    """Groups students whose normalized sources are near duplicates.
+
+    student_paths maps student directory names to their paths. Signatures are
+    cached in the results store by the hash of the sources, so only new or
+    changed submissions are tokenized. Every cached student is indexed too,
+    so a late submission is compared with everyone graded before it.
+    Returns [(members, [(first, second, similarity), ...])], biggest first.
+    """
+    hasher = MinHasher()
+    cached = results_store.load_signatures(MINHASH_SEED)
+    signatures = {student_dir: signature for student_dir, (source_hash, signature) in cached.items()}
+    computed = 0
+    for student_dir, student_path in student_paths.items():
+        source_hash, texts = read_sources(student_path)
+        if not texts:
+            signatures.pop(student_dir, None)
+            continue
+        if student_dir in cached and cached[student_dir][0] == source_hash:
+            continue
+        shingle_set = set().union(*(shingles(tokenize(text)) for text in texts))
+        if not shingle_set:
+            continue
+        signatures[student_dir] = hasher.signature(shingle_set)
+        results_store.save_signature(student_dir, source_hash, MINHASH_SEED, signatures[student_dir])
+        computed += 1
+    logging.info(f"Similarity signatures: {computed} computed, {len(signatures) - computed} from the cache")
+
+    index = LshIndex()
+    groups = UnionFind()
+    pairs = []
+    for student_dir in sorted(signatures):
+        for other in index.add(student_dir, signatures[student_dir]):
+            if groups.find(other) == groups.find(student_dir):
+                continue  # Already linked through someone else, keeps a big cluster of copies from costing n^2 comparisons
+            similarity = estimated_similarity(signatures[student_dir], signatures[other])
+            if similarity >= threshold:
+                pairs.append((other, student_dir, similarity))
+                groups.union(other, student_dir)
+    clusters = {}
+    for first, second, similarity in pairs:
+        clusters.setdefault(groups.find(first), []).append((first, second, similarity))
+    result = []
+    for cluster_pairs in clusters.values():
+        members = sorted({name for first, second, similarity in cluster_pairs for name in (first, second)})
+        result.append((members, sorted(cluster_pairs, key=lambda pair: pair[2], reverse=True)))
+    return sorted(result, key=lambda cluster: len(cluster[0]), reverse=True)
+
+def format_clusters(clusters, threshold=DEFAULT_THRESHOLD):
+    lines = [f"Similarity Clusters (estimated similarity >= {threshold:.2f} of normalized token {SHINGLE_SIZE}-grams):"]
+    for number, (members, pairs) in enumerate(clusters, 1):
+        lines.append(f"\tCluster {number} ({len(members)} students): {', '.join(members)}")
+        lines.extend(f"\t\t{first} ~ {second}: {similarity:.2f}" for first, second, similarity in pairs[:LISTED_PAIRS])
+        if len(pairs) > LISTED_PAIRS:
+            lines.append(f"\t\t... {len(pairs) - LISTED_PAIRS} more pairs")
+    if not clusters:
+        lines.append("\tNone")
+    return "\n".join(lines) + "\n" + "=" * 40 + "\n\n"
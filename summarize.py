@@ -1,4 +1,9 @@
+import math
+from collections import namedtuple
 
+PERCENTILES = [0.5, 0.9, 0.99]
+BUSY_WAIT_CPU_SHARE = 0.8  # A run that used this share of its wall time as CPU...
+BUSY_WAIT_MIN_SECONDS = 1.0  # ...for at least this long probably spins instead of blocking in msgrcv/read
 
 
 def do_summarize(student, summary_type="default"):
@@ -34,7 +39,7 @@ def generate_default_summary(student):
     def format_error(field,summary_lines,field_name):
         summary_lines.append(f"{field_name} Errors:")
         if field:
-            summary_lines.extend(["\t- " + error for error in field])
+            summary_lines.extend(["\t- " + str(error) for error in field])
         else:
             summary_lines.append("\tNone")
         summary_lines.append("")
@@ -44,19 +49,50 @@ def generate_default_summary(student):
     format_error(student.memory_leaks,summary_lines,"Memory Leaks")
     format_error(student.catched_errors,summary_lines,"Catched")
 
+    # Output checks, only the failed ones are listed
+    summary_lines.append("Output Checks:")
+    failed = [check for check in student.output_checks if check["verdict"] != "pass"]
+    if student.output_checks:
+        summary_lines.append(f"\tPassed {len(student.output_checks) - len(failed)} of {len(student.output_checks)}")
+    else:
+        summary_lines.append("\tNone")
+    for check in failed:
+        summary_lines.append(f"\t- {check['program']}: {check['message']}" + (f" (-{check['points']} points)" if check["points"] else ""))
+    summary_lines.append("")
+
     # Program Outputs
     summary_lines.append("Program Outputs:")
     if student.output:
         for program, output in student.output:
             summary_lines.append(f"\tOutput for {program}:")
             # Show first few lines of output with an indication there's more
-            output_preview = "\n".join(output.splitlines()[:7])
-            summary_lines.extend(["\t\t" + line for line in output_preview.splitlines()])
-            summary_lines.append("\t\t... (more lines follow)")
+            summary_lines.extend(["\t\t" + line for line in output.head[:7]])
+            if output.lines > 7:
+                summary_lines.append(f"\t\t... ({output.lines - 7} more lines follow, {output.bytes} bytes, sha256 {output.sha256[:16]})")
+            if output.spill_path:
+                summary_lines.append(f"\t\tFull output: {output.spill_path}")
     else:
         summary_lines.append("\tNone")
     summary_lines.append("")
 
+    # Resource usage of every test run
+    summary_lines.append("Resource Usage:")
+    runs = run_usage(student.test_results)
+    for label, cpu, wall, rss_kb, voluntary, involuntary in runs:
+        line = f"\t{label}: {cpu:.2f}s CPU in {wall:.2f}s, max RSS {rss_kb / 1024:.1f} MB, {voluntary}/{involuntary} context switches"
+        if is_busy_wait(cpu, wall):
+            line += " (possible busy wait)"
+        summary_lines.append(line)
+    if not runs:
+        summary_lines.append("\tNone")
+    for hit in student.timeout_hits:
+        summary_lines.append(f"\t{hit['program']}: stopped by its adaptive time budget of {hit['budget']:.2f}s (fixed {hit['fixed']}s)")
+    summary_lines.append("")
+
+    if student.orphans_reaped:
+        summary_lines.append(f"Leftover processes killed: {student.orphans_reaped} (used {student.orphan_cpu_time:.2f}s CPU)")
+        summary_lines.append("")
+
     # Final summary
     summary_lines.extend([
         f"Extraction Penalty: {student.extraction_penalty}",
@@ -66,18 +102,61 @@ def generate_default_summary(student):
 
     return "\n".join(summary_lines)
 
-def display_statistics(students, total_count):
+def run_usage(test_results):
+    # (label, CPU seconds, wall seconds, max RSS kB, voluntary, involuntary switches) of every run with wait4 numbers
+    runs = []
+    for test in test_results:
+        usage = test.get("usage")
+        if usage:
+            label = " ".join([test["program"]] + test["args"])
+            runs.append((label, usage["user_seconds"] + usage["system_seconds"], usage.get("wall_seconds", 0.0), usage["max_rss_kb"],
+                         usage["voluntary_switches"], usage["involuntary_switches"]))
+    return runs
+
+def is_busy_wait(cpu, wall):
+    return wall >= BUSY_WAIT_MIN_SECONDS and cpu >= BUSY_WAIT_CPU_SHARE * wall
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    return ordered[min(len(ordered), max(1, math.ceil(fraction * len(ordered)))) - 1]
+
+def distribution(values, unit=""):
+    if not values:
+        return "no data"
+    return " / ".join(f"{percentile(values, fraction):.2f}{unit}" for fraction in PERCENTILES) + f" / {max(values):.2f}{unit}"
+
+# What display_statistics needs of one student, kept instead of the Student once its summary is written
+StudentTotals = namedtuple("StudentTotals", ["student_dir", "compilation_errors", "warnings", "memory_leaks", "leaked_bytes", "grade", "catched_errors",
+                                             "orphans_reaped", "orphan_cpu_time", "runs", "output_checks", "output_checks_failed",
+                                             "timeout_hits"])
+
+def student_totals(student):
+    return StudentTotals(student.student_dir, len(student.compilation_errors), len(student.warning_messages),
+                         sum(1 for report in student.memory_leaks if report.status == "leaks"),
+                         sum(report.leaked_bytes for report in student.memory_leaks), student.grade, len(student.catched_errors),
+                         student.orphans_reaped, student.orphan_cpu_time, run_usage(student.test_results),
+                         len(student.output_checks), sum(1 for check in student.output_checks if check["verdict"] != "pass"),
+                         [(hit["budget"], hit["fixed"]) for hit in student.timeout_hits])
+
+def display_statistics(students, total_count, compile_cache=None):
     total_compilation_errors = 0
     total_warnings = 0
     total_memory_leaks = 0
+    total_leaked_bytes = 0
     total_grades = 0
     total_catched_errors = 0
+    total_orphans_reaped = 0
+    total_orphan_cpu_time = 0.0
     for student in students:
-        total_compilation_errors += len(student.compilation_errors)
-        total_warnings += len(student.warning_messages)
-        total_memory_leaks += len(student.memory_leaks)
+        total_compilation_errors += student.compilation_errors
+        total_warnings += student.warnings
+        total_memory_leaks += student.memory_leaks
+        total_leaked_bytes += student.leaked_bytes
         total_grades += student.grade
-        total_catched_errors += len(student.catched_errors)
+        total_catched_errors += student.catched_errors
+        total_orphans_reaped += student.orphans_reaped
+        total_orphan_cpu_time += student.orphan_cpu_time
     average_grade = total_grades / len(students) if students else 0
 
     print("\n----- Statistics Summary -----")
@@ -85,8 +164,31 @@ def display_statistics(students, total_count):
     print(f"Total students with submissions: {len(students)}")
     print(f"Total compilation errors: {total_compilation_errors}")
     print(f"Total warnings: {total_warnings}")
-    print(f"Total memory leaks detected: {total_memory_leaks}")
+    print(f"Total memory leaks detected: {total_memory_leaks} ({total_leaked_bytes} bytes)")
     print(f"Total catched errors: {total_catched_errors}")
+    output_checks = sum(student.output_checks for student in students)
+    output_checks_failed = sum(student.output_checks_failed for student in students)
+    print(f"Output checks: {output_checks - output_checks_failed} passed, {output_checks_failed} failed")
+    print(f"Leftover processes killed: {total_orphans_reaped} (used {total_orphan_cpu_time:.2f}s CPU)")
+    if compile_cache:
+        print(f"Compile cache: {compile_cache.hits} hits, {compile_cache.misses} misses")
+    display_resource_usage(students)
+    hits = [hit for student in students for hit in student.timeout_hits]
+    # A run cut short would at most have run on until its fixed budget
+    print(f"Adaptive timeouts: {len(hits)} runs stopped early, saving up to {sum(fixed - budget for budget, fixed in hits):.2f}s of wall time against the fixed budgets")
     print(f"Average grade: {average_grade:.2f}")
     print("--------------------------------\n")
 
+def display_resource_usage(students):
+    # Percentiles (p50 / p90 / p99 / max) over every program run and over the students
+    runs = [run for student in students for run in student.runs]
+    with_runs = [student for student in students if student.runs]
+    print(f"Program runs: {len(runs)} (p50 / p90 / p99 / max)")
+    print(f"\tCPU per run: {distribution([run[1] for run in runs], 's')}")
+    print(f"\tMax RSS per run: {distribution([run[3] / 1024 for run in runs], ' MB')}")
+    print(f"\tVoluntary context switches per run: {distribution([run[4] for run in runs])}")
+    print(f"\tInvoluntary context switches per run: {distribution([run[5] for run in runs])}")
+    print(f"\tCPU per student: {distribution([sum(run[1] for run in student.runs) for student in with_runs], 's')}")
+    print(f"\tMax RSS per student: {distribution([max(run[3] for run in student.runs) / 1024 for student in with_runs], ' MB')}")
+    busy = [f"{student.student_dir} ({run[0]})" for student in students for run in student.runs if is_busy_wait(run[1], run[2])]
+    print(f"Possible busy waits: {', '.join(busy) if busy else 'None'}")
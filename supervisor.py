@@ -0,0 +1,396 @@
+import os
+import signal
+import selectors
+import subprocess
+import time
+import logging
+from capture import StreamCapture, decode_output, READ_CHUNK_SIZE
+from procfs import read_wchan, is_blocking_wchan, session_processes, signal_process_group, CHILD_WAIT_WCHAN
+
+POLL_INTERVAL = 0.1  # Exit polling when pidfd is not available (Python < 3.9)
+EXIT_DRAIN_GRACE = 0.1  # How long pipes stay open after their process exited
+READY_POLL_MIN = 0.005
+READY_POLL_MAX = 0.05
+DEADLOCK_SAMPLE_INTERVAL = 0.25
+
+# ------------------------------------------------------------------ #
+
+class ProcessSpec:
+    """One command of a test group.
+
+    ready is called right before the process starts and returns a predicate
+    that tells when the process is ready (e.g. its FIFO exists). The next
+    command of the group is started only after the predicate holds, the
+    process exited, or ready_timeout passed.
+
+    readers maps extra pipe read ends to callbacks that get every chunk read
+    from them; the matching write ends go in pass_fds and are closed in the
+    parent once the child started. A process that has to be stopped gets
+    stop_signal first and SIGKILL stop_grace seconds later. env replaces the
+    child's environment when given.
+    """
+
+    def __init__(self, command, input_data=None, timeout=120, ready=None, ready_timeout=5,
+                 preexec_fn=None, pass_fds=(), readers=None, stop_signal=signal.SIGKILL, stop_grace=2, env=None, stdout_checker=None):
+        self.command = command
+        self.input_data = input_data
+        self.timeout = timeout
+        self.ready = ready
+        self.ready_timeout = ready_timeout
+        self.preexec_fn = preexec_fn
+        self.pass_fds = pass_fds
+        self.readers = readers or {}
+        self.stop_signal = stop_signal
+        self.stop_grace = stop_grace
+        self.env = env
+        self.stdout_checker = stdout_checker  # Checks stdout as it arrives, see output_check.OutputChecker
+
+class ProcessResult:
+    def __init__(self, spec, max_output_bytes):
+        self.spec = spec
+        self.command = spec.command
+        self.pid = None
+        self.returncode = None
+        self.error = None
+        self.timed_out = False
+        self.start_time = None
+        self.ready_time = None
+        self.exit_time = None
+        self.usage = None  # wait4 rusage and wall time once the process was reaped, see resource_usage
+        self.stdout_capture = StreamCapture(max_output_bytes // 2, max_output_bytes // 2)
+        self.stderr_capture = StreamCapture(max_output_bytes // 2, max_output_bytes // 2)
+        self.stdout_capture.checker = spec.stdout_checker
+        self.stopped_by_checker = False
+        self.stdout = None  # Decoded once the group is done
+        self.stderr = None
+        self.process = None
+        self.pidfd = None
+        self.pending_input = memoryview(b'')
+        self.open_fds = set()
+        self.drain_deadline = None
+        self.kill_deadline = None
+        self.readers_closed = False
+
+    @property
+    def running(self):
+        return self.process is not None and self.exit_time is None
+
+    @property
+    def finished(self):
+        return self.exit_time is not None and not self.open_fds
+
+# ------------------------------------------------------------------ #
+
+class DeadlockDetector:
+    """Declares a group deadlocked when it stops making progress.
+
+    That is when every live process in the group's sessions, forked children
+    included, has been asleep in a pipe/FIFO or message queue wait (per
+    /proc/<pid>/wchan) or in wait() for such a child, without using CPU time
+    and without any new output, for window seconds.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.idle_since = None
+        self.last_progress = None
+        self.blocked_in = {}
+
+    def sample(self, results, processes, now):
+        # processes: session_processes() of the group's sessions
+        blocked_in = {}
+        cpu_ticks = []
+        for proc_stat in processes:
+            wchan = read_wchan(proc_stat.pid)
+            if proc_stat.state != 'S' or not (is_blocking_wchan(wchan) or wchan == CHILD_WAIT_WCHAN):
+                self.idle_since = None
+                return False
+            if wchan != CHILD_WAIT_WCHAN:
+                blocked_in[proc_stat.pid] = (proc_stat.name, wchan)
+            cpu_ticks.append((proc_stat.pid, proc_stat.cpu_ticks))
+        if not blocked_in:
+            self.idle_since = None
+            return False
+        progress = (tuple(cpu_ticks), sum(result.stdout_capture.total + result.stderr_capture.total for result in results))
+        if progress != self.last_progress or self.idle_since is None:
+            self.last_progress = progress
+            self.idle_since = now
+        self.blocked_in = blocked_in
+        return now - self.idle_since >= self.window
+
+    def describe(self):
+        return ", ".join(f"{name} in {wchan}" for name, wchan in self.blocked_in.values())
+
+# ------------------------------------------------------------------ #
+
+class GroupSupervisor:
+    """Runs the commands of one test group from a single selector loop.
+
+    All stdout/stderr pipes, stdin feeds and exit notifications (a pidfd per
+    process where the platform has one) are multiplexed together, so a group
+    costs one thread no matter how many processes it has. With a
+    deadlock_window the group is killed early once it stops making progress,
+    and self.deadlock describes where the processes were stuck. on_sample is
+    called with the live processes of the group's sessions every
+    DEADLOCK_SAMPLE_INTERVAL once all commands started.
+    """
+
+    def __init__(self, specs, cwd=None, max_output_bytes=1024*1024, on_start=None, deadlock_window=None, spill_dir=None, on_sample=None):
+        self.results = [ProcessResult(spec, max_output_bytes) for spec in specs]
+        self.cwd = cwd
+        self.spill_dir = spill_dir  # Full stdout/stderr of every process is written here when set
+        self.on_start = on_start
+        self.on_sample = on_sample
+        self.detector = DeadlockDetector(deadlock_window) if deadlock_window else None
+        self.next_sample = 0
+        self.deadlock = None
+        self.sessions = []  # Every process we start leads its own session and process group
+        self.selector = None
+        self.scratch_view = memoryview(bytearray(READ_CHUNK_SIZE))
+
+    def run(self):
+        self.selector = selectors.DefaultSelector()
+        try:
+            self._loop()
+        finally:
+            for result in self.results:
+                if result.running:
+                    signal_process_group(result.pid)
+                    self._mark_exit(result)
+                self._close_pipes(result)
+            self.selector.close()
+        for result in self.results:
+            result.stdout_capture.close()
+            result.stderr_capture.close()
+            result.stdout = decode_output(result.stdout_capture.getvalue())
+            result.stderr = decode_output(result.stderr_capture.getvalue())
+        return self.results
+
+    def _loop(self):
+        next_index = 0
+        gate = None  # (predicate, deadline, result) of the creator we are waiting for
+        gate_interval = READY_POLL_MIN
+        while True:
+            now = time.time()
+            if gate:
+                predicate, gate_deadline, creator = gate
+                if creator.exit_time is not None or predicate():
+                    creator.ready_time = now
+                    gate = None
+                elif now >= gate_deadline:
+                    logging.warning(f"{creator.command[0]} not ready after {creator.spec.ready_timeout}s, starting the others anyway")
+                    gate = None
+            while gate is None and next_index < len(self.results):
+                result = self.results[next_index]
+                next_index += 1
+                predicate = self._launch(result)
+                if predicate:
+                    gate = (predicate, result.start_time + result.spec.ready_timeout, result)
+                    gate_interval = READY_POLL_MIN
+
+            now = time.time()
+            for result in self.results:
+                if result.running and not result.timed_out and now - result.start_time > result.spec.timeout:
+                    logging.warning(f"Timeout expired running {result.command[0]}, attempting to terminate...")
+                    result.timed_out = True
+                    result.error = "Execution timed out."
+                    self._stop(result, now)
+                if result.running and result.kill_deadline is not None and now >= result.kill_deadline:
+                    logging.warning(f"{result.command[0]} did not stop after signal {result.spec.stop_signal}, killing its process group...")
+                    result.kill_deadline = None
+                    signal_process_group(result.pid)
+                if result.running and result.pidfd is None and self._reap(result, os.WNOHANG):
+                    self._mark_exit(result)
+                if result.exit_time is not None and result.open_fds and now >= result.drain_deadline:
+                    # Something the process forked still holds the pipe, stop waiting for EOF
+                    self._close_pipes(result)
+
+            if next_index == len(self.results) and gate is None and all(result.finished for result in self.results):
+                return
+            if self._sampling() and next_index == len(self.results) and gate is None and now >= self.next_sample:
+                self.next_sample = now + DEADLOCK_SAMPLE_INTERVAL
+                processes = session_processes(set(self.sessions))
+                if self.on_sample:
+                    self.on_sample(processes)
+                if self.detector and self.deadlock is None and self.detector.sample(self.results, processes, now):
+                    self.deadlock = self.detector.describe()
+                    logging.warning(f"Deadlock detected after {self.detector.window}s without progress: {self.deadlock}")
+                    for result in self.results:
+                        if result.running:
+                            self._stop(result, now)
+
+            timeout = self._select_timeout(now, gate, gate_interval)
+            if gate:
+                gate_interval = min(gate_interval * 2, READY_POLL_MAX)
+            for key, events in self.selector.select(timeout):
+                result, stream = key.data
+                if stream == 'exit':
+                    self._mark_exit(result)
+                elif stream == 'stdin':
+                    self._write_input(result, key.fd)
+                else:
+                    self._read_output(result, key.fd, stream)
+
+    def _select_timeout(self, now, gate, gate_interval):
+        timeout = None
+        for result in self.results:
+            if result.running:
+                timeout = _earliest(timeout, result.start_time + result.spec.timeout - now)
+                if result.kill_deadline is not None:
+                    timeout = _earliest(timeout, result.kill_deadline - now)
+                if result.pidfd is None:
+                    timeout = _earliest(timeout, POLL_INTERVAL)
+            elif result.open_fds and result.drain_deadline is not None:
+                timeout = _earliest(timeout, result.drain_deadline - now)
+        if gate:
+            timeout = _earliest(timeout, gate_interval)
+        elif self._sampling() and any(result.running for result in self.results):
+            timeout = _earliest(timeout, self.next_sample - now)
+        return max(0, timeout) if timeout is not None else POLL_INTERVAL
+
+    def _sampling(self):
+        return bool(self.on_sample) or (self.detector is not None and self.deadlock is None)
+
+    def _launch(self, result):
+        spec = result.spec
+        predicate = spec.ready() if spec.ready else None
+        result.start_time = time.time()
+        try:
+            result.process = subprocess.Popen(spec.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE, start_new_session=True, cwd=self.cwd,
+                                              preexec_fn=spec.preexec_fn, pass_fds=spec.pass_fds, env=spec.env)
+        except Exception as e:
+            logging.exception(f"Error running {spec.command[0]}")
+            result.error = str(e)
+            result.exit_time = result.start_time
+            return None
+        finally:
+            for fd in spec.pass_fds:
+                os.close(fd)
+        result.pid = result.process.pid
+        self.sessions.append(result.pid)
+        logging.info(f"Starting {spec.command[0]} with PID: {result.pid}")
+        if self.on_start:
+            self.on_start(result.process)
+        if self.spill_dir:
+            name = os.path.basename(spec.command[0])
+            result.stdout_capture.spill_path = os.path.join(self.spill_dir, f"{name}_{result.pid}.stdout")
+            result.stderr_capture.spill_path = os.path.join(self.spill_dir, f"{name}_{result.pid}.stderr")
+
+        for stream, pipe in (('stdout', result.process.stdout), ('stderr', result.process.stderr)):
+            os.set_blocking(pipe.fileno(), False)
+            self.selector.register(pipe.fileno(), selectors.EVENT_READ, (result, stream))
+            result.open_fds.add(pipe.fileno())
+        for fd in spec.readers:
+            os.set_blocking(fd, False)
+            self.selector.register(fd, selectors.EVENT_READ, (result, 'reader'))
+            result.open_fds.add(fd)
+        if spec.input_data:
+            result.pending_input = memoryview(spec.input_data.encode())
+            os.set_blocking(result.process.stdin.fileno(), False)
+            self.selector.register(result.process.stdin.fileno(), selectors.EVENT_WRITE, (result, 'stdin'))
+        else:
+            result.process.stdin.close()
+        if hasattr(os, 'pidfd_open'):
+            try:
+                result.pidfd = os.pidfd_open(result.pid)
+                self.selector.register(result.pidfd, selectors.EVENT_READ, (result, 'exit'))
+            except OSError:
+                result.pidfd = None  # Kernel without pidfd support, fall back to polling
+        if predicate is None:
+            result.ready_time = result.start_time
+        return predicate
+
+    def _read_output(self, result, fd, stream):
+        try:
+            count = os.readv(fd, [self.scratch_view])
+        except BlockingIOError:
+            return
+        if count == 0:
+            self.selector.unregister(fd)
+            result.open_fds.discard(fd)
+            return
+        if stream == 'reader':
+            result.spec.readers[fd](bytes(self.scratch_view[:count]))
+            return
+        capture = result.stdout_capture if stream == 'stdout' else result.stderr_capture
+        capture.write(self.scratch_view[:count])
+        if capture.checker is not None and capture.checker.stop_requested and result.running and not result.stopped_by_checker:
+            logging.info(f"Stopping {result.command[0]}: {capture.checker.message}")
+            result.stopped_by_checker = True
+            self._stop(result, time.time())
+
+    def _write_input(self, result, fd):
+        try:
+            written = os.write(fd, result.pending_input[:READ_CHUNK_SIZE])
+            result.pending_input = result.pending_input[written:]
+        except BlockingIOError:
+            return
+        except BrokenPipeError:
+            result.pending_input = result.pending_input[:0]
+        if not result.pending_input:
+            self.selector.unregister(fd)
+            result.process.stdin.close()
+
+    def _mark_exit(self, result):
+        if result.exit_time is not None:
+            return
+        self._reap(result)
+        result.returncode = result.process.returncode
+        result.exit_time = time.time()
+        if result.usage is not None:
+            result.usage["wall_seconds"] = round(result.exit_time - result.start_time, 3)
+        result.drain_deadline = result.exit_time + EXIT_DRAIN_GRACE
+        if result.pidfd is not None:
+            self.selector.unregister(result.pidfd)
+            os.close(result.pidfd)
+            result.pidfd = None
+        if not result.process.stdin.closed:
+            if result.process.stdin.fileno() in self.selector.get_map():
+                self.selector.unregister(result.process.stdin.fileno())
+            result.process.stdin.close()
+        logging.info(f"Completed {result.command[0]} with PID: {result.pid} (exit code {result.returncode})")
+
+    def _reap(self, result, options=0):
+        # waitpid through wait4, so the rusage of the process (and the children it waited for) is kept; False while it still runs
+        if result.process.returncode is not None:
+            return True
+        try:
+            pid, status, usage = os.wait4(result.pid, options)
+        except ChildProcessError:
+            result.process.wait()  # Reaped elsewhere, only the exit code is left
+            return True
+        if pid == 0:
+            return False
+        result.process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        result.usage = resource_usage(usage)
+        return True
+
+    def _stop(self, result, now):
+        signal_process_group(result.pid, result.spec.stop_signal)
+        if result.spec.stop_signal != signal.SIGKILL:
+            result.kill_deadline = now + result.spec.stop_grace
+
+    def _close_pipes(self, result):
+        for fd in list(result.open_fds):
+            self.selector.unregister(fd)
+        result.open_fds.clear()
+        if not result.readers_closed:
+            result.readers_closed = True
+            for fd in result.spec.readers:
+                os.close(fd)
+        if result.process:
+            for pipe in (result.process.stdin, result.process.stdout, result.process.stderr):
+                pipe.close()
+
+def resource_usage(usage):
+    # The parts of a struct rusage kept per process; max RSS is in kilobytes on Linux
+    return {
+        "user_seconds": round(usage.ru_utime, 3),
+        "system_seconds": round(usage.ru_stime, 3),
+        "max_rss_kb": usage.ru_maxrss,
+        "voluntary_switches": usage.ru_nvcsw,
+        "involuntary_switches": usage.ru_nivcsw,
+    }
+
+def _earliest(current, candidate):
+    return candidate if current is None else min(current, candidate)
@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from output_check import OutputRule
+
+DEFAULT_PLAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_plans", "ex4.json")
+DEFAULT_READY_TIMEOUT = 5  # Upper bound on waiting for a step's FIFO or queue
+MSGQUEUE_RESOURCE = "msgqueue"  # Resource of the groups whose programs make message queues
+
+# ------------------------------------------------------------------ #
+
+class StepPlan:
+    """One command of a group: program name, arguments and stdin.
+
+    ready_fifos / ready_msgqueue say what the step creates before the next
+    step may start; timeout None leaves the budget to the grader. expect is
+    the OutputRule its stdout is checked against, None leaves it unchecked.
+    """
+
+    def __init__(self, data, base_dir=None):
+        self.program = data["program"]
+        self.args = [str(arg) for arg in data.get("args", [])]
+        self.stdin = data.get("stdin")
+        ready = data.get("ready", {})
+        self.ready_fifos = list(ready.get("fifos", []))
+        self.ready_msgqueue = bool(ready.get("msgqueue", False))
+        self.ready_timeout = data.get("ready_timeout", DEFAULT_READY_TIMEOUT)
+        self.timeout = data.get("timeout")
+        self.expect = OutputRule(data["expect"], base_dir) if "expect" in data else None
+
+    @property
+    def has_ready_check(self):
+        return bool(self.ready_fifos) or self.ready_msgqueue
+
+class GroupPlan:
+    # Steps that run together; groups sharing a resource never overlap
+    def __init__(self, data, base_dir=None):
+        self.name = data["name"]
+        self.steps = [StepPlan(step, base_dir) for step in data["steps"]]
+        self.resources = set(data.get("resources", []))
+        self.depends_on = list(data.get("depends_on", []))
+        if not self.steps:
+            raise ValueError(f"Group {self.name} has no steps")
+        # Only groups holding it claim unused queues by key, and holding it keeps them from running side by side
+        if any(step.ready_msgqueue for step in self.steps) and MSGQUEUE_RESOURCE not in self.resources:
+            raise ValueError(f"Group {self.name} waits for a message queue but does not list the {MSGQUEUE_RESOURCE} resource")
+
+class TestPlan:
+    """A test plan file: the sources to compile and the groups to run.
+
+    sources maps every program name to the source files compiled for it, in
+    grading order. Groups form a DAG through depends_on.
+    """
+
+    def __init__(self, data, path=None, digest=None):
+        self.path = path
+        self.digest = digest  # sha256 of the plan file, part of every student's input hash
+        self.name = data.get("name", os.path.splitext(os.path.basename(path or "plan"))[0])
+        self.sources = data["sources"]
+        self.groups = [GroupPlan(group, os.path.dirname(path) if path else None) for group in data["groups"]]
+        self.validate()
+
+    def validate(self):
+        names = [group.name for group in self.groups]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate group names in {self.path}: {names}")
+        for group in self.groups:
+            for dependency in group.depends_on:
+                if dependency not in names:
+                    raise ValueError(f"Group {group.name} depends on unknown group {dependency}")
+        # Every group has to become runnable once its dependencies are done
+        done = set()
+        while len(done) < len(self.groups):
+            runnable = [group.name for group in self.groups if group.name not in done and set(group.depends_on) <= done]
+            if not runnable:
+                raise ValueError(f"Dependency cycle between groups {sorted(set(names) - done)} in {self.path}")
+            done.update(runnable)
+
+@functools.lru_cache(maxsize=None)
+def load_plan(path=DEFAULT_PLAN):
+    with open(path, 'rb') as f:
+        content = f.read()
+    return TestPlan(json.loads(content.decode('utf-8')), path, hashlib.sha256(content).hexdigest())
+
+# ------------------------------------------------------------------ #
+
+def run_plan(groups, run_group, max_parallel=1):
+    """Runs run_group(group) for every group, returns {group name: result}.
+
+    A group starts once everything it depends on finished and no running
+    group holds one of its resources; among ready groups the plan order wins.
+    """
+    results = {}
+    pending = list(groups)
+    running = {}  # future -> group
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as pool:
+        while pending or running:
+            held = set().union(*(group.resources for group in running.values())) if running else set()
+            for group in list(pending):
+                if len(running) >= max(1, max_parallel):
+                    break
+                if set(group.depends_on) <= set(results) and not (group.resources & held):
+                    pending.remove(group)
+                    running[pool.submit(run_group, group)] = group
+                    held |= group.resources
+            if not running:
+                raise RuntimeError(f"Groups {[group.name for group in pending]} can never start")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                group = running.pop(future)
+                results[group.name] = future.result()
+    return results
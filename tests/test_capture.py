@@ -0,0 +1,52 @@
+import random
+from capture import BoundedBuffer
+
+
+def feed(buffer, data, sizes):
+    position = 0
+    for size in sizes:
+        buffer.write(data[position:position + size])
+        position += size
+    buffer.write(data[position:])
+
+
+def test_short_stream_is_kept_whole():
+    buffer = BoundedBuffer(4, 8)
+    feed(buffer, b"0123456789ab", [3, 5, 1])
+    assert not buffer.truncated
+    assert buffer.getvalue() == b"0123456789ab"
+
+
+def test_ring_wraps_around():
+    buffer = BoundedBuffer(4, 8)
+    data = bytes(range(48, 48 + 40))
+    feed(buffer, data, [5, 3, 7, 2, 6])  # Chunks shorter than the ring, crossing its end several times
+    assert buffer.truncated
+    assert bytes(buffer.head) == data[:4]
+    assert buffer.tail() == data[-8:]
+    assert buffer.getvalue() == data[:4] + b"\n... [28 bytes omitted] ...\n" + data[-8:]
+
+
+def test_chunk_longer_than_the_ring():
+    buffer = BoundedBuffer(2, 4)
+    buffer.write(b"abc")
+    buffer.write(b"0123456789")
+    assert buffer.tail() == b"6789"
+    assert buffer.total == 13
+
+
+def test_random_chunks_match_the_stream():
+    rng = random.Random(7)
+    for _ in range(200):
+        head_limit, tail_limit = rng.randint(0, 6), rng.randint(1, 9)
+        data = bytes(rng.randrange(256) for _ in range(rng.randint(0, 60)))
+        buffer = BoundedBuffer(head_limit, tail_limit)
+        feed(buffer, data, [rng.randint(0, 12) for _ in range(rng.randint(0, 8))])
+        assert bytes(buffer.head) == data[:head_limit]
+        assert buffer.tail() == data[head_limit:][-tail_limit:]
+
+
+def test_no_tail():
+    buffer = BoundedBuffer(3, 0)
+    buffer.write(b"abcdef")
+    assert buffer.getvalue() == b"abc\n... [3 bytes omitted] ...\n"
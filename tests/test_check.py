@@ -0,0 +1,103 @@
+import os
+import argparse
+import pytest
+import check
+from results_store import ResultsStore
+from testplan import DEFAULT_PLAN
+
+
+def args(**values):
+    defaults = {name: None for name in check.SHARED_OPTIONS}
+    defaults.update(plan=DEFAULT_PLAN, results_db="ex4_results.sqlite")
+    defaults.update(values)
+    return argparse.Namespace(**defaults)
+
+
+def test_shared_paths_are_relative_to_the_class_directory(tmp_path):
+    plan = tmp_path / "plans" / "ex5.json"
+    plan.parent.mkdir()
+    with open(DEFAULT_PLAN, 'rb') as source:
+        plan.write_bytes(source.read())
+    options = check.shared_options(args(plan=str(plan), spill_dir=str(tmp_path / "spill"), results_db=str(tmp_path / "results.sqlite")), str(tmp_path))
+    assert options["plan"] == os.path.join("plans", "ex5.json")
+    assert options["spill_dir"] == "spill"
+    assert options["results_db"] == "results.sqlite"
+    assert options["plan_digest"] == check.load_plan(str(plan)).digest
+
+
+def test_default_plan_and_outside_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # The coordinator runs in the class directory
+    options = check.shared_options(args(spill_dir="/srv/spill"), str(tmp_path))
+    assert options["plan"] is None
+    assert options["spill_dir"] == "/srv/spill"
+    assert options["results_db"] == "ex4_results.sqlite"
+
+
+# ------------------------------------------------------------------ #
+
+STUDENTS = ["דנה כהן", "יעל לוי"]
+
+
+@pytest.fixture
+def class_dir(tmp_path, monkeypatch):
+    # Two ungraded students in the current directory, grading them is recorded instead of run
+    for student_dir in STUDENTS:
+        (tmp_path / student_dir).mkdir()
+        (tmp_path / student_dir / "ex4a1.c").write_text("int main(void) { return 0; }\n")
+    monkeypatch.chdir(tmp_path)
+    graded = []
+    def grade_student(student):
+        graded.append(student.student_dir)
+        student.grade = 60
+        return f"Summary for {student.student_dir}\nGrade: 60\n", True
+    monkeypatch.setattr(check, "grade_student", grade_student)
+    monkeypatch.setattr(check, "compile_all", lambda students, workers: None)
+    return graded
+
+
+def stored_student(results_store, student_dir, grade, run_id=None):
+    student = check.prepare_student(student_dir, check.parse_args([]), None, None, None, {}, 0)
+    student.grade = grade
+    results_store.save(student_dir, student.source_hash, check.RUBRIC_VERSION, True, student.to_dict(), run_id)
+
+
+def test_stored_result_is_reused_only_when_current(class_dir, monkeypatch):
+    results_store = ResultsStore("ex4_results.sqlite")
+    stored_student(results_store, STUDENTS[0], 77)
+    options = check.parse_args(["--incremental"])
+    student = check.prepare_student(STUDENTS[0], options, None, None, None, {}, 0)
+    assert check.reusable_result(results_store, student, options, set())[3]["grade"] == 77
+    assert check.reusable_result(results_store, student, check.parse_args([]), set()) is None  # Only with --incremental
+    changed = check.prepare_student(STUDENTS[0], check.parse_args(["--incremental", "--rlimit-cpu", "10"]), None, None, None, {}, 0)
+    assert check.reusable_result(results_store, changed, changed.options, set()) is None
+    penalized = check.prepare_student(STUDENTS[0], options, None, None, None, {STUDENTS[0]: {"penalty": 15}}, 0)
+    assert check.reusable_result(results_store, penalized, options, set()) is None
+    monkeypatch.setattr(check, "RUBRIC_VERSION", check.RUBRIC_VERSION + 1)
+    assert check.reusable_result(results_store, student, options, set()) is None
+    results_store.close()
+
+
+def test_resume_skips_the_students_the_run_finished(class_dir):
+    results_store = ResultsStore("ex4_results.sqlite")
+    run_id = results_store.start_run({"argv": []})
+    stored_student(results_store, STUDENTS[0], 77, run_id)
+    results_store.close()
+    check.main(["--resume", "--no-similarity", "--no-compile-cache", "--trace-top", "0"])
+    assert class_dir == [STUDENTS[1]]
+    with open("final_summary_ex4.log") as f:
+        summary = f.read()
+    assert "Grade: 77" in summary and "Grade: 60" in summary
+    results_store = ResultsStore("ex4_results.sqlite")
+    assert results_store.unfinished_run() is None
+    assert results_store.graded_in_run(run_id) == set(STUDENTS)
+    results_store.close()
+
+
+def test_resume_without_an_unfinished_run_grades_everyone(class_dir):
+    results_store = ResultsStore("ex4_results.sqlite")
+    run_id = results_store.start_run({"argv": []})
+    stored_student(results_store, STUDENTS[0], 77, run_id)
+    results_store.finish_run(run_id)
+    results_store.close()
+    check.main(["--resume", "--no-similarity", "--no-compile-cache", "--trace-top", "0"])
+    assert sorted(class_dir) == sorted(STUDENTS)
@@ -0,0 +1,96 @@
+import io
+import os
+import json
+import tarfile
+import zipfile
+from extract import extract_student, manifest_extraction, write_summary_log, MANIFEST_NAME
+
+LIMITS = (1000, 2500, 5)  # Bytes per entry, bytes per student, entries per student
+
+
+def make_student(tmp_path, name="student"):
+    student_path = tmp_path / name
+    student_path.mkdir()
+    return student_path
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(str(path), 'w') as zip_ref:
+        for name, content in members:
+            zip_ref.writestr(name, content)
+
+
+def reasons(stats):
+    return {entry["name"]: entry["reason"] for entry in stats["rejected"]}
+
+
+def test_paths_outside_the_student_directory(tmp_path):
+    student_path = make_student(tmp_path)
+    write_zip(student_path / "sub.zip", [("ex4a1.c", "int main;"), ("../escape.c", "x"), ("dir/../../escape2.c", "x"), ("/etc/abs.c", "x")])
+    log_entries, score, stats = extract_student(str(tmp_path), "student", LIMITS)
+    assert reasons(stats) == {"../escape.c": "path outside the student directory", "dir/../../escape2.c": "path outside the student directory",
+                              "/etc/abs.c": "path outside the student directory"}
+    assert sorted(os.listdir(str(tmp_path))) == ["student"]
+    assert [file["path"] for file in stats["files"]] == ["ex4a1.c"]
+    assert not (student_path / "sub.zip").exists()
+    assert score == 100
+
+
+def test_tar_links_and_absolute_names(tmp_path):
+    student_path = make_student(tmp_path)
+    with tarfile.open(str(student_path / "sub.tgz"), 'w:gz') as tar_ref:
+        for name, content in (("ex4b1.c", b"int main;"), ("/tmp/abs.c", b"x")):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar_ref.addfile(info, io.BytesIO(content))
+        link = tarfile.TarInfo("passwd")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "/etc/passwd"
+        tar_ref.addfile(link)
+    log_entries, score, stats = extract_student(str(tmp_path), "student", LIMITS)
+    assert reasons(stats) == {"/tmp/abs.c": "path outside the student directory", "passwd": "link or special file"}
+    assert sorted(os.listdir(str(student_path))) == ["ex4b1.c"]
+
+
+def test_entry_and_total_budgets(tmp_path):
+    student_path = make_student(tmp_path)
+    write_zip(student_path / "a.zip", [("big.c", "x" * 1001), ("one.c", "x" * 900), ("two.c", "x" * 900)])
+    write_zip(student_path / "b.zip", [("three.c", "x" * 900)])  # The total budget is shared by all archives of a student
+    log_entries, score, stats = extract_student(str(tmp_path), "student", LIMITS)
+    rejected = reasons(stats)
+    assert rejected.pop("big.c") == "larger than 1000 bytes"
+    assert list(rejected.values()) == ["student total over 2500 bytes"]
+    assert stats["bytes"] == 1800
+    assert stats["extracted"] == 2
+    assert sum(1 for name in os.listdir(str(student_path)) if name.endswith(".c")) == 2  # Partial files are removed
+
+
+def test_entry_count_budget_and_skipped_entries(tmp_path):
+    student_path = make_student(tmp_path)
+    members = [(f"f{index}.c", "x") for index in range(7)] + [("__MACOSX/._f0.c", "x"), ("ex4a1.o", "x"), ("ex4a1", "\x7fELF rest")]
+    write_zip(student_path / "sub.zip", members)
+    log_entries, score, stats = extract_student(str(tmp_path), "student", LIMITS)
+    assert reasons(stats) == {"f5.c": "more than 5 entries", "f6.c": "more than 5 entries", "ex4a1": "more than 5 entries"}
+    assert stats["extracted"] == 5
+    assert "Skipped 2 editor, system or build artifact entries" in log_entries
+
+
+def test_compiled_binary_is_rejected(tmp_path):
+    student_path = make_student(tmp_path)
+    write_zip(student_path / "sub.zip", [("ex4a1", "\x7fELF rest")])
+    log_entries, score, stats = extract_student(str(tmp_path), "student", LIMITS)
+    assert reasons(stats) == {"ex4a1": "compiled binary"}
+    assert os.listdir(str(student_path)) == []
+
+
+def test_nested_folder_penalty_survives_the_manifest(tmp_path):
+    student_path = make_student(tmp_path)
+    write_zip(student_path / "sub.zip", [("inner/ex4a1.c", "int main;")])
+    log_entries, score, stats = extract_student(str(tmp_path), "student", LIMITS)
+    assert score == 85
+    assert os.listdir(str(student_path)) == ["ex4a1.c"]
+    write_summary_log(str(tmp_path), {"student": log_entries}, {"student": score}, {"student": stats}, 1.0)
+    with open(str(tmp_path / MANIFEST_NAME)) as f:
+        record = json.loads(f.readline())
+    assert record["penalty"] == 15
+    assert manifest_extraction(record) == (log_entries, score, stats)
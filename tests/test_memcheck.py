@@ -0,0 +1,158 @@
+from types import SimpleNamespace
+from memcheck import LeakReport, ValgrindXmlParser, parse_sanitizer_log, sanitizer_options
+from summarize import display_statistics, student_totals
+
+FRAME_MAIN = "<frame><ip>0x4005A1</ip><obj>/work/ex4a1</obj><fn>main</fn><dir>/work</dir><file>ex4a1.c</file><line>12</line></frame>"
+FRAME_MALLOC = "<frame><ip>0x4C2FB0F</ip><obj>/usr/lib/valgrind/vgpreload_memcheck.so</obj><fn>malloc</fn></frame>"
+
+
+def leak(kind, leaked_bytes, blocks):
+    return (f"<error><unique>0x{leaked_bytes:x}</unique><tid>1</tid><kind>{kind}</kind><xwhat><text>{leaked_bytes} bytes in {blocks} blocks</text>"
+            f"<leakedbytes>{leaked_bytes}</leakedbytes><leakedblocks>{blocks}</leakedblocks></xwhat><stack>{FRAME_MALLOC}{FRAME_MAIN}</stack></error>")
+
+
+def valgrind_xml(*errors):
+    return ('<?xml version="1.0"?>\n<valgrindoutput>\n<protocolversion>4</protocolversion>\n<tool>memcheck</tool>\n'
+            + "\n".join(errors) + "\n<errorcounts></errorcounts>\n</valgrindoutput>\n").encode()
+
+
+def parse(data, chunk_size=7):
+    report = LeakReport("ex4a1")
+    parser = ValgrindXmlParser(report)
+    for start in range(0, len(data), chunk_size):
+        parser.feed(data[start:start + chunk_size])
+    return report, parser
+
+
+def test_leak_kinds_are_added_up():
+    invalid_read = f"<error><unique>0x1</unique><tid>1</tid><kind>InvalidRead</kind><what>Invalid read of size 4</what><stack>{FRAME_MAIN}</stack></error>"
+    data = valgrind_xml(invalid_read, leak("Leak_DefinitelyLost", 64, 1), leak("Leak_DefinitelyLost", 16, 2),
+                        leak("Leak_IndirectlyLost", 32, 4), leak("Leak_PossiblyLost", 8, 1))
+    report, parser = parse(data)
+    assert parser.complete and not parser.failed
+    assert report.status == "leaks"
+    assert report.bytes == {"definitely_lost": 80, "indirectly_lost": 32, "possibly_lost": 8}
+    assert report.blocks["definitely_lost"] == 3
+    assert report.leaked_bytes == 120
+    assert report.errors == {"InvalidRead": 1}
+    assert report.records[1]["frames"] == ["malloc (vgpreload_memcheck.so)", "main (ex4a1.c:12)"]
+    assert "largest at malloc (vgpreload_memcheck.so) < main (ex4a1.c:12)" in str(report)
+
+
+def test_still_reachable_counts_as_a_leak():
+    # The old "no leaks are possible" check failed on still reachable blocks too
+    report, parser = parse(valgrind_xml(leak("Leak_StillReachable", 24, 3)))
+    assert report.status == "leaks"
+    assert report.bytes == {"still_reachable": 24}
+    assert "24 bytes still reachable" in str(report)
+
+
+def test_clean_run():
+    report, parser = parse(valgrind_xml())
+    assert parser.complete
+    assert report.status == "ok"
+    assert str(report) == "No memory leaks in ex4a1"
+
+
+def test_stream_cut_off_before_the_summary():
+    report, parser = parse(valgrind_xml(leak("Leak_DefinitelyLost", 64, 1))[:-40])
+    assert not parser.complete  # The checker reports a timeout or error then
+    assert report.leaked_bytes == 64
+
+
+def test_unreadable_xml():
+    report, parser = parse(b"<valgrindoutput><error></valgrindoutput>")
+    assert parser.failed
+    assert report.message.startswith("Unreadable valgrind XML")
+
+
+def test_report_round_trip():
+    report, parser = parse(valgrind_xml(leak("Leak_DefinitelyLost", 64, 1), leak("Leak_StillReachable", 8, 1)))
+    restored = LeakReport.from_dict(report.to_dict())
+    assert (restored.status, restored.bytes, restored.blocks, restored.records) == (report.status, report.bytes, report.blocks, report.records)
+
+
+def student(reports):
+    return SimpleNamespace(student_dir="s", compilation_errors=[], warning_messages=[], memory_leaks=reports, grade=90, catched_errors=[],
+                           orphans_reaped=0, orphan_cpu_time=0.0, test_results=[], output_checks=[], timeout_hits=[])
+
+
+def test_total_memory_leaks_detected(capsys):
+    leaky, parser = parse(valgrind_xml(leak("Leak_DefinitelyLost", 64, 1), leak("Leak_IndirectlyLost", 32, 1)))
+    reachable, parser = parse(valgrind_xml(leak("Leak_StillReachable", 8, 1)))
+    clean, parser = parse(valgrind_xml())
+    timeout = LeakReport("ex4a2")
+    timeout.status = "timeout"
+    totals = [student_totals(student([leaky, clean, timeout])), student_totals(student([reachable])), student_totals(student([]))]
+    assert [(t.memory_leaks, t.leaked_bytes) for t in totals] == [(1, 96), (1, 8), (0, 0)]
+    display_statistics(totals, 3)
+    assert "Total memory leaks detected: 2 (104 bytes)" in capsys.readouterr().out
+
+
+# ------------------------------------------------------------------ #
+
+LEAK_LOG = """=================================================================
+==4711==ERROR: LeakSanitizer: detected memory leaks
+
+Direct leak of 64 byte(s) in 1 object(s) allocated from:
+    #0 0x7f1c2a8b2b40 in __interceptor_malloc (/lib64/libasan.so.5+0xefb40)
+    #1 0x400a1b in main /work/ex4c2.c:7
+    #2 0x7f1c2a4c0554 in __libc_start_main (/lib64/libc.so.6+0x22554)
+    #3 0x400900 in _start (/work/ex4c2+0x400900)
+
+Indirect leak of 16 byte(s) in 2 object(s) allocated from:
+    #0 0x7f1c2a8b2b40 in __interceptor_malloc (/lib64/libasan.so.5+0xefb40)
+    #1 0x400a2b in main /work/ex4c2.c:8
+
+SUMMARY: AddressSanitizer: 80 byte(s) leaked in 3 allocation(s).
+"""
+OVERFLOW_LOG = """=================================================================
+==4712==ERROR: AddressSanitizer: heap-buffer-overflow on address 0x602000000014 at pc 0x400b3c bp 0x7ffd sp 0x7ffd
+READ of size 4 at 0x602000000014 thread T0
+    #0 0x400b3b in main /work/ex4a1.c:10
+    #1 0x7f1c2a4c0554 in __libc_start_main (/lib64/libc.so.6+0x22554)
+
+SUMMARY: AddressSanitizer: heap-buffer-overflow /work/ex4a1.c:10 in main
+"""
+
+
+def test_sanitizer_leak_kinds():
+    report = LeakReport("ex4c2", tool="AddressSanitizer")
+    parse_sanitizer_log(LEAK_LOG, report)
+    assert report.status == "leaks"
+    assert report.bytes == {"definitely_lost": 64, "indirectly_lost": 16}
+    assert report.blocks == {"definitely_lost": 1, "indirectly_lost": 2}
+    assert report.errors == {}  # The LeakSanitizer header is not an error of its own
+    assert report.records[0]["frames"] == ["__interceptor_malloc (libasan.so.5)", "main (ex4c2.c:7)", "__libc_start_main (libc.so.6)"]
+    assert "still_reachable" not in report.bytes  # LeakSanitizer does not report reachable blocks
+
+
+def test_sanitizer_error_and_logs_of_several_processes():
+    report = LeakReport("ex4a1", tool="AddressSanitizer")
+    parse_sanitizer_log(OVERFLOW_LOG, report)
+    assert report.status == "ok"
+    assert report.errors == {"heap-buffer-overflow": 1}
+    assert report.records[0]["frames"] == ["main (ex4a1.c:10)", "__libc_start_main (libc.so.6)"]
+    parse_sanitizer_log(LEAK_LOG, report)  # A forked child writes its own <prefix>.<pid>
+    parse_sanitizer_log(LEAK_LOG, report)
+    assert report.status == "leaks"
+    assert report.leaked_bytes == 160
+    assert str(report).startswith("Memory leaks detected in ex4a1: 128 bytes definitely lost, 32 bytes indirectly lost")
+    assert str(report).endswith("errors: heap-buffer-overflow x1\n\t\tlargest at __interceptor_malloc (libasan.so.5) < main (ex4c2.c:7) < __libc_start_main (libc.so.6)")
+
+
+def test_empty_sanitizer_log():
+    report = LeakReport("ex4a1", tool="AddressSanitizer")
+    parse_sanitizer_log("", report)
+    assert report.status == "ok" and report.records == []
+
+
+def test_sanitizer_options():
+    assert sanitizer_options("/tmp/run/asan_ex4a_0") == "log_path=/tmp/run/asan_ex4a_0:detect_leaks=1:halt_on_error=0"
+
+
+def test_sanitizer_reports_in_the_totals(capsys):
+    report = LeakReport("ex4c2", tool="AddressSanitizer")
+    parse_sanitizer_log(LEAK_LOG, report)
+    display_statistics([student_totals(student([report]))], 1)
+    assert "Total memory leaks detected: 1 (80 bytes)" in capsys.readouterr().out
@@ -0,0 +1,86 @@
+from output_check import OutputRule, OutputChecker
+from testplan import load_plan
+
+
+def check(data, *chunks, finish=True):
+    checker = OutputChecker(OutputRule(data))
+    for chunk in chunks:
+        checker.feed(chunk)
+    if finish:
+        checker.finish()
+    return checker
+
+
+def test_patterns_in_order_across_chunks():
+    checker = check({"patterns": [r"\b2\b", r"\b3\b", r"\b5\b"]}, b"primes: 2 3", b"\n5\n")
+    assert checker.verdict == "pass"
+    assert checker.message is None
+
+
+def test_missing_pattern_fails_at_the_end():
+    checker = check({"patterns": ["hello", "world"]}, b"hello\nbye\n")
+    assert checker.verdict == "fail"
+    assert "'world'" in checker.message
+
+
+def test_forbidden_line_stops_early():
+    checker = check({"patterns": ["7"], "forbidden": [r"^4$"], "stop_on_fail": True}, b"2\n4\n", finish=False)
+    assert checker.verdict == "fail"
+    assert checker.stop_requested
+    checker.feed(b"7\n")  # Ignored once the verdict is certain
+    assert checker.lines == 2
+
+
+def test_max_lines_stops_endless_output():
+    checker = check({"max_lines": 3, "stop_on_fail": True}, b"y\n" * 10, finish=False)
+    assert checker.stop_requested
+    assert checker.lines == 4
+
+
+def test_no_stop_without_stop_on_fail():
+    checker = check({"max_lines": 1}, b"a\nb\n", finish=False)
+    assert checker.verdict == "fail"
+    assert not checker.stop_requested
+
+
+def test_open_ended_rule_passes_before_the_end():
+    checker = check({"patterns": ["ready"]}, b"ready\n", finish=False)
+    assert checker.verdict == "pass"
+
+
+def test_exact_lines():
+    assert check({"lines": ["a", "b"]}, b"a\nb\n").verdict == "pass"
+    assert check({"lines": ["a", "b"]}, b"a\nbb\n").verdict == "fail"
+    assert "unexpected line 3" in check({"lines": ["a", "b"]}, b"a\nb\nc\n").message
+
+
+def test_last_line_without_newline():
+    assert check({"lines": ["a", "b"]}, b"a\n", b"b").verdict == "pass"
+
+
+def test_reference_file(tmp_path):
+    (tmp_path / "expected.txt").write_text("one\ntwo\n")
+    rule = OutputRule({"reference": "expected.txt"}, str(tmp_path))
+    checker = OutputChecker(rule)
+    checker.feed(b"one\ntwo\n")
+    checker.finish()
+    assert checker.verdict == "pass"
+
+
+def test_ex4c3_rule_of_the_shipped_plan():
+    rule = load_plan().groups[2].steps[2].expect
+    primes = b"2 is prime\n3 is prime\n5 is prime\n7 is prime\n"
+    assert rule.points > 0
+    for answer in (b"121 palindrome: yes\n", b"121 is a palindrome\n", b"1\n"):
+        checker = OutputChecker(rule)
+        checker.feed(primes + answer)
+        checker.finish()
+        assert checker.verdict == "pass", answer
+    for answer in (b"121 palindrome: no\n", b"121 is not a palindrome\n", b"121 palindrome: 0\n", b""):
+        checker = OutputChecker(rule)
+        checker.feed(primes + answer)
+        checker.finish()
+        assert checker.verdict == "fail", answer
+    checker = OutputChecker(rule)
+    checker.feed(b"2\n3\n4\n")
+    assert checker.stop_requested
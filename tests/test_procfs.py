@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import ctypes
+import subprocess
+import pytest
+from procfs import (CHILD_WAIT_WCHAN, SYSVIPC_MSG_PATH, MsgQueueScope, ftok_suffix, is_blocking_wchan, list_msg_queues, read_proc_stat, read_wchan,
+                    session_processes, sweep_sessions)
+
+
+@pytest.fixture
+def child():
+    # Started by the test, then killed and reaped
+    processes = []
+    def start(command, **kwargs):
+        process = subprocess.Popen(command, **kwargs)
+        processes.append(process)
+        return process
+    yield start
+    for process in processes:
+        process.kill()
+        process.wait()
+
+
+def wait_for(predicate, seconds=5):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_stat_of_a_name_with_spaces_and_parentheses(child):
+    name = "a) (b c"
+    process = child([sys.executable, "-c", f"import ctypes, time; ctypes.CDLL(None).prctl(15, {name.encode()!r}, 0, 0, 0); time.sleep(30)"],
+                    start_new_session=True)
+    assert wait_for(lambda: read_proc_stat(process.pid).name == name)
+    proc_stat = read_proc_stat(process.pid)
+    assert proc_stat.ppid == os.getpid()
+    assert proc_stat.session == process.pid and proc_stat.pgrp == process.pid
+    assert proc_stat.state in "RS"
+
+
+def test_stat_of_a_process_that_is_gone():
+    process = subprocess.Popen(["true"])
+    process.wait()
+    assert read_proc_stat(process.pid) is None
+    assert read_wchan(process.pid) is None
+
+
+def test_pipe_reader_is_blocked(child):
+    read_fd, write_fd = os.pipe()
+    try:
+        process = child(["cat"], stdin=read_fd, stdout=subprocess.DEVNULL, start_new_session=True)
+        wchan = []
+        assert wait_for(lambda: wchan.append(read_wchan(process.pid)) or is_blocking_wchan(wchan[-1])), wchan[-1]
+        assert [proc_stat.pid for proc_stat in session_processes({process.pid})] == [process.pid]
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+@pytest.mark.parametrize("wchan, blocking", [
+    ("pipe_read", True), ("anon_pipe_read", True), ("pipe_write", True), ("wait_for_partner", True), ("fifo_open", True),
+    ("do_msgrcv", True), ("do_msgsnd", True), ("hrtimer_nanosleep", False), (CHILD_WAIT_WCHAN, False), ("0", False), ("", False), (None, False),
+])
+def test_blocking_wait_channels(wchan, blocking):
+    assert is_blocking_wchan(wchan) == blocking
+
+
+# ------------------------------------------------------------------ #
+
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+SENDER = """
+import ctypes, os, struct, sys, time
+if sys.argv[2] == "fork" and os.fork():
+    time.sleep(30)  # The parent only waits, the forked child sends
+ctypes.CDLL(None).msgsnd(int(sys.argv[1]), struct.pack("l", 1) + b"x", 1, 0)
+time.sleep(30)
+"""
+
+libc = ctypes.CDLL(None, use_errno=True)
+needs_msg_queues = pytest.mark.skipif(not os.path.exists(SYSVIPC_MSG_PATH), reason="no System V message queues")
+
+
+@pytest.fixture
+def queues():
+    # Makes message queues, removes whatever the test left
+    made = []
+    def make(key=IPC_PRIVATE):
+        msqid = libc.msgget(key, IPC_CREAT | 0o600)
+        assert msqid >= 0, os.strerror(ctypes.get_errno())
+        made.append(msqid)
+        return msqid
+    yield make
+    for msqid in made:
+        libc.msgctl(msqid, IPC_RMID, None)
+
+
+@pytest.fixture
+def scopes():
+    # Opens scopes and closes the ones a test left open, so later tests start exclusive
+    opened = []
+    def open_scope(name, key_paths=()):
+        scope = MsgQueueScope(name, key_paths)
+        opened.append(scope)
+        return scope
+    yield open_scope
+    for scope in opened:
+        scope.cleanup()
+
+
+def ftok(path):
+    key = libc.ftok(path.encode(), ord('b'))
+    assert key != -1
+    return key
+
+
+@needs_msg_queues
+def test_queues_from_before_the_scope_are_never_touched(queues, scopes):
+    old = queues()
+    scope = scopes("alone")
+    assert scope.exclusive
+    assert old not in scope.owned_queues()
+    assert scope.cleanup() == []
+    assert old in list_msg_queues()
+
+
+@needs_msg_queues
+def test_unused_queue_goes_to_the_only_open_scope(queues, scopes):
+    scope = scopes("alone")
+    new = queues()
+    assert scope.group_queues() == []  # Nobody used it, it could be anybody's
+    assert scope.owned_queues() == [new]
+    assert scope.cleanup() == [new]
+    assert new not in list_msg_queues()
+
+
+@needs_msg_queues
+def test_used_queue_belongs_to_the_scope_of_its_user(queues, scopes, child):
+    ours, theirs = scopes("ours"), scopes("theirs")
+    assert not ours.exclusive and not theirs.exclusive
+    msqid = queues()
+    process = child([sys.executable, "-c", SENDER, str(msqid), "send"], start_new_session=True)
+    ours.track(process.pid)
+    assert wait_for(lambda: list_msg_queues()[msqid].lspid == process.pid)
+    assert ours.group_queues() == [msqid]
+    assert theirs.owned_queues() == []
+
+
+@needs_msg_queues
+def test_queue_used_by_a_forked_child_is_found_through_the_session(queues, scopes, child):
+    ours, other = scopes("ours"), scopes("other")
+    msqid = queues()
+    process = child([sys.executable, "-c", SENDER, str(msqid), "fork"], start_new_session=True)
+    ours.track(process.pid)
+    assert wait_for(lambda: list_msg_queues()[msqid].lspid not in (0, process.pid))
+    assert ours.group_queues() == [msqid]
+    assert list_msg_queues()[msqid].lspid in ours.pids
+    assert sweep_sessions([process.pid])[0] == 2
+
+
+@needs_msg_queues
+def test_unused_queue_with_our_key_is_not_claimed_by_a_group_without_keys(tmp_path, queues, scopes):
+    # ex4a (FIFOs only) runs next to ex4b, whose creator made a queue with ftok() of the shared scratch directory
+    fifo_group = scopes("ex4a")
+    queue_group = scopes("ex4b", [str(tmp_path)])
+    msqid = queues(ftok(str(tmp_path)))
+    assert list_msg_queues()[msqid].key & 0xffffff == ftok_suffix(str(tmp_path))
+    assert fifo_group.cleanup() == []
+    assert msqid in list_msg_queues()
+    assert queue_group.group_queues() == [msqid]
+    assert queue_group.cleanup() == [msqid]
+
+
+@needs_msg_queues
+def test_key_shared_by_two_open_scopes_is_claimed_by_neither(tmp_path, queues, scopes):
+    first = scopes("first", [str(tmp_path)])
+    second = scopes("second", [str(tmp_path)])
+    msqid = queues(ftok(str(tmp_path)))
+    assert first.group_queues() == [] and second.group_queues() == []
+    assert first.cleanup() == [] and second.cleanup() == []
+    assert msqid in list_msg_queues()
+
+
+def test_sweep_kills_the_session_and_what_it_forked(child):
+    process = child([sys.executable, "-c", "import os, time; os.fork(); time.sleep(30)"], start_new_session=True)
+    assert wait_for(lambda: len(session_processes({process.pid})) == 2)
+    killed, cpu_seconds = sweep_sessions([process.pid])
+    assert killed == 2
+    assert cpu_seconds >= 0
+    assert session_processes({process.pid}) == []
+    assert sweep_sessions([process.pid]) == (0, 0)
@@ -0,0 +1,85 @@
+import time
+import hashlib
+import pytest
+from results_store import ResultsStore, input_hash
+
+
+@pytest.fixture
+def store(tmp_path):
+    results_store = ResultsStore(str(tmp_path / "results.sqlite"))
+    yield results_store
+    results_store.close()
+
+
+@pytest.fixture
+def student(tmp_path):
+    path = tmp_path / "student"
+    path.mkdir()
+    (path / "ex4a1.c").write_text("int main(void) { return 0; }\n")
+    (path / "README.txt").write_text("name\n")
+    return path
+
+
+def test_input_hash_covers_sources_readme_and_settings(student):
+    before = input_hash(str(student), extra=(0, "valgrind"))
+    assert input_hash(str(student), extra=(0, "valgrind")) == before
+    (student / "notes.txt").write_text("not graded")
+    (student / "ex4a1").write_bytes(b"\x7fELF")
+    assert input_hash(str(student), extra=(0, "valgrind")) == before
+    assert input_hash(str(student), extra=(15, "valgrind")) != before
+    assert input_hash(str(student), extra=(0, "asan")) != before
+    (student / "README.txt").write_text("other name\n")
+    assert input_hash(str(student), extra=(0, "valgrind")) != before
+
+
+def test_manifest_hashes_are_used_for_files_not_changed_since(student):
+    content_hash = input_hash(str(student))
+    real = hashlib.sha256((student / "ex4a1.c").read_bytes()).hexdigest()
+    assert input_hash(str(student), {"ex4a1.c": real}, time.time() + 60) == content_hash
+    # A manifest hash older than the file is not trusted
+    assert input_hash(str(student), {"ex4a1.c": "stale"}, 0) == content_hash
+    assert input_hash(str(student), {"ex4a1.c": "stale"}, time.time() + 60) != content_hash
+
+
+def test_stored_result_is_current_only_for_the_same_hash_and_rubric(store):
+    assert store.lookup("s1") is None
+    assert not store.is_current("s1", "hash", 3)
+    store.save("s1", "hash", 3, True, {"grade": 90})
+    assert store.lookup("s1") == ("hash", 3, True, {"grade": 90})
+    assert store.is_current("s1", "hash", 3)
+    assert not store.is_current("s1", "other", 3)
+    assert not store.is_current("s1", "hash", 4)
+    store.save("s1", "hash", 3, False, {"summary": "error"})
+    assert not store.is_current("s1", "hash", 3)  # A student that failed to grade is graded again
+
+
+def test_runs(store):
+    assert store.unfinished_run() is None
+    first = store.start_run({"argv": []})
+    store.save("s1", "h", 3, True, {}, first)
+    store.save("s2", "h", 3, True, {}, first)
+    assert store.unfinished_run() == first
+    assert store.graded_in_run(first) == {"s1", "s2"}
+    store.finish_run(first)
+    assert store.unfinished_run() is None
+    second = store.start_run({"argv": ["--incremental"]})
+    store.save("s1", "h", 3, True, {}, second)
+    assert store.graded_in_run(first) == {"s2"}
+    assert store.unfinished_run() == second
+
+
+def test_rows_survive_reopening(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    first = ResultsStore(path)
+    first.save("דנה כהן", "h", 3, True, {"readme_content": ["דנה"]})
+    first.close()
+    second = ResultsStore(path)
+    assert second.lookup("דנה כהן")[3] == {"readme_content": ["דנה"]}
+    second.close()
+
+
+def test_runtimes_keep_the_latest(store):
+    store.save_runtimes([("ex4a1", float(seconds)) for seconds in range(5)] + [("ex4b1", 9.0)], 3)
+    store.save_runtimes([("ex4a1", 5.0)], 3)
+    assert store.load_runtimes(10) == {"ex4a1": [5.0, 4.0, 3.0], "ex4b1": [9.0]}
+    assert store.load_runtimes(2)["ex4a1"] == [5.0, 4.0]
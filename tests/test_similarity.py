@@ -0,0 +1,73 @@
+from results_store import ResultsStore
+from similarity import LshIndex, MinHasher, UnionFind, estimated_similarity, find_clusters, shingles, tokenize
+
+PROGRAM = """#include <stdio.h>
+/* Prints the primes up to a limit */
+int main(int argc, char *argv[]) {
+    int limit = 100;
+    for (int number = 2; number < limit; number++) {
+        int prime = 1;
+        for (int divisor = 2; divisor * divisor <= number; divisor++)
+            if (number % divisor == 0) prime = 0;
+        if (prime) printf("%d\\n", number);
+    }
+    return 0;
+}
+"""
+RENAMED = PROGRAM.replace("number", "n").replace("divisor", "d").replace("%d\\n", "prime %d\\n").replace("/* Prints", "// Shows")
+OTHER = """int sum(int *values, int count) {
+    int total = 0;
+    while (count-- > 0) total += *values++;
+    return total;
+}
+"""
+
+
+def test_tokenize_normalizes_names_literals_and_comments():
+    assert tokenize("#include <x.h>\nint a = 4; // c\nputs(\"hi\");") == ["int", "ID", "=", "NUM", ";", "ID", "(", "STR", ")", ";"]
+    assert tokenize(PROGRAM) == tokenize(RENAMED)
+
+
+def test_minhash_estimates_similarity():
+    hasher = MinHasher()
+    same = hasher.signature(shingles(tokenize(PROGRAM)))
+    assert same == hasher.signature(shingles(tokenize(RENAMED)))
+    assert estimated_similarity(same, hasher.signature(shingles(tokenize(OTHER)))) < 0.2
+
+
+def test_lsh_band_collisions():
+    index = LshIndex(bands=4)
+    assert index.add("a", [1, 2, 3, 4, 5, 6, 7, 8]) == set()
+    assert index.add("b", [9, 9, 9, 9, 9, 9, 7, 8]) == {"a"}  # Only the last band matches
+    assert index.add("c", [1, 2, 0, 0, 0, 0, 0, 0]) == {"a"}
+    assert index.add("d", [2, 1, 4, 3, 6, 5, 8, 7]) == set()  # Same values, but no band equal
+    assert index.add("e", [1, 2, 3, 4, 9, 9, 7, 8]) == {"a", "b", "c"}
+
+
+def test_union_find():
+    groups = UnionFind()
+    groups.union("a", "b")
+    groups.union("c", "b")
+    assert groups.find("a") == groups.find("c")
+    assert groups.find("d") != groups.find("a")
+
+
+def write_student(root, name, text):
+    path = root / name
+    path.mkdir()
+    (path / "ex4a1.c").write_text(text)
+    return str(path)
+
+
+def test_find_clusters_uses_the_cache(tmp_path):
+    students = {name: write_student(tmp_path, name, text) for name, text in (("s1", PROGRAM), ("s2", RENAMED), ("s3", OTHER))}
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    try:
+        clusters = find_clusters(students, store)
+        assert [members for members, pairs in clusters] == [["s1", "s2"]]
+        assert clusters[0][1][0][2] == 1.0
+        # A later submission is compared with the cached signatures of everyone before it
+        late = {"s4": write_student(tmp_path, "s4", PROGRAM.replace("limit", "top"))}
+        assert [members for members, pairs in find_clusters(late, store)] == [["s1", "s2", "s4"]]
+    finally:
+        store.close()
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+import pytest
+import supervisor
+from procfs import ProcStat
+from supervisor import DeadlockDetector
+
+
+def proc(pid, name, state='S', cpu_ticks=0):
+    return ProcStat(pid, state, 1, pid, pid, cpu_ticks, name)
+
+
+def result(output_bytes=0):
+    capture = SimpleNamespace(total=output_bytes)
+    return SimpleNamespace(stdout_capture=capture, stderr_capture=SimpleNamespace(total=0))
+
+
+@pytest.fixture
+def wchans(monkeypatch):
+    # pid -> wait channel the detector reads
+    channels = {}
+    monkeypatch.setattr(supervisor, "read_wchan", channels.get)
+    return channels
+
+
+def test_blocked_group_is_deadlocked_after_the_window(wchans):
+    wchans.update({10: "pipe_read", 11: "wait_for_partner"})
+    detector = DeadlockDetector(5)
+    processes = [proc(10, "ex4a1"), proc(11, "ex4a2")]
+    assert not detector.sample([result()], processes, 100)
+    assert not detector.sample([result()], processes, 104.9)
+    assert detector.sample([result()], processes, 105)
+    assert detector.describe() == "ex4a1 in pipe_read, ex4a2 in wait_for_partner"
+
+
+def test_running_process_resets_the_window(wchans):
+    wchans.update({10: "pipe_read", 11: "pipe_read"})
+    detector = DeadlockDetector(5)
+    assert not detector.sample([], [proc(10, "a"), proc(11, "b")], 100)
+    assert not detector.sample([], [proc(10, "a"), proc(11, "b", state='R')], 103)
+    assert not detector.sample([], [proc(10, "a"), proc(11, "b")], 106)
+    assert detector.sample([], [proc(10, "a"), proc(11, "b")], 111)
+
+
+def test_cpu_time_and_output_are_progress(wchans):
+    wchans.update({10: "do_msgrcv"})
+    detector = DeadlockDetector(5)
+    assert not detector.sample([result(0)], [proc(10, "a", cpu_ticks=1)], 100)
+    assert not detector.sample([result(0)], [proc(10, "a", cpu_ticks=2)], 106)  # Used CPU since the last sample
+    assert not detector.sample([result(7)], [proc(10, "a", cpu_ticks=2)], 112)  # Printed since the last sample
+    assert detector.sample([result(7)], [proc(10, "a", cpu_ticks=2)], 117)
+
+
+def test_parent_waiting_for_a_blocked_child(wchans):
+    wchans.update({10: supervisor.CHILD_WAIT_WCHAN, 11: "pipe_read"})
+    detector = DeadlockDetector(1)
+    processes = [proc(10, "parent"), proc(11, "child")]
+    detector.sample([], processes, 0)
+    assert detector.sample([], processes, 1)
+    assert detector.describe() == "child in pipe_read"
+
+
+def test_only_waiting_parents_or_other_sleeps_are_no_deadlock(wchans):
+    wchans.update({10: supervisor.CHILD_WAIT_WCHAN, 11: "hrtimer_nanosleep"})
+    detector = DeadlockDetector(1)
+    assert not detector.sample([], [proc(10, "parent")], 0)
+    assert not detector.sample([], [proc(10, "parent")], 5)
+    assert not detector.sample([], [proc(11, "sleeper")], 10)
+    assert not detector.sample([], [proc(11, "sleeper")], 20)
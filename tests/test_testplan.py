@@ -0,0 +1,79 @@
+import threading
+import time
+import pytest
+import testplan
+from testplan import GroupPlan, run_plan, load_plan
+
+
+def group(name, resources=(), depends_on=()):
+    return GroupPlan({"name": name, "steps": [{"program": name}], "resources": list(resources), "depends_on": list(depends_on)})
+
+
+class Recorder:
+    # run_group that notes which groups overlapped
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.running = set()
+        self.overlaps = set()
+        self.order = []
+
+    def __call__(self, plan_group):
+        with self.lock:
+            for other in self.running:
+                self.overlaps.add(frozenset((other, plan_group.name)))
+            self.running.add(plan_group.name)
+            self.order.append(plan_group.name)
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running.discard(plan_group.name)
+        return plan_group.name.upper()
+
+
+def test_groups_sharing_a_resource_never_overlap():
+    groups = [group("a", ["msgqueue"]), group("b", ["msgqueue"]), group("c", ["fifo:fifom"])]
+    recorder = Recorder()
+    results = run_plan(groups, recorder, max_parallel=3)
+    assert results == {"a": "A", "b": "B", "c": "C"}
+    assert frozenset(("a", "b")) not in recorder.overlaps
+    assert frozenset(("a", "c")) in recorder.overlaps
+
+
+def test_dependencies_finish_first():
+    groups = [group("late", depends_on=["early"]), group("early")]
+    recorder = Recorder(0.01)
+    run_plan(groups, recorder, max_parallel=2)
+    assert recorder.order == ["early", "late"]
+
+
+def test_group_that_can_never_start():
+    with pytest.raises(RuntimeError):
+        run_plan([group("a", depends_on=["missing"])], Recorder(0), max_parallel=2)
+
+
+def test_cycle_is_rejected():
+    data = {"sources": {}, "groups": [
+        {"name": "a", "steps": [{"program": "a"}], "depends_on": ["b"]},
+        {"name": "b", "steps": [{"program": "b"}], "depends_on": ["a"]},
+    ]}
+    with pytest.raises(ValueError, match="cycle"):
+        testplan.TestPlan(data)
+
+
+def test_unknown_dependency_is_rejected():
+    data = {"sources": {}, "groups": [{"name": "a", "steps": [{"program": "a"}], "depends_on": ["b"]}]}
+    with pytest.raises(ValueError, match="unknown"):
+        testplan.TestPlan(data)
+
+
+def test_default_plan_loads():
+    plan = load_plan()
+    assert plan.name == "ex4"
+    assert [g.name for g in plan.groups] == ["ex4a", "ex4b", "ex4c"]
+
+
+def test_queue_group_has_to_hold_the_msgqueue_resource():
+    data = {"name": "b", "steps": [{"program": "b1", "ready": {"msgqueue": True}}]}
+    with pytest.raises(ValueError, match="msgqueue"):
+        GroupPlan(data)
+    assert GroupPlan(dict(data, resources=["msgqueue"])).resources == {"msgqueue"}
@@ -0,0 +1,30 @@
+from timeouts import MIN_BUDGET, MIN_SAMPLES, TimeoutPolicy, learned_budget
+
+
+def test_p99_of_the_clean_runs():
+    runs = [1.0] * 99 + [4.0]
+    assert learned_budget(runs) == 3.0  # Nearest-rank p99 of 100 runs is the 99th, 1.0 * 2 + 1
+    assert learned_budget(runs + [4.0]) == 9.0
+
+
+def test_never_below_the_minimum():
+    assert learned_budget([0.01] * 50) == MIN_BUDGET
+
+
+def test_fixed_budget_is_the_cap():
+    policy = TimeoutPolicy({"ex4a1": [10.0] * MIN_SAMPLES, "ex4b1": [0.5] * MIN_SAMPLES}, adaptive=True)
+    assert policy.budget("ex4a1", 12) == 12
+    assert policy.budget("ex4b1", 12) == 2.0
+
+
+def test_too_few_runs_keep_the_fixed_budget():
+    policy = TimeoutPolicy({"ex4a1": [0.5] * (MIN_SAMPLES - 1)}, adaptive=True)
+    assert policy.budget("ex4a1", 120) == 120
+    assert policy.budget("unknown", 120) == 120
+    assert policy.describe() == []
+
+
+def test_not_adaptive():
+    policy = TimeoutPolicy({"ex4a1": [0.5] * MIN_SAMPLES})
+    assert policy.budget("ex4a1", 120) == 120
+    assert policy.describe() == ["ex4a1: 2.00s from 20 runs"]
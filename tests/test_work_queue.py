@@ -0,0 +1,57 @@
+import pytest
+from work_queue import MAX_ATTEMPTS, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    work_queue = WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds=60)
+    work_queue.fill("run1", {"memcheck": "asan"}, ["s1", "s2"])
+    yield work_queue
+    work_queue.close()
+
+
+def test_claims_in_order(queue):
+    assert queue.run() == ("run1", {"memcheck": "asan"})
+    assert queue.claim("w1") == ("s1", None, 1)
+    assert queue.claim("w2") == ("s2", None, 1)
+    assert queue.claim("w1") is None
+    assert queue.complete("s1", "w1")
+    assert not queue.complete("s2", "w1")  # Leased by w2
+    assert queue.counts() == {"done": 1, "leased": 1}
+
+
+def test_expired_lease_goes_to_the_next_worker(queue):
+    queue.lease_seconds = -1  # Every lease is expired as soon as it is taken
+    assert queue.claim("w1") == ("s1", None, 1)
+    assert queue.claim("w2") == ("s1", "w1", 2)
+    assert not queue.complete("s1", "w1")
+
+
+def test_failed_after_max_attempts(queue):
+    queue.lease_seconds = -1
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        assert queue.claim(f"w{attempt}") == ("s1", f"w{attempt - 1}" if attempt > 1 else None, attempt)
+    assert queue.claim("next") == ("s2", None, 1)  # s1 lost MAX_ATTEMPTS leases and is given up
+    assert queue.failed() == [("s1", f"w{MAX_ATTEMPTS}", MAX_ATTEMPTS)]
+    assert queue.counts() == {"failed": 1, "pending": 1}  # s2 lost only one lease
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    queue.claim("w1")
+    queue.claim("w1")
+    assert queue.heartbeat("w1") == 2
+    assert queue.heartbeat("w2") == 0
+    assert queue.counts() == {"leased": 2}
+
+
+def test_cancel_pending(queue):
+    queue.claim("w1")
+    assert queue.cancel_pending() == 1
+    assert queue.counts() == {"leased": 1}
+
+
+def test_fill_replaces_the_old_run(queue):
+    queue.claim("w1")
+    queue.fill("run2", {}, ["s3"])
+    assert queue.run() == ("run2", {})
+    assert queue.counts() == {"pending": 1}
@@ -0,0 +1,60 @@
+import logging
+import threading
+from summarize import percentile
+
+PERCENTILE = 0.99
+MARGIN_FACTOR = 2.0  # Budget = PERCENTILE of the clean runs * MARGIN_FACTOR + MARGIN_SECONDS...
+MARGIN_SECONDS = 1.0
+MIN_BUDGET = 2.0  # ...but never below this, a loaded machine starts programs slower
+MIN_SAMPLES = 20  # Fewer clean runs than this keep the fixed budget
+HISTORY_SIZE = 2000  # Latest clean runs kept per program in the results store
+
+# ------------------------------------------------------------------ #
+
+class TimeoutPolicy:
+    """Time budgets per program learned from how long earlier runs took.
+
+    history maps a program key ("ex4a1", "valgrind ex4a1", ...) to the wall
+    seconds of its recent clean runs, the ones that exited on their own. With
+    adaptive on, a program's budget is learned from them but never exceeds
+    the fixed budget it replaces, which stays the hard cap. Budgets are
+    computed once from the history the batch starts with, so every student
+    of a batch gets the same ones; the runs of this batch only count for the
+    next one.
+    """
+
+    def __init__(self, history, adaptive=False):
+        self.adaptive = adaptive
+        self.lock = threading.Lock()
+        self.samples = []  # (key, seconds) of the clean runs of this batch, to be stored
+        self.learned = {key: learned_budget(seconds) for key, seconds in history.items() if len(seconds) >= MIN_SAMPLES}
+        self.history_sizes = {key: len(seconds) for key, seconds in history.items()}
+
+    def budget(self, key, fixed):
+        if not self.adaptive or key not in self.learned:
+            return fixed
+        return min(fixed, self.learned[key])
+
+    def record(self, key, seconds):
+        with self.lock:
+            self.samples.append((key, seconds))
+
+    def describe(self):
+        # One line per learned budget, for the log at the start of a batch
+        return [f"{key}: {budget:.2f}s from {self.history_sizes[key]} runs" for key, budget in sorted(self.learned.items())]
+
+def learned_budget(seconds):
+    return max(MIN_BUDGET, percentile(seconds, PERCENTILE) * MARGIN_FACTOR + MARGIN_SECONDS)
+
+def load_policy(results_store, adaptive):
+    policy = TimeoutPolicy(results_store.load_runtimes(HISTORY_SIZE), adaptive)
+    if adaptive:
+        logging.info(f"Adaptive timeout budgets: {', '.join(policy.describe()) or 'none learned yet'}")
+    return policy
+
+def save_samples(results_store, policy):
+    # Stores the clean runs of the batch for the next one, the oldest beyond HISTORY_SIZE are dropped
+    with policy.lock:
+        samples, policy.samples = policy.samples, []
+    if samples:
+        results_store.save_runtimes(samples, HISTORY_SIZE)
@@ -0,0 +1,112 @@
+import json
+import time
+import threading
+import functools
+import contextlib
+
+GRADER_PID = 0  # Trace "process" of the spans that belong to no student
+
+# ------------------------------------------------------------------ #
+
+class Tracer:
+    """Timed spans of the grading work, per student and per thread.
+
+    Totals per student and per span name are always kept, for the table
+    printed after the statistics. The spans themselves are only kept as
+    Chrome trace events once record_events() was called (--trace), so a batch
+    without it does not grow a list per span. In the trace every student is a
+    process and every thread (or student program) one of its tracks.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Span depth of the current thread
+        self.origin = time.time()
+        self.events = None
+        self.student_pids = {}
+        self.named_tracks = set()
+        self.student_seconds = {}
+        self.phases = {}  # Span name -> [count, total seconds, longest]
+
+    def record_events(self):
+        self.events = [{"name": "process_name", "ph": "M", "pid": GRADER_PID, "args": {"name": "grader"}}]
+
+    @contextlib.contextmanager
+    def span(self, name, student=None, nested=False, **args):
+        """Times the with block.
+
+        The outermost span of a thread counts towards the student's total;
+        nested marks spans run on a helper thread on behalf of a span the
+        student already has open (valgrind and test group pools), so that
+        time is not counted twice.
+        """
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            self.add(name, start, time.time(), student, counted=depth == 0 and not nested, **args)
+
+    def add(self, name, start, end, student=None, track=None, track_name=None, counted=False, **args):
+        # Records a finished span; track/track_name put it on its own row instead of the current thread's
+        with self.lock:
+            phase = self.phases.setdefault(name, [0, 0.0, 0.0])
+            phase[0] += 1
+            phase[1] += end - start
+            phase[2] = max(phase[2], end - start)
+            if counted and student is not None:
+                self.student_seconds[student] = self.student_seconds.get(student, 0.0) + end - start
+            if self.events is None:
+                return
+            pid = self.student_pid(student)
+            if track is None:
+                track, track_name = threading.get_ident(), threading.current_thread().name
+            if (pid, track) not in self.named_tracks:
+                self.named_tracks.add((pid, track))
+                self.events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": track, "args": {"name": track_name}})
+            self.events.append({"name": name, "ph": "X", "pid": pid, "tid": track, "ts": round((start - self.origin) * 1e6),
+                                "dur": round((end - start) * 1e6), "args": args})
+
+    def student_pid(self, student):
+        # Called with the lock held
+        if student is None:
+            return GRADER_PID
+        if student not in self.student_pids:
+            self.student_pids[student] = len(self.student_pids) + 1
+            self.events.append({"name": "process_name", "ph": "M", "pid": self.student_pids[student], "args": {"name": student}})
+        return self.student_pids[student]
+
+    def write(self, path):
+        # Chrome trace JSON, opens in chrome://tracing and ui.perfetto.dev
+        with self.lock:
+            with open(path, 'w') as f:
+                json.dump({"traceEvents": self.events or [], "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+    def print_top(self, count):
+        with self.lock:
+            students = sorted(self.student_seconds.items(), key=lambda item: item[1], reverse=True)[:count]
+            phases = sorted(self.phases.items(), key=lambda item: item[1][1], reverse=True)[:count]
+        print(f"----- Slowest students (top {count}) -----")
+        for student, seconds in students:
+            print(f"{seconds:10.2f}s  {student}")
+        print(f"----- Slowest phases (top {count}) -----")
+        for name, (spans, total, longest) in phases:
+            print(f"{total:10.2f}s  {name}: {spans} spans, longest {longest:.2f}s")
+        print("--------------------------------\n")
+
+tracer = Tracer()
+
+def traced(name, nested=False, describe=None):
+    """Decorator for Student methods: every call is a span of self.student_dir.
+
+    describe gets the call's arguments and returns the span's args.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with tracer.span(name, self.student_dir, nested, **(describe(*args, **kwargs) if describe else {})):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,129 @@
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+
+LEASE_SECONDS = 60  # A lease not renewed for this long belongs to a dead worker
+MAX_ATTEMPTS = 3  # Leases a student may lose before it is given up, so one submission cannot kill every worker
+
+# ------------------------------------------------------------------ #
+
+class WorkQueue:
+    """Durable SQLite queue of the students a coordinator hands out to workers.
+
+    The coordinator fills the queue with the students of one run together
+    with the options the workers grade them with. A worker claims a
+    student by taking a lease and renews all its leases with heartbeats;
+    when a worker dies its leases run out and the next claim hands the
+    student to another worker. Every change is one IMMEDIATE transaction, so
+    any number of worker processes, on this host or on others that see the
+    same file, can share the queue.
+    """
+
+    def __init__(self, db_path, lease_seconds=LEASE_SECONDS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        # Transactions are begun by hand; the timeout waits out other processes holding the write lock
+        self.connection = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.transaction():
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS queue (
+                    student_dir TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )""")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def fill(self, run_id, options, student_dirs):
+        # Replaces whatever an earlier run left with student_dirs, in order
+        with self.transaction():
+            self.connection.execute("DELETE FROM queue")
+            self.connection.executemany("INSERT INTO queue (student_dir, position, state) VALUES (?, ?, 'pending')",
+                                        [(student_dir, position) for position, student_dir in enumerate(student_dirs)])
+            self.connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('run', ?)",
+                                    (json.dumps({"run_id": run_id, "options": options}),))
+
+    def run(self):
+        # (run id, grading options) of the queued run, or None before a coordinator filled the queue
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM settings WHERE key = 'run'").fetchone()
+        if row is None:
+            return None
+        run = json.loads(row[0])
+        return run["run_id"], run["options"]
+
+    def claim(self, worker):
+        """Leases the next pending student to worker.
+
+        Expired leases are returned to the queue first, or marked failed after
+        MAX_ATTEMPTS. Returns (student_dir, previous worker, attempt) or None
+        when nothing is pending.
+        """
+        now = time.time()
+        with self.transaction():
+            self.expire(now)
+            row = self.connection.execute("SELECT student_dir, worker, attempts FROM queue WHERE state = 'pending' ORDER BY position LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE queue SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE student_dir = ?",
+                                    (worker, now + self.lease_seconds, row[0]))
+        return row[0], row[1], row[2] + 1
+
+    def expire(self, now):
+        # Called inside a transaction
+        self.connection.execute("UPDATE queue SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END "
+                                "WHERE state = 'leased' AND lease_expires < ?", (MAX_ATTEMPTS, now))
+
+    def heartbeat(self, worker):
+        # Renews every lease worker holds, returns how many
+        with self.transaction():
+            cursor = self.connection.execute("UPDATE queue SET lease_expires = ? WHERE state = 'leased' AND worker = ?",
+                                             (time.time() + self.lease_seconds, worker))
+        return cursor.rowcount
+
+    def complete(self, student_dir, worker):
+        # False when the lease ran out and the student went to another worker meanwhile
+        with self.transaction():
+            cursor = self.connection.execute("UPDATE queue SET state = 'done', lease_expires = NULL WHERE student_dir = ? AND state = 'leased' AND worker = ?",
+                                             (student_dir, worker))
+        return cursor.rowcount == 1
+
+    def cancel_pending(self):
+        # Takes the students no worker holds off the queue, returns how many
+        with self.transaction():
+            cursor = self.connection.execute("DELETE FROM queue WHERE state = 'pending'")
+        return cursor.rowcount
+
+    def counts(self):
+        # {state: students}, after returning expired leases to the queue
+        with self.transaction():
+            self.expire(time.time())
+            return dict(self.connection.execute("SELECT state, COUNT(*) FROM queue GROUP BY state").fetchall())
+
+    def failed(self):
+        # [(student_dir, last worker, attempts)] of the students given up on
+        with self.lock:
+            return self.connection.execute("SELECT student_dir, worker, attempts FROM queue WHERE state = 'failed' ORDER BY position").fetchall()
+
+    def close(self):
+        self.connection.close()